@@ -12,6 +12,7 @@ from isamples_metadata.Transformer import (
     Transformer, Keyword,
 )
 from isamples_metadata.metadata_constants import METADATA_LABEL, METADATA_AUTHORIZED_BY, METADATA_COMPLIES_WITH, METADATA_RELATIONSHIP, METADATA_TARGET
+from isamples_metadata.taxonomy.taxonomy_index import TaxonomyIndex
 from isamples_metadata.vocabularies import vocabulary_mapper
 
 PERMIT_STRINGS_TO_IGNORE = ['nan', 'na', 'no data', 'unknown', 'none_required']
@@ -30,19 +31,24 @@ class GEOMETransformer(Transformer):
     """Concrete transformer class for going from a GEOME record to an iSamples record"""
 
     def __init__(
-        self, source_record: typing.Dict, last_updated_time: Optional[datetime.datetime] = None, session: Optional[Session] = None
+        self,
+        source_record: typing.Dict,
+        last_updated_time: Optional[datetime.datetime] = None,
+        session: Optional[Session] = None,
+        taxonomy_index: Optional[TaxonomyIndex] = None,
     ):
         super().__init__(source_record)
         self._child_transformers = []
         self._last_updated_time = last_updated_time
         self._session = session
+        self._taxonomy_index = taxonomy_index
         children = self._get_children()
         for child_record in children:
             entity = child_record.get("entity")
             if entity == TISSUE_ENTITY:
                 self._child_transformers.append(
                     GEOMEChildTransformer(
-                        source_record, child_record, last_updated_time, session
+                        source_record, child_record, last_updated_time, session, taxonomy_index
                     )
                 )
 
@@ -143,6 +149,22 @@ class GEOMETransformer(Transformer):
 
         return Transformer.DESCRIPTION_SEPARATOR.join(description_pieces)
 
+    # Taxonomic ranks of the main record to resolve the kingdom from, most specific last
+    KINGDOM_RANKS = ["kingdom", "phylum", "genus"]
+
+    def kingdom(self) -> Optional[str]:
+        """The biological kingdom of the first of the record's ranks known to the taxonomy index, if there is one"""
+        if self._taxonomy_index is None:
+            return None
+        main_record = self._source_record_main_record()
+        for rank in self.KINGDOM_RANKS:
+            value = main_record.get(rank)
+            if value is not None and value != "unidentified":
+                kingdom = self._taxonomy_index.kingdom(value)
+                if kingdom is not None:
+                    return kingdom
+        return None
+
     def has_context_categories(self) -> list:
         # TODO: resolve https://github.com/isamplesorg/isamples_inabox/issues/312
         # This should probably return the biological kingdom once that is hooked into the vocabulary
@@ -555,12 +577,14 @@ class GEOMEChildTransformer(GEOMETransformer):
         source_record: typing.Dict,
         child_record: typing.Dict,
         last_updated_time: Optional[datetime.datetime],
-        session: Optional[Session] = None
+        session: Optional[Session] = None,
+        taxonomy_index: Optional[TaxonomyIndex] = None,
     ):
         self.source_record = source_record
         self.child_record = child_record
         self._last_updated_time = last_updated_time
         self._session = session
+        self._taxonomy_index = taxonomy_index
 
     def _id_minus_prefix(self) -> str:
         return self.child_record["bcid"].removeprefix(self.ARK_PREFIX)
@@ -3,6 +3,7 @@ import typing
 from typing import Optional
 
 import h3
+import h3.api.basic_int
 
 from isamples_metadata.metadata_constants import METADATA_SAMPLE_IDENTIFIER, METADATA_SCHEMA, METADATA_AT_ID, METADATA_LABEL, METADATA_DESCRIPTION, \
     METADATA_HAS_CONTEXT_CATEGORY, METADATA_HAS_CONTEXT_CATEGORY_CONFIDENCE, METADATA_HAS_MATERIAL_CATEGORY, METADATA_HAS_MATERIAL_CATEGORY_CONFIDENCE, \
@@ -38,6 +39,10 @@ class Transformer(ABC):
 
     DEFAULT_H3_RESOLUTION = 15
 
+    # Bump whenever a change alters the output of any transformer, so that cached transforms made by older code aren't
+    # reused (see isb_lib.transform_cache)
+    VERSION = 1
+
     @staticmethod
     def _transform_key_to_label(
         key: str,
@@ -367,6 +372,7 @@ class AbstractCategoryMapper(ABC):
 
 class AbstractCategoryMetaMapper(ABC):
     _categoriesMappers: list[AbstractCategoryMapper] = []
+    _compiledMappers: "CompiledCategoryMappers"
 
     @classmethod
     def categories(
@@ -376,10 +382,7 @@ class AbstractCategoryMetaMapper(ABC):
     ) -> list[VocabularyTerm]:
         categories: list[VocabularyTerm] = []
         if source_category is not None:
-            for mapper in cls._categoriesMappers:
-                mapper.append_if_matched(
-                    source_category, auxiliary_source_category, categories
-                )
+            categories = cls._compiledMappers.categories(source_category, auxiliary_source_category)
         if len(categories) == 0:
             categories.append(VocabularyTerm(None, Transformer.NOT_PROVIDED, None))
         return categories
@@ -390,6 +393,7 @@ class AbstractCategoryMetaMapper(ABC):
 
     def __init_subclass__(cls, **kwargs):
         cls._categoriesMappers = cls.categories_mappers()
+        cls._compiledMappers = CompiledCategoryMappers(cls._categoriesMappers)
 
 
 class StringConstantCategoryMapper(AbstractCategoryMapper):
@@ -456,18 +460,37 @@ class StringOrderedCategoryMapper(AbstractCategoryMapper):
     def __init__(self, submappers: typing.List[AbstractCategoryMapper]):
         self._submappers = submappers
 
-    def matches(
+    @property
+    def submappers(self) -> typing.List[AbstractCategoryMapper]:
+        return self._submappers
+
+    def matching_mapper(
         self,
         potential_match: str,
         auxiliary_match: typing.Optional[str] = None,
-    ) -> bool:
+    ) -> typing.Optional[AbstractCategoryMapper]:
         for mapper in self._submappers:
             if mapper.matches(potential_match, auxiliary_match):
-                # Note that this isn't thread-safe -- we expect one of these objects per thread
-                self.destination = mapper.destination
-                self.controlled_vocabulary = mapper.controlled_vocabulary
-                return True
-        return False
+                return mapper
+        return None
+
+    def matches(
+        self,
+        potential_match: str,
+        auxiliary_match: typing.Optional[str] = None,
+    ) -> bool:
+        return self.matching_mapper(potential_match, auxiliary_match) is not None
+
+    def append_if_matched(
+        self,
+        potential_match: str,
+        auxiliary_match: typing.Optional[str] = None,
+        categories_list: typing.List[VocabularyTerm] = list(),
+    ):
+        # The destination is the matching submapper's, so look it up rather than storing it on this shared instance
+        mapper = self.matching_mapper(potential_match, auxiliary_match)
+        if mapper is not None and mapper.destination != NOT_PROVIDED:
+            categories_list.append(mapper.controlled_vocabulary.term_for_label(mapper.destination))
 
 
 class StringPairedCategoryMapper(AbstractCategoryMapper):
@@ -498,6 +521,98 @@ class StringPairedCategoryMapper(AbstractCategoryMapper):
         )
 
 
+def _category_mapper_term(mapper: AbstractCategoryMapper) -> typing.Optional[VocabularyTerm]:
+    if mapper.destination == NOT_PROVIDED:
+        return None
+    return mapper.controlled_vocabulary.term_for_label(mapper.destination)
+
+
+class CompiledCategoryMappers:
+    """A lookup index over an ordered list of category mappers, compiled once.
+
+    categories() returns exactly what calling append_if_matched on each of the mappers in turn would.  Instead of
+    testing every mapper, the input is normalized once and the matching equality, ends with and paired mappers are
+    found with dictionary lookups -- ends with mappers are indexed by suffix, so there's one lookup per distinct suffix
+    length.  Ordered mappers get an index of their own, and any other kind of mapper falls back to calling matches().
+    Nothing is modified after construction, so instances are safe to share between threads.
+    """
+
+    def __init__(self, mappers: typing.List[AbstractCategoryMapper]):
+        self._mappers = mappers
+        # Each of these maps a normalized input to the positions of the mappers it matches, in order
+        self._equals: dict[str, list[int]] = {}
+        self._ends_with: dict[str, list[int]] = {}
+        self._pairs: dict[tuple[str, str], list[int]] = {}
+        self._always: list[int] = []
+        self._ordered: list[tuple[int, CompiledCategoryMappers]] = []
+        self._other: list[int] = []
+        self._terms: list[typing.Optional[VocabularyTerm]] = []
+        for position, mapper in enumerate(mappers):
+            self._add_mapper(position, mapper)
+        self._ends_with_lengths = sorted({len(suffix) for suffix in self._ends_with})
+
+    def _add_mapper(self, position: int, mapper: AbstractCategoryMapper):
+        self._terms.append(None)
+        if isinstance(mapper, StringOrderedCategoryMapper):
+            self._ordered.append((position, CompiledCategoryMappers(mapper.submappers)))
+            return
+        if isinstance(mapper, StringConstantCategoryMapper):
+            self._always.append(position)
+        elif isinstance(mapper, StringEqualityCategoryMapper):
+            for category in dict.fromkeys(mapper._categories):
+                self._equals.setdefault(category, []).append(position)
+        elif isinstance(mapper, StringEndsWithCategoryMapper):
+            self._ends_with.setdefault(mapper._endsWith, []).append(position)
+        elif isinstance(mapper, StringPairedCategoryMapper):
+            self._pairs.setdefault((mapper._primaryMatch, mapper._auxiliaryMatch), []).append(position)
+        else:
+            self._other.append(position)
+            return
+        self._terms[position] = _category_mapper_term(mapper)
+
+    def _matches(
+        self,
+        potential_match: str,
+        auxiliary_match: typing.Optional[str],
+    ) -> list[tuple[int, typing.Optional[VocabularyTerm]]]:
+        """Returns (position, term) of every matching mapper in order.  The term is None for mappers that match but
+        don't contribute a category."""
+        normalized = potential_match.lower().strip()
+        positions = self._always + self._equals.get(normalized, [])
+        for length in self._ends_with_lengths:
+            if length > len(normalized):
+                break
+            positions.extend(self._ends_with.get(normalized[len(normalized) - length:], []))
+        if auxiliary_match is not None:
+            positions.extend(self._pairs.get((normalized, auxiliary_match.lower().strip()), []))
+        matches = [(position, self._terms[position]) for position in positions]
+        for position, submappers in self._ordered:
+            first_match = submappers.first_match(potential_match, auxiliary_match)
+            if first_match is not None:
+                matches.append((position, first_match[1]))
+        for position in self._other:
+            mapper = self._mappers[position]
+            if mapper.matches(potential_match, auxiliary_match):
+                matches.append((position, _category_mapper_term(mapper)))
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+    def first_match(
+        self,
+        potential_match: str,
+        auxiliary_match: typing.Optional[str] = None,
+    ) -> typing.Optional[tuple[int, typing.Optional[VocabularyTerm]]]:
+        matches = self._matches(potential_match, auxiliary_match)
+        return matches[0] if len(matches) > 0 else None
+
+    def categories(
+        self,
+        potential_match: str,
+        auxiliary_match: typing.Optional[str] = None,
+    ) -> list[VocabularyTerm]:
+        return [term for _, term in self._matches(potential_match, auxiliary_match) if term is not None]
+
+
 class Keyword(dict):
     """Keyword for inclusion in the iSamples keywords metadata key"""
     def __init__(self, value: str, uri: Optional[str] = None, scheme: Optional[str] = None):
@@ -522,3 +637,50 @@ def geo_to_h3(latitude: typing.Optional[float], longitude: typing.Optional[float
         return h3.latlng_to_cell(latitude, longitude, resolution)
     else:
         return None
+
+
+H3_MAX_RESOLUTION = 15
+# H3 indexes are 64 bit integers with the resolution in bits 52-55, followed by one 3 bit digit per resolution.  The
+# parent at a resolution is the same index with the resolution replaced and every finer digit set to 7 (unused).
+_H3_RESOLUTION_OFFSET = 52
+_H3_RESOLUTION_MASK = 0xF << _H3_RESOLUTION_OFFSET
+_H3_PARENT_BITS = [
+    (resolution << _H3_RESOLUTION_OFFSET) | ((1 << ((H3_MAX_RESOLUTION - resolution) * 3)) - 1)
+    for resolution in range(0, H3_MAX_RESOLUTION + 1)
+]
+
+
+def _h3_cell_with_parents(cell: int) -> list[str]:
+    cleared_cell = cell & ~_H3_RESOLUTION_MASK
+    return [format(cleared_cell | parent_bits, "x") for parent_bits in _H3_PARENT_BITS]
+
+
+def geo_to_h3_all_resolutions(latitude: typing.Optional[float], longitude: typing.Optional[float]) -> typing.Optional[list[str]]:
+    """Returns the h3 cells for the point at every resolution from 0 through H3_MAX_RESOLUTION, indexed by resolution.
+
+    Only the finest cell is computed from the coordinates; the coarser cells are its ancestors.  This guarantees the
+    cells nest, but since H3 cells only approximately contain their children, a coarse cell near a cell boundary may
+    differ from geo_to_h3 at that resolution.
+    """
+    if latitude is not None and longitude is not None:
+        return _h3_cell_with_parents(h3.api.basic_int.latlng_to_cell(latitude, longitude, H3_MAX_RESOLUTION))
+    else:
+        return None
+
+
+def geo_to_h3_all_resolutions_batch(
+    coordinates: typing.Iterable[tuple[typing.Optional[float], typing.Optional[float]]]
+) -> list[typing.Optional[list[str]]]:
+    """Batch variant of geo_to_h3_all_resolutions, for computing the h3 columns of a whole page of records at once.
+
+    Args:
+        coordinates: (latitude, longitude) tuples
+
+    Returns: A list parallel to coordinates, containing the cells at every resolution or None for missing coordinates
+    """
+    latlng_to_cell = h3.api.basic_int.latlng_to_cell
+    return [
+        _h3_cell_with_parents(latlng_to_cell(latitude, longitude, H3_MAX_RESOLUTION))
+        if latitude is not None and longitude is not None else None
+        for latitude, longitude in coordinates
+    ]
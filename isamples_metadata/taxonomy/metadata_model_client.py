@@ -1,6 +1,13 @@
-import functools
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
 import json
-from typing import Any
+import logging
+import queue
+import threading
+import time
+from typing import Any, Optional
 
 import requests
 
@@ -22,16 +29,206 @@ class PredictionResult:
         self.confidence = confidence
 
 
+class _PendingRequest:
+    def __init__(self, url: str, data_params: dict, model_type: str):
+        self.url = url
+        self.data_params = data_params
+        self.data_params_bytes: bytes = json.dumps(data_params).encode("utf-8")
+        self.model_type = model_type
+        # The request body with its keys in a stable order, used to look up stored predictions
+        normalized_bytes = json.dumps(data_params, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        self.input_hash = hashlib.sha256(normalized_bytes).hexdigest()
+        self.future: concurrent.futures.Future = concurrent.futures.Future()
+
+
+class PredictionBatcher:
+    """Coalesces model server requests made concurrently from several threads into batched requests.
+
+    A background thread waits for the first pending request, then collects more until it has max_batch_size of them or
+    max_wait_seconds have passed.  The collected requests are grouped by endpoint and model type, and each group is
+    sent as a single POST of the list of request bodies to the endpoint's /batch path, which responds with the list of
+    results in the same order.  If a batch is rejected, e.g. by a model server without batch support or because one of
+    the records raised, every request in it is retried on its own so errors are still raised for the right record.
+    """
+
+    def __init__(self, client: "ModelServerClient", max_batch_size: int = 64, max_wait_seconds: float = 0.01):
+        self._client = client
+        self._max_batch_size = max_batch_size
+        self._max_wait_seconds = max_wait_seconds
+        self._queue: queue.Queue = queue.Queue()
+        self._rsession = requests.session()
+        self._thread = threading.Thread(target=self._run, name="prediction-batcher", daemon=True)
+        self.num_batches = 0
+        self.num_fallbacks = 0
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._rsession.close()
+
+    def submit(self, pending: _PendingRequest) -> concurrent.futures.Future:
+        self._queue.put(pending)
+        return pending.future
+
+    def _collect(self, first: _PendingRequest) -> tuple[list[_PendingRequest], bool]:
+        batch = [first]
+        deadline = time.monotonic() + self._max_wait_seconds
+        while len(batch) < self._max_batch_size:
+            try:
+                pending = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if pending is None:
+                return batch, True
+            batch.append(pending)
+        return batch, False
+
+    def _run(self):
+        closed = False
+        while not closed:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch, closed = self._collect(first)
+            groups: dict[tuple[str, Any], list[_PendingRequest]] = collections.defaultdict(list)
+            for pending in batch:
+                groups[(pending.url, pending.data_params.get("type"))].append(pending)
+            for group in groups.values():
+                self._send(group)
+
+    def _batched_results(self, group: list[_PendingRequest]) -> Optional[list]:
+        body = json.dumps([pending.data_params for pending in group]).encode("utf-8")
+        try:
+            res = self._rsession.post(f"{group[0].url}/batch", headers=self._client.base_headers, data=body)
+            if res.status_code == 200:
+                results = res.json()
+                if isinstance(results, list) and len(results) == len(group):
+                    return results
+        except Exception as e:
+            logging.warning("Batched model server request failed, falling back to single requests: %s", e)
+        return None
+
+    def _send_singly(self, group: list[_PendingRequest]):
+        predictions = []
+        for pending in group:
+            try:
+                result = self._client._post_json(pending.url, pending.data_params_bytes, self._rsession)
+            except Exception as e:
+                pending.future.set_exception(e)
+                continue
+            pending.future.set_result(result)
+            predictions.append((pending, result))
+        self._client._store_predictions(predictions)
+
+    def _send(self, group: list[_PendingRequest]):
+        stored = self._client._stored_predictions(group)
+        for pending in group:
+            if pending.input_hash in stored:
+                pending.future.set_result(stored[pending.input_hash])
+        group = [pending for pending in group if pending.input_hash not in stored]
+        results = self._batched_results(group) if len(group) > 1 else None
+        if results is None:
+            if len(group) > 1:
+                self.num_fallbacks += 1
+            self._send_singly(group)
+            return
+        self.num_batches += 1
+        for pending, result in zip(group, results):
+            pending.future.set_result(result)
+        self._client._store_predictions(list(zip(group, results)))
+
+
 class ModelServerClient:
+    """Client for the iSamples model server.
+
+    Responses are cached in an LRU of modelserver_lru_cache_size entries keyed on the endpoint and request body, so
+    hits are shared no matter which requests.Session made the original request.  Requests are sent one at a time,
+    except inside batching(), where requests made concurrently from several threads are combined into batched requests.
+
+    If prediction_store is set (see isb_lib.prediction_store.PredictionStore), it's consulted before the model server
+    and keeps every prediction the model server makes.  Failures to read or write the store are logged and otherwise
+    ignored, so the store can never make a prediction fail.
+    """
     base_url: str
     base_headers: dict
 
-    def __init__(self, base_url: str, base_headers: dict = {}):
+    def __init__(self, base_url: str, base_headers: dict = {}, cache_size: int = cache_size):
         self.base_url = base_url
         self.base_headers = base_headers
+        self._cache_size = cache_size
+        self._cache: collections.OrderedDict[tuple[str, bytes], Any] = collections.OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._batcher: Optional[PredictionBatcher] = None
+        self._batching_lock = threading.Lock()
+        self.prediction_store: Optional[Any] = None
+
+    def _model_type(self, url: str, data_params: dict) -> str:
+        endpoint = url.removeprefix(self.base_url)
+        return f"{endpoint}/{data_params.get('type')}"
+
+    def _stored_predictions(self, pending_requests: list[_PendingRequest]) -> dict[str, Any]:
+        """Returns the stored predictions of whichever of pending_requests, all of the same model type, have one"""
+        if self.prediction_store is None or len(pending_requests) == 0:
+            return {}
+        try:
+            return self.prediction_store.get_many(
+                pending_requests[0].model_type, [pending.input_hash for pending in pending_requests]
+            )
+        except Exception as e:
+            logging.warning("Unable to read stored model predictions: %s", e)
+            return {}
+
+    def _store_predictions(self, predictions: list[tuple[_PendingRequest, Any]]):
+        if self.prediction_store is None or len(predictions) == 0:
+            return
+        try:
+            self.prediction_store.put_many(
+                predictions[0][0].model_type, {pending.input_hash: result for pending, result in predictions}
+            )
+        except Exception as e:
+            logging.warning("Unable to store model predictions: %s", e)
 
-    @functools.lru_cache(maxsize=config.Settings().modelserver_lru_cache_size)
-    def _make_json_request_bytes(self, url: str, data_params_bytes: bytes, rsession: requests.Session) -> Any:
+    def _cache_get(self, key: tuple[str, bytes]) -> tuple[bool, Any]:
+        with self._cache_lock:
+            if key not in self._cache:
+                return False, None
+            self._cache.move_to_end(key)
+            return True, self._cache[key]
+
+    def _cache_put(self, key: tuple[str, bytes], result: Any):
+        with self._cache_lock:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+
+    @contextlib.contextmanager
+    def batching(self, max_batch_size: int = 64, max_wait_seconds: float = 0.01):
+        """Within this context, requests made concurrently from several threads are sent as batched requests.  Nested
+        uses share the outermost batcher."""
+        with self._batching_lock:
+            if self._batcher is not None:
+                batcher = None
+            else:
+                batcher = PredictionBatcher(self, max_batch_size, max_wait_seconds)
+                batcher.start()
+                self._batcher = batcher
+        try:
+            yield self._batcher
+        finally:
+            if batcher is not None:
+                with self._batching_lock:
+                    self._batcher = None
+                batcher.close()
+
+    def _post_json(self, url: str, data_params_bytes: bytes, rsession: requests.Session) -> Any:
         res = rsession.post(url, headers=self.base_headers, data=data_params_bytes)
         if res.status_code == 200:
             response_dict = res.json()
@@ -43,9 +240,27 @@ class ModelServerClient:
         else:
             raise Exception(f"Exception calling model server: {res.text}")
 
+    def _request(self, pending: _PendingRequest, rsession: requests.Session) -> Any:
+        stored = self._stored_predictions([pending])
+        if pending.input_hash in stored:
+            return stored[pending.input_hash]
+        result = self._post_json(pending.url, pending.data_params_bytes, rsession)
+        self._store_predictions([(pending, result)])
+        return result
+
     def _make_json_request(self, url: str, data_params: dict, rsession: requests.Session) -> Any:
-        data_params_bytes: bytes = json.dumps(data_params).encode("utf-8")
-        return self._make_json_request_bytes(url, data_params_bytes, rsession)
+        pending = _PendingRequest(url, data_params, self._model_type(url, data_params))
+        key = (url, pending.data_params_bytes)
+        cached, result = self._cache_get(key)
+        if cached:
+            return result
+        batcher = self._batcher
+        if batcher is not None:
+            result = batcher.submit(pending).result()
+        else:
+            result = self._request(pending, rsession)
+        self._cache_put(key, result)
+        return result
 
     @staticmethod
     def _convert_to_prediction_result_list(result: Any) -> list[PredictionResult]:
@@ -0,0 +1,148 @@
+import array
+import json
+import mmap
+import os
+import struct
+import tempfile
+import typing
+from typing import Optional
+
+MAGIC = b"ISBTAX01"
+# magic, number of names, size of the padded kingdoms JSON
+HEADER = struct.Struct("<8sQQ")
+# Kingdom numbers are stored as unsigned shorts
+MAX_KINGDOMS = 65535
+
+
+def _padded(data: bytes, alignment: int = 8) -> bytes:
+    # JSON ignores trailing whitespace, so pad with spaces to keep the arrays that follow aligned
+    return data + b" " * (-len(data) % alignment)
+
+
+def write_taxonomy_index(path: str, rows: typing.Iterable[typing.Tuple[str, str]]) -> int:
+    """Writes the (name, kingdom) rows to a taxonomy index file at path, returns the number of distinct names.
+
+    The rows must be sorted by the UTF-8 bytes of the name, e.g. from sqlmodel_database.taxonomy_name_rows.  When a
+    name is repeated, the last row wins like it does in taxonomy_name_to_kingdom_map.  The file is laid out as
+
+        header | kingdoms JSON | name offsets (uint64 x names + 1) | kingdom numbers (uint16 x names) | names
+
+    so that a lookup is a binary search over the memory-mapped file with no parsing up front.  Only the offsets and
+    kingdom numbers are held in memory while writing, the names are spooled to a temporary file in the same directory.
+    """
+    kingdoms: typing.Dict[str, int] = {}
+    offsets = array.array("Q", [0])
+    kingdom_numbers = array.array("H")
+    previous_name: Optional[bytes] = None
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.TemporaryFile(dir=directory) as names_file:
+        for name, kingdom in rows:
+            name_bytes = name.encode("utf-8")
+            kingdom_number = kingdoms.setdefault(kingdom, len(kingdoms))
+            if kingdom_number >= MAX_KINGDOMS:
+                raise ValueError(f"Taxonomy index can hold at most {MAX_KINGDOMS} kingdoms")
+            if previous_name is not None and name_bytes <= previous_name:
+                if name_bytes < previous_name:
+                    raise ValueError(f"Taxonomy names must be sorted, {name!r} came after {previous_name!r}")
+                kingdom_numbers[-1] = kingdom_number
+                continue
+            names_file.write(name_bytes)
+            offsets.append(offsets[-1] + len(name_bytes))
+            kingdom_numbers.append(kingdom_number)
+            previous_name = name_bytes
+        kingdoms_json = _padded(json.dumps(list(kingdoms.keys())).encode("utf-8"))
+        # Write then rename so readers never map a partially written index
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as index_file:
+            index_file.write(HEADER.pack(MAGIC, len(kingdom_numbers), len(kingdoms_json)))
+            index_file.write(kingdoms_json)
+            index_file.write(offsets.tobytes())
+            index_file.write(_padded(kingdom_numbers.tobytes()))
+            names_file.seek(0)
+            while chunk := names_file.read(1024 * 1024):
+                index_file.write(chunk)
+        os.replace(temp_path, path)
+    return len(kingdom_numbers)
+
+
+class TaxonomyIndex:
+    """Read-only lookup of the biological kingdom for a taxonomic name, backed by a file from write_taxonomy_index.
+
+    The file is memory-mapped rather than loaded, so processes using the same index share its pages through the OS
+    page cache and only the pages touched by lookups are ever read.  A lookup is a binary search over the sorted
+    names, a few microseconds even for the full GBIF backbone.  Like kingdom_for_taxonomy_name, a kingdom resolves to
+    itself.  Instances pickle as their path, so they can be handed to worker processes which map the file themselves.
+    """
+
+    def __init__(self, path: str):
+        self._open(path)
+
+    def _open(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._num_names, kingdoms_size = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a taxonomy index")
+        position = HEADER.size
+        self._kingdoms = json.loads(self._mmap[position:position + kingdoms_size])
+        self._kingdom_set = frozenset(self._kingdoms)
+        position += kingdoms_size
+        offsets_size = (self._num_names + 1) * 8
+        self._offsets = memoryview(self._mmap)[position:position + offsets_size].cast("Q")
+        position += offsets_size
+        self._kingdom_numbers = memoryview(self._mmap)[position:position + self._num_names * 2].cast("H")
+        self._names_start = position + len(_padded(b"\0" * (self._num_names * 2)))
+
+    def __getstate__(self) -> dict:
+        return {"path": self.path}
+
+    def __setstate__(self, state: dict):
+        self._open(state["path"])
+
+    def __len__(self) -> int:
+        return self._num_names
+
+    def __contains__(self, name: str) -> bool:
+        return self.kingdom(name) is not None
+
+    @property
+    def kingdoms(self) -> typing.List[str]:
+        return list(self._kingdoms)
+
+    def _name_at(self, position: int) -> bytes:
+        return self._mmap[self._names_start + self._offsets[position]:self._names_start + self._offsets[position + 1]]
+
+    def kingdom(self, name: str) -> Optional[str]:
+        """Returns the kingdom for the name, or None if the index doesn't know it"""
+        name_bytes = name.encode("utf-8")
+        low = 0
+        high = self._num_names
+        while low < high:
+            middle = (low + high) // 2
+            middle_name = self._name_at(middle)
+            if middle_name < name_bytes:
+                low = middle + 1
+            elif middle_name > name_bytes:
+                high = middle
+            else:
+                return self._kingdoms[self._kingdom_numbers[middle]]
+        if name in self._kingdom_set:
+            return name
+        return None
+
+    def close(self):
+        # The views into the map have to be released before it can be closed
+        for view_name in ["_offsets", "_kingdom_numbers"]:
+            view = self.__dict__.pop(view_name, None)
+            if view is not None:
+                view.release()
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> "TaxonomyIndex":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
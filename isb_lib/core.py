@@ -1,10 +1,18 @@
 """
 
 """
+import collections
+import concurrent.futures
+import contextlib
 import logging
 import datetime
+import functools
 import hashlib
 import json
+import math
+import queue
+import threading
+import time
 import typing
 import faulthandler
 from signal import SIGINT
@@ -18,8 +26,12 @@ from isamples_metadata.metadata_constants import METADATA_SAMPLE_IDENTIFIER, MET
     METADATA_RELATED_RESOURCE, METADATA_DESCRIPTION, METADATA_HAS_SPECIMEN_CATEGORY_CONFIDENCE, METADATA_CURATION_LOCATION, METADATA_SAMPLE_LOCATION, METADATA_KEYWORD, METADATA_NAME, \
     METADATA_ROLE
 from isamples_metadata.metadata_exceptions import MetadataException
+from isb_lib.models.solr_import_checkpoint import SolrImportCheckpoint
+from isb_lib.prediction_store import PredictionStore
+from isb_lib.transform_cache import TransformCache, content_hash, transform_cache_key
 from isb_lib.models.thing import Thing
-from isamples_metadata.Transformer import Transformer, geo_to_h3
+from isamples_metadata.Transformer import Transformer, geo_to_h3_all_resolutions, geo_to_h3_all_resolutions_batch
+from isamples_metadata.taxonomy.metadata_model_client import MODEL_SERVER_CLIENT
 import dateparser
 from dateparser.date import DateDataParser
 import re
@@ -52,6 +64,7 @@ ELEVATION_PATTERN = re.compile(r"\s*(-?\d+\.?\d*)\s*m?", re.IGNORECASE)
 MEDIA_JSON = "application/json"
 MEDIA_NQUADS = "application/n-quads"
 MEDIA_GEO_JSON = "application/geo+json"
+MEDIA_NDJSON = "application/x-ndjson"
 
 
 def getLogger():
@@ -271,18 +284,69 @@ def shapely_to_solr(shape: shapely.geometry.shape):
     return res
 
 
+def _h3_to_solr(coreMetadata: typing.Dict, h3_cells: typing.List[str]):
+    for index, h3_at_resolution in enumerate(h3_cells):
+        field_name = f"producedBy_samplingSite_location_h3_{index}"
+        coreMetadata[field_name] = h3_at_resolution
+
+
+class _H3Page:
+    """Solr documents whose h3 fields are computed together once a page of them has been transformed"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs: typing.List[typing.Dict] = []
+        self._coordinates: typing.List[typing.Tuple[float, float]] = []
+
+    def add(self, coreMetadata: typing.Dict, latitude: typing.Any, longitude: typing.Any) -> bool:
+        """Defers the h3 fields of the document and returns True.  Coordinates that aren't finite numbers are left to a
+        lookup of their own, so that they still fail the transform of just their Thing."""
+        if not all(type(value) in (int, float) and math.isfinite(value) for value in (latitude, longitude)):
+            return False
+        with self._lock:
+            self._docs.append(coreMetadata)
+            self._coordinates.append((latitude, longitude))
+        return True
+
+    def fill(self):
+        for doc, h3_cells in zip(self._docs, geo_to_h3_all_resolutions_batch(self._coordinates)):
+            if h3_cells is not None:
+                _h3_to_solr(doc, h3_cells)
+
+
+_H3_PAGE: Optional[_H3Page] = None
+_H3_PAGE_LOCK = threading.Lock()
+
+
+@contextlib.contextmanager
+def h3_page():
+    """Within this context, lat_lon_to_solr leaves out the h3 fields, and they're computed for all the documents at
+    once with geo_to_h3_all_resolutions_batch when it exits.  Nested uses share the outermost page."""
+    global _H3_PAGE
+    with _H3_PAGE_LOCK:
+        page = _H3Page() if _H3_PAGE is None else None
+        if page is not None:
+            _H3_PAGE = page
+    try:
+        yield
+    finally:
+        if page is not None:
+            with _H3_PAGE_LOCK:
+                _H3_PAGE = None
+    if page is not None:
+        page.fill()
+
+
 def lat_lon_to_solr(coreMetadata: typing.Dict, latitude: typing.SupportsFloat, longitude: typing.SupportsFloat):
     coreMetadata.update(shapely_to_solr(shapely.geometry.Point(longitude, latitude)))
     coreMetadata["producedBy_samplingSite_location_latitude"] = latitude
     coreMetadata["producedBy_samplingSite_location_longitude"] = longitude
-    for index in range(0, 16):
-        h3_at_resolution = geo_to_h3(
-            latitude,
-            longitude,
-            index,
-        )
-        field_name = f"producedBy_samplingSite_location_h3_{index}"
-        coreMetadata[field_name] = h3_at_resolution
+    page = _H3_PAGE
+    if page is not None and page.add(coreMetadata, latitude, longitude):
+        return
+    h3_cells = geo_to_h3_all_resolutions(latitude, longitude)
+    if h3_cells is not None:
+        _h3_to_solr(coreMetadata, h3_cells)
 
 
 def _gather_produced_by_responsibilities(responsibility_dicts: list[dict]) -> list[str]:
@@ -374,6 +438,70 @@ def parsed_datetime_from_isamples_format(raw_date_str) -> datetime.datetime:
     return lastmod_date
 
 
+SOLR_UPDATE_CHUNK_SIZE = 64 * 1024
+"""Size in bytes at which a streamed Solr update body is flushed to the connection"""
+
+
+def _strip_generated_solr_fields(record: typing.Dict) -> typing.Dict:
+    # Need to strip previously generated fields to avoid solr inconsistency errors
+    record.pop("_version_", None)
+    record.pop("producedBy_samplingSite_location_bb__minY", None)
+    record.pop("producedBy_samplingSite_location_bb__minX", None)
+    record.pop("producedBy_samplingSite_location_bb__maxY", None)
+    record.pop("producedBy_samplingSite_location_bb__maxX", None)
+
+    # If we don't nuke all the copy fields, they'll end up copying over multiple times
+    record.pop("searchText", None)
+    record.pop("description_text", None)
+    record.pop("producedBy_description_text", None)
+    record.pop("producedBy_samplingSite_description_text", None)
+    record.pop("curation_description_text", None)
+    return record
+
+
+SOLR_DIGEST_EXCLUDED_FIELDS = {"indexUpdatedTime", "_version_"}
+"""Solr document fields that don't participate in solr_document_digest"""
+
+
+class SolrUpdateStream:
+    """Serializes Solr documents into a JSON array incrementally, for use as a chunked HTTP request body.
+
+    Only one chunk of roughly chunk_size bytes is resident at a time, rather than the whole serialized batch.  Once the
+    stream has been consumed, num_records and num_bytes describe what was sent.
+    """
+
+    def __init__(self, records: typing.Iterable[typing.Dict], chunk_size: int = SOLR_UPDATE_CHUNK_SIZE):
+        self._records = records
+        self._chunk_size = chunk_size
+        self.num_records = 0
+        self.num_bytes = 0
+
+    def __iter__(self) -> typing.Iterator[bytes]:
+        buffer = bytearray(b"[")
+        for record in self._records:
+            if self.num_records > 0:
+                buffer += b","
+            buffer += json.dumps(_strip_generated_solr_fields(record)).encode("utf-8")
+            self.num_records += 1
+            if len(buffer) >= self._chunk_size:
+                self.num_bytes += len(buffer)
+                yield bytes(buffer)
+                buffer = bytearray()
+        buffer += b"]"
+        self.num_bytes += len(buffer)
+        yield bytes(buffer)
+
+
+def solr_document_digest(doc: typing.Dict) -> str:
+    """Computes a stable digest of a solr document, ignoring fields that change on every index run.
+
+    Two documents with the same digest would result in the same stored solr document, so reposting is unnecessary.
+    """
+    hashed_fields = {key: value for key, value in doc.items() if key not in SOLR_DIGEST_EXCLUDED_FIELDS}
+    serialized = json.dumps(hashed_fields, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
 def solr_delete_records(rsession, ids_to_delete: typing.List[str], url):
     L = getLogger()
     headers = {"Content-Type": "application/json"}
@@ -393,7 +521,7 @@ def solr_delete_records(rsession, ids_to_delete: typing.List[str], url):
         # TODO: something more elegant for error handling
         raise ValueError()
     else:
-        L.debug("Successfully posted data %s to url %s", str(data), str(_url))
+        L.debug("Successfully posted %d deletes (%d bytes) to url %s", len(dicts_to_delete), len(data), _url)
 
 
 def solrAddRecords(rsession, records, url):
@@ -405,35 +533,21 @@ def solrAddRecords(rsession, records, url):
     Note that it Solr recommends no manual commits, instead rely on
     proper configuration of the core.
 
+    The records are streamed to Solr as a chunked request body (see SolrUpdateStream) rather than serialized up front,
+    so records may be any iterable of dicts, including a generator.
+
     Args:
         rsession: requests.Session
-        relations: list of relations
+        records: iterable of solr document dicts
 
     Returns: nothing
 
     """
-
-    # Need to strip previously generated fields to avoid solr inconsistency errors
-    for record in records:
-        record.pop("_version_", None)
-        record.pop("producedBy_samplingSite_location_bb__minY", None)
-        record.pop("producedBy_samplingSite_location_bb__minX", None)
-        record.pop("producedBy_samplingSite_location_bb__maxY", None)
-        record.pop("producedBy_samplingSite_location_bb__maxX", None)
-
-        # If we don't nuke all the copy fields, they'll end up copying over multiple times
-        record.pop("searchText", None)
-        record.pop("description_text", None)
-        record.pop("producedBy_description_text", None)
-        record.pop("producedBy_samplingSite_description_text", None)
-        record.pop("curation_description_text", None)
-
     L = getLogger()
     headers = {"Content-Type": "application/json"}
-    data = json.dumps(records).encode("utf-8")
+    data = SolrUpdateStream(records)
     params = {"overwrite": "true"}
     _url = f"{url}update"
-    L.debug("Going to post data %s to url %s", str(data), str(_url))
     res = rsession.post(_url, headers=headers, data=data, params=params)
     L.debug("post status: %s", res.status_code)
     L.debug("Solr update: %s", res.text)
@@ -442,7 +556,7 @@ def solrAddRecords(rsession, records, url):
         # TODO: something more elegant for error handling
         raise ValueError()
     else:
-        L.debug("Successfully posted data %s to url %s", str(data), str(_url))
+        L.debug("Successfully posted %d records (%d bytes) to url %s", data.num_records, data.num_bytes, _url)
 
 
 def solrCommit(rsession, url):
@@ -619,6 +733,12 @@ class CollectionAdaptor:
 
 
 class ThingRecordIterator:
+    """Iterates the Things for an authority in primary key order.
+
+    offset is the primary key to start after and max_id, if set, the last primary key to include; paging is done with
+    a primary_key > last seen keyset rather than a SQL OFFSET.
+    """
+
     def __init__(
         self,
         session,
@@ -628,6 +748,7 @@ class ThingRecordIterator:
         offset: int = 0,
         limit: int = -1,
         min_time_created: Optional[datetime.datetime] = None,
+        max_id: Optional[int] = None,
     ):
         self._session = session
         self._authority_id = authority_id
@@ -637,6 +758,7 @@ class ThingRecordIterator:
         self._min_time_created = min_time_created
         self._id = offset
         self._limit = limit
+        self._max_id = max_id
         self._total_selected = 0
 
     def yieldRecordsByPage(self):
@@ -647,9 +769,10 @@ class ThingRecordIterator:
                 self._authority_id,
                 self._status,
                 self._page_size,
-                self._offset,
+                0,
                 self._min_time_created,
                 self._id,
+                self._max_id,
             )
             max_id_in_page = 0
             for rec in things:
@@ -665,8 +788,233 @@ class ThingRecordIterator:
             # Grab the next page, by only selecting records with _id > than the last one we fetched
             self._id = max_id_in_page
 
+    def yieldRecordsByCursor(self, columns: Optional[list[str]] = None):
+        """Yields records through one server-side cursor instead of a query per page.
+
+        Without columns, yields detached Things.  With columns, yields lightweight rows holding only those Thing
+        attributes -- callers that only need e.g. resolved_content avoid loading and tracking full ORM objects.
+        """
+        if columns is not None and "primary_key" not in columns:
+            columns = ["primary_key"] + columns
+        records = sqlmodel_database.stream_things_with_ids(
+            self._session,
+            self._authority_id,
+            self._status,
+            self._min_time_created,
+            self._id,
+            columns,
+            self._page_size,
+            self._max_id,
+        )
+        for rec in records:
+            if self._limit is not None and 0 < self._limit <= self._total_selected:
+                records.close()
+                break
+            self._total_selected += 1
+            self._id = rec.primary_key
+            yield rec
+
+    def yieldPagesOfRecords(self) -> typing.Iterator[typing.List[Thing]]:
+        """Yields lists of up to page_size detached Things, with one keyset query per page.
+
+        Each page is read completely before it is yielded, so unlike yieldRecordsByCursor no cursor is left open while
+        the caller works on it.
+        """
+        while self._limit is None or self._limit <= 0 or self._total_selected < self._limit:
+            page_size = self._page_size
+            if self._limit is not None and self._limit > 0:
+                page_size = min(page_size, self._limit - self._total_selected)
+            things = sqlmodel_database.paged_things_with_ids(
+                self._session,
+                self._authority_id,
+                self._status,
+                page_size,
+                0,
+                self._min_time_created,
+                self._id,
+                self._max_id,
+            )
+            if len(things) == 0:
+                return
+            for thing in things:
+                self._session.expunge(thing)
+            self._total_selected += len(things)
+            self._id = things[-1].primary_key
+            yield things
+
+
+def _transform_thing(
+    core_record_function: typing.Callable, thing: Thing
+) -> typing.Tuple[typing.List[typing.Dict], Optional[str], Optional[str]]:
+    """Runs the core record function against a single Thing.
+
+    Returns: A tuple of (core records, exclusion message, error message).  At most one of the messages will be set, and
+    the core records will be empty if either is.  Exceptions are flattened to strings so the result may be pickled back
+    from a worker process.
+    """
+    try:
+        return core_record_function(thing), None, None
+    except MetadataException as e:
+        return [], str(e), None
+    except Exception as e:
+        return [], None, str(e)
+
+
+def _transform_things(
+    core_record_function: typing.Callable, things: typing.List[Thing], prediction_batch_size: int = 0
+) -> typing.List[typing.Tuple[typing.List[typing.Dict], Optional[str], Optional[str]]]:
+    """Transforms the Things in order, computing the h3 fields of all their solr documents at once (see h3_page).
+
+    With a prediction_batch_size above 1, that many Things are transformed at once on a thread pool, so the model
+    server requests they make can be combined into batched requests (see ModelServerClient.batching).  The core record
+    function must then be safe to call from several threads.
+    """
+    with h3_page():
+        if prediction_batch_size <= 1 or len(things) <= 1:
+            return [_transform_thing(core_record_function, thing) for thing in things]
+        with MODEL_SERVER_CLIENT.batching(max_batch_size=prediction_batch_size):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=prediction_batch_size) as executor:
+                return list(executor.map(functools.partial(_transform_thing, core_record_function), things))
+
+
+def _init_transform_worker(prediction_store: Optional[PredictionStore]):
+    """Process pool initializer: shares the importer's model server prediction store with the worker"""
+    MODEL_SERVER_CLIENT.prediction_store = prediction_store
+
+
+def _transform_thing_page(
+    core_record_function: typing.Callable, thing_dicts: typing.List[typing.Dict], prediction_batch_size: int = 0
+) -> typing.List[typing.Tuple[typing.List[typing.Dict], Optional[str], Optional[str]]]:
+    """Process pool entry point: rebuilds detached Things from their column values and transforms them in order"""
+    things = [Thing(**thing_dict) for thing_dict in thing_dicts]
+    return _transform_things(core_record_function, things, prediction_batch_size)
+
+
+class ImportStageStats:
+    """Wall clock accounting for one stage of the CoreSolrImporter pipeline.
+
+    A stage is starved while it waits on its input queue and blocked while it waits for room on its output queue.  The
+    remaining time is busy time, so the stage with the lowest records per busy second is the bottleneck.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.records = 0
+        self.elapsed_seconds = 0.0
+        self.starved_seconds = 0.0
+        self.blocked_seconds = 0.0
+
+    @property
+    def busy_seconds(self) -> float:
+        return max(self.elapsed_seconds - self.starved_seconds - self.blocked_seconds, 0.0)
+
+    @property
+    def records_per_second(self) -> float:
+        if self.busy_seconds == 0:
+            return 0.0
+        return self.records / self.busy_seconds
+
+    def __str__(self):
+        return (
+            f"{self.name}: {self.records} records, {self.records_per_second:.1f} records/s busy, "
+            f"busy {self.busy_seconds:.1f}s, starved {self.starved_seconds:.1f}s, blocked {self.blocked_seconds:.1f}s"
+        )
+
+
+# Marker placed on a pipeline queue when the producing stage has no more work
+_END_OF_STAGE = object()
+
+
+class _PipelineAborted(Exception):
+    """Raised inside a pipeline stage when another stage has failed"""
+
+
+def _put_unless_aborted(work_queue: queue.Queue, item: typing.Any, abort: threading.Event, stats: ImportStageStats):
+    start = time.monotonic()
+    try:
+        while True:
+            if abort.is_set():
+                raise _PipelineAborted()
+            try:
+                work_queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+    finally:
+        stats.blocked_seconds += time.monotonic() - start
+
+
+def _get_unless_aborted(work_queue: queue.Queue, abort: threading.Event, stats: ImportStageStats) -> typing.Any:
+    start = time.monotonic()
+    try:
+        while True:
+            if abort.is_set():
+                raise _PipelineAborted()
+            try:
+                return work_queue.get(timeout=1)
+            except queue.Empty:
+                pass
+    finally:
+        stats.starved_seconds += time.monotonic() - start
+
+
+class _PipelineStage(threading.Thread):
+    """Background pipeline stage that records its exception and aborts the rest of the pipeline if it fails"""
+
+    def __init__(self, name: str, target: typing.Callable, abort: threading.Event):
+        super().__init__(name=name, daemon=True)
+        self._target_function = target
+        self._abort = abort
+        self.exception: Optional[BaseException] = None
+
+    def run(self):
+        try:
+            self._target_function()
+        except _PipelineAborted:
+            pass
+        except BaseException as e:
+            self.exception = e
+            self._abort.set()
+
+
+class _SolrBatch:
+    """A batch of solr documents to post, along with the import progress that posting it completes"""
+
+    def __init__(self):
+        self.core_records: typing.List[typing.Dict] = []
+        self.digests: typing.Dict[str, str] = {}
+        self.last_primary_key: Optional[int] = None
+        self.num_things = 0
+        self.num_excluded = 0
+        self.failed_ids: typing.List[str] = []
+
 
 class CoreSolrImporter:
+    """Indexes the Things for an authority into Solr.
+
+    The import runs as three stages connected by bounded queues: a background thread reads pages of Things from the
+    database, the calling thread transforms them into Solr documents (optionally across a process pool), and a second
+    background thread posts batches of documents to Solr.  queue_size bounds the number of pages and Solr batches held
+    between stages, so a slow stage applies backpressure instead of letting memory grow.
+
+    The digest of every posted document is recorded in the SolrDocumentDigest table.  With skip_unchanged, documents
+    whose digest matches the recorded one are not reposted.  Don't use skip_unchanged against a solr core that has been
+    emptied since the digests were recorded.
+
+    Progress is checkpointed to the SolrImportCheckpoint table, keyed by checkpoint_name (the authority id by default),
+    after every batch Solr accepts.  With resume, the run continues after the last checkpointed Thing using the
+    checkpoint's min_time_created.  Combined with limit, this allows a long import to be split across invocations.
+    offset and max_id restrict the import to a range of primary keys, see ShardedCoreSolrImporter.
+
+    With transform_cache, the output of core_record_function is cached in the TransformCacheEntry table, keyed by the
+    content and timestamps of the Thing, so a reindex only transforms the Things that changed since the last one.
+
+    With a prediction_batch_size above 1, each page is transformed on that many threads so that the model server
+    requests of different Things are sent as batched requests.  Only use it with core record functions that are safe
+    to call from several threads.  With prediction_store, model server predictions are kept in the ModelPrediction
+    table, so a reindex only asks the model server about records whose inputs changed.
+    """
+
     def __init__(
         self,
         db_url: str,
@@ -676,95 +1024,548 @@ class CoreSolrImporter:
         solr_url: str,
         offset: int = 0,
         min_time_created: Optional[datetime.datetime] = None,
+        workers: int = 1,
+        queue_size: int = 4,
+        skip_unchanged: bool = False,
+        resume: bool = False,
+        limit: int = -1,
+        checkpoint_name: Optional[str] = None,
+        max_id: Optional[int] = None,
+        transform_cache: bool = False,
+        prediction_batch_size: int = 0,
+        prediction_store: bool = False,
     ):
-        self._db_session = SQLModelDAO(db_url).get_session()
+        self._db_dao = SQLModelDAO(db_url)
+        self._db_session = self._db_dao.get_session()
         self._authority_id = authority_id
-        self._min_time_created = min_time_created
+        self.checkpoint = self._start_checkpoint(checkpoint_name or authority_id, offset, max_id, min_time_created, resume)
+        self._min_time_created = self.checkpoint.min_time_created
         self._thing_iterator = ThingRecordIterator(
             self._db_session,
             authority_id=self._authority_id,
             page_size=db_batch_size,
-            offset=offset,
-            min_time_created=min_time_created,
+            offset=self.checkpoint.last_primary_key,
+            limit=limit,
+            min_time_created=self._min_time_created,
+            max_id=self.checkpoint.max_primary_key,
         )
         self._db_batch_size = db_batch_size
         self._solr_batch_size = solr_batch_size
         self._solr_url = solr_url
+        self._workers = workers
+        self._queue_size = queue_size
+        self._skip_unchanged = skip_unchanged
+        # Each Thing is only transformed once per import, so only the persistent tier is of any use
+        self._transform_cache = TransformCache(maxsize=0, persistent=True) if transform_cache else None
+        self._prediction_batch_size = prediction_batch_size
+        if prediction_store:
+            MODEL_SERVER_CLIENT.prediction_store = PredictionStore(db_url)
+        self.num_unchanged = 0
+        self.stage_stats = {
+            "read": ImportStageStats("read"),
+            "transform": ImportStageStats("transform"),
+            "post": ImportStageStats("post"),
+        }
+
+    def _start_checkpoint(
+        self,
+        name: str,
+        offset: int,
+        max_id: Optional[int],
+        min_time_created: Optional[datetime.datetime],
+        resume: bool,
+    ) -> SolrImportCheckpoint:
+        checkpoint = sqlmodel_database.solr_import_checkpoint(self._db_session, name)
+        if checkpoint is not None:
+            # The post stage saves the checkpoint from its own session, so don't leave it attached to this one
+            self._db_session.expunge(checkpoint)
+        if resume and checkpoint is not None:
+            getLogger().info(
+                "Resuming import %s after primary key %s, %d things processed so far",
+                name,
+                checkpoint.last_primary_key,
+                checkpoint.num_things,
+            )
+            # Shards are planned before they start
+            checkpoint.tstarted = checkpoint.tstarted or datetime.datetime.now()
+        else:
+            if resume:
+                getLogger().warning("No checkpoint found for import %s, starting from the beginning", name)
+            checkpoint = SolrImportCheckpoint(
+                name=name,
+                authority_id=self._authority_id,
+                min_time_created=min_time_created,
+                min_primary_key=offset,
+                max_primary_key=max_id,
+                last_primary_key=offset,
+                failed_ids=[],
+                tstarted=datetime.datetime.now(),
+            )
+        checkpoint.tcompleted = None
+        # Save right away so that a later resume doesn't pick up a previous run's progress if this one fails early
+        return sqlmodel_database.save_solr_import_checkpoint(self._db_session, checkpoint)
+
+    def _save_checkpoint(self, session, batch: _SolrBatch, num_posted: int):
+        checkpoint = self.checkpoint
+        if batch.last_primary_key is not None:
+            checkpoint.last_primary_key = batch.last_primary_key
+        checkpoint.num_things += batch.num_things
+        checkpoint.num_records += num_posted
+        checkpoint.num_excluded += batch.num_excluded
+        checkpoint.num_failures += len(batch.failed_ids)
+        if len(batch.failed_ids) > 0:
+            checkpoint.failed_ids = (checkpoint.failed_ids or []) + batch.failed_ids
+        sqlmodel_database.save_solr_import_checkpoint(session, checkpoint)
+
+    def _thing_pages(self) -> typing.Iterator[typing.List[Thing]]:
+        for page in self._thing_iterator.yieldPagesOfRecords():
+            # The reader blocks on the page queue for as long as the downstream stages are behind, so don't hold a
+            # read transaction open meanwhile -- on SQLite it keeps the post stage's bookkeeping from committing
+            self._db_session.commit()
+            yield page
+
+    def _cache_keys(self, core_record_function: typing.Callable, page: typing.List[Thing]) -> typing.List[str]:
+        kind = f"{core_record_function.__module__}.{core_record_function.__qualname__}"
+        return [
+            transform_cache_key(
+                self._authority_id, thing.id, content_hash(thing.resolved_content, thing.tcreated, thing.tstamp), kind
+            )
+            for thing in page
+        ]
+
+    def _cached_transforms(self, cache_keys: typing.List[str], cache_session) -> typing.Dict[str, typing.List[typing.Dict]]:
+        if self._transform_cache is None:
+            return {}
+        return self._transform_cache.get_many(cache_keys, cache_session)
+
+    def _page_results(
+        self,
+        core_record_function: typing.Callable,
+        page: typing.List[Thing],
+        cache_keys: typing.List[str],
+        cached: typing.Dict[str, typing.List[typing.Dict]],
+        cache_session,
+        future: Optional[concurrent.futures.Future],
+    ) -> typing.Iterator[typing.Tuple[Thing, typing.List[typing.Dict], Optional[str], Optional[str]]]:
+        if future is not None:
+            transformed = iter(future.result())
+        else:
+            misses = [thing for thing, key in zip(page, cache_keys) if key not in cached]
+            transformed = iter(_transform_things(core_record_function, misses, self._prediction_batch_size))
+        results = []
+        new_entries = []
+        for thing, key in zip(page, cache_keys):
+            if key in cached:
+                results.append((cached[key], None, None))
+                continue
+            result = next(transformed)
+            results.append(result)
+            # Failures may well be transient (e.g. the model server being unavailable), so only cache successes
+            if result[1] is None and result[2] is None:
+                new_entries.append((key, self._authority_id, thing.id, result[0]))
+        # Cache before yielding, the core records get modified once they're handed out
+        if self._transform_cache is not None and len(new_entries) > 0:
+            self._transform_cache.put_many(new_entries, cache_session)
+        for thing, result in zip(page, results):
+            yield (thing, *result)
+
+    def _transformed_things(
+        self, core_record_function: typing.Callable, pages: typing.Iterable[typing.List[Thing]], cache_session=None
+    ) -> typing.Iterator[typing.Tuple[Thing, typing.List[typing.Dict], Optional[str], Optional[str]]]:
+        """Yields (thing, core records, exclusion message, error message) in primary key order.
+
+        With more than one worker, pages of Things are transformed in a process pool.  Results are still yielded in
+        submission order so that the output is identical to a single process run.  Things found in the transform cache
+        aren't transformed at all.
+        """
+        if self._workers <= 1:
+            for page in pages:
+                cache_keys = self._cache_keys(core_record_function, page)
+                cached = self._cached_transforms(cache_keys, cache_session)
+                yield from self._page_results(core_record_function, page, cache_keys, cached, cache_session, None)
+            return
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=self._workers,
+            initializer=_init_transform_worker,
+            initargs=(MODEL_SERVER_CLIENT.prediction_store,),
+        ) as executor:
+            # Bound the number of in-flight pages so we don't read the whole table into memory ahead of the workers
+            pending: typing.Deque = collections.deque()
+            for page in pages:
+                cache_keys = self._cache_keys(core_record_function, page)
+                cached = self._cached_transforms(cache_keys, cache_session)
+                thing_dicts = [thing.dict() for thing, key in zip(page, cache_keys) if key not in cached]
+                future = executor.submit(
+                    _transform_thing_page, core_record_function, thing_dicts, self._prediction_batch_size
+                )
+                pending.append((page, cache_keys, cached, future))
+                if len(pending) >= 2 * self._workers:
+                    completed_page, cache_keys, cached, future = pending.popleft()
+                    yield from self._page_results(
+                        core_record_function, completed_page, cache_keys, cached, cache_session, future
+                    )
+            while len(pending) > 0:
+                completed_page, cache_keys, cached, future = pending.popleft()
+                yield from self._page_results(
+                    core_record_function, completed_page, cache_keys, cached, cache_session, future
+                )
+
+    def _read_stage(self, page_queue: queue.Queue, abort: threading.Event):
+        stats = self.stage_stats["read"]
+        start = time.monotonic()
+        try:
+            pages = self._thing_pages()
+            while True:
+                page = next(pages, None)
+                if page is None:
+                    break
+                stats.records += len(page)
+                _put_unless_aborted(page_queue, page, abort, stats)
+            # Only signal completion on success -- a failure sets the abort event instead so the run isn't committed
+            _put_unless_aborted(page_queue, _END_OF_STAGE, abort, stats)
+        finally:
+            stats.elapsed_seconds = time.monotonic() - start
+
+    def _queued_pages(self, page_queue: queue.Queue, abort: threading.Event) -> typing.Iterator[typing.List[Thing]]:
+        while True:
+            page = _get_unless_aborted(page_queue, abort, self.stage_stats["transform"])
+            if page is _END_OF_STAGE:
+                return
+            yield page
+
+    def _post_batch(
+        self, rsession: requests.Session, digest_session, core_records: typing.List[typing.Dict], digests: typing.Dict[str, str]
+    ) -> int:
+        if len(core_records) == 0:
+            return 0
+        existing_digests = sqlmodel_database.solr_document_digests(digest_session, list(digests.keys()))
+        if self._skip_unchanged:
+            core_records = [record for record in core_records if existing_digests.get(record["id"]) != digests[record["id"]]]
+        if len(core_records) > 0:
+            solrAddRecords(
+                rsession,
+                core_records,
+                url=self._solr_url,
+            )
+        changed_digests = {id: digest for id, digest in digests.items() if existing_digests.get(id) != digest}
+        sqlmodel_database.save_solr_document_digests(
+            digest_session, self._authority_id, changed_digests, existing_digests.keys()
+        )
+        return len(core_records)
+
+    def _post_stage(self, solr_batch_queue: queue.Queue, abort: threading.Event):
+        stats = self.stage_stats["post"]
+        start = time.monotonic()
+        rsession = requests.session()
+        # The reader thread owns the importer's session, so the digest and checkpoint bookkeeping needs its own
+        bookkeeping_session = self._db_dao.get_session()
+        try:
+            while True:
+                batch = _get_unless_aborted(solr_batch_queue, abort, stats)
+                if batch is _END_OF_STAGE:
+                    break
+                num_posted = self._post_batch(rsession, bookkeeping_session, batch.core_records, batch.digests)
+                stats.records += num_posted
+                self.num_unchanged += len(batch.core_records) - num_posted
+                # Solr has accepted the batch into its update log, so it's safe to resume after it
+                self._save_checkpoint(bookkeeping_session, batch, num_posted)
+                getLogger().info(
+                    "Just posted %d solr records, %d posted so far, %d unchanged skipped, checkpointed at %s",
+                    num_posted,
+                    stats.records,
+                    self.num_unchanged,
+                    self.checkpoint.last_primary_key,
+                )
+            solrCommit(rsession, url=self._solr_url)
+            self.checkpoint.tcompleted = datetime.datetime.now()
+            sqlmodel_database.save_solr_import_checkpoint(bookkeeping_session, self.checkpoint)
+        finally:
+            bookkeeping_session.close()
+            stats.elapsed_seconds = time.monotonic() - start
+
+    def _prepare_core_record(self, thing: Thing, core_record: typing.Dict):
+        core_record["source"] = self._authority_id
+        # Note that the h3 is precomputed and stored on the Thing itself because we do a
+        # "select distinct h3 from thing" query in order to determine which h3 values we need to compute
+        # Cesium elevation for.  The full order of operations is
+        # (1) compute h3 on things
+        # (2) select distinct h3 to determine points that need to be computed
+        # (3) compute points and insert into Point db cache table using Cesium JS API
+        # (4) at index time, consult Point cache to get elevation for thing, and since we've previously
+        #  computed the h3 just grab it off the Thing
+        # Step 3 in this sequence of events is both slow and API rate-limited by Cesium, so we take great
+        # pain to ensure that we're only querying the absolute minimum
+        core_record["producedBy_samplingSite_location_h3_15"] = thing.h3
+        # core_record["producedBy_samplingSite_location_cesium_height"] = h3_to_height.get(thing.h3)
+        if ("producedBy_samplingSite_location_cesium_height" in core_record):
+            core_record.pop("producedBy_samplingSite_location_cesium_height")
+
+    def _transform_stage(
+        self,
+        core_record_function: typing.Callable,
+        page_queue: queue.Queue,
+        solr_batch_queue: queue.Queue,
+        abort: threading.Event,
+        allkeys: typing.Set[str],
+    ):
+        stats = self.stage_stats["transform"]
+        start = time.monotonic()
+        # The reader and poster threads have sessions of their own, so the transform cache needs a separate one too
+        cache_session = self._db_dao.get_session() if self._transform_cache is not None else None
+        try:
+            batch = _SolrBatch()
+            transformed = self._transformed_things(
+                core_record_function, self._queued_pages(page_queue, abort), cache_session
+            )
+            for thing, core_records_from_thing, exclusion, error in transformed:
+                stats.records += 1
+                batch.num_things += 1
+                batch.last_primary_key = thing.primary_key
+                if exclusion is not None:
+                    getLogger().info(f"Excluding record {thing.id} from index due to known exclusion: \"{exclusion}\".")
+                    batch.num_excluded += 1
+                    continue
+                if error is not None:
+                    getLogger().error("Failed trying to run transformer, skipping record %s exception %s",
+                                      thing.resolved_content, error)
+                    batch.failed_ids.append(thing.id)
+                    continue
+                for core_record in core_records_from_thing:
+                    self._prepare_core_record(thing, core_record)
+                    allkeys.add(core_record["id"])
+                    batch.core_records.append(core_record)
+                    batch.digests[core_record["id"]] = solr_document_digest(core_record)
+                if len(batch.core_records) > self._solr_batch_size:
+                    _put_unless_aborted(solr_batch_queue, batch, abort, stats)
+                    batch = _SolrBatch()
+            # Even without any documents, a trailing batch still advances the checkpoint past excluded or failed Things
+            if batch.num_things > 0:
+                _put_unless_aborted(solr_batch_queue, batch, abort, stats)
+            _put_unless_aborted(solr_batch_queue, _END_OF_STAGE, abort, stats)
+        finally:
+            if cache_session is not None:
+                cache_session.close()
+            stats.elapsed_seconds = time.monotonic() - start
 
-    def run_solr_import(  # noqa: C901
+    def run_solr_import(
         self, core_record_function: typing.Callable
     ) -> typing.Set[str]:
         getLogger().info(
-            "importing solr records with db batch size: %s, solr batch size: %s",
+            "importing solr records with db batch size: %s, solr batch size: %s, workers: %s, queue size: %s, "
+            "skip unchanged: %s, starting after primary key: %s",
             self._db_batch_size,
             self._solr_batch_size,
+            self._workers,
+            self._queue_size,
+            self._skip_unchanged,
+            self.checkpoint.last_primary_key,
         )
         faulthandler.enable()
         faulthandler.register(SIGINT)
-        allkeys = set()
-        rsession = requests.session()
-        # h3_to_height = sqlmodel_database.h3_to_height(self._db_session)
+        allkeys: typing.Set[str] = set()
+        abort = threading.Event()
+        page_queue: queue.Queue = queue.Queue(maxsize=self._queue_size)
+        solr_batch_queue: queue.Queue = queue.Queue(maxsize=self._queue_size)
+        reader = _PipelineStage("read", lambda: self._read_stage(page_queue, abort), abort)
+        poster = _PipelineStage("post", lambda: self._post_stage(solr_batch_queue, abort), abort)
         try:
-            core_records = []
-            for thing in self._thing_iterator.yieldRecordsByPage():
-                try:
-                    core_records_from_thing = core_record_function(thing)
-                except MetadataException as e:
-                    getLogger().info(f"Excluding record {thing.id} from index due to known exclusion: \"{e}\".")
-                    continue
-                except Exception as e:
-                    getLogger().error("Failed trying to run transformer, skipping record %s exception %s",
-                                      thing.resolved_content, e)
-                    continue
-
-                for core_record in core_records_from_thing:
-                    core_record["source"] = self._authority_id
-                    # Note that the h3 is precomputed and stored on the Thing itself because we do a
-                    # "select distinct h3 from thing" query in order to determine which h3 values we need to compute
-                    # Cesium elevation for.  The full order of operations is
-                    # (1) compute h3 on things
-                    # (2) select distinct h3 to determine points that need to be computed
-                    # (3) compute points and insert into Point db cache table using Cesium JS API
-                    # (4) at index time, consult Point cache to get elevation for thing, and since we've previously
-                    #  computed the h3 just grab it off the Thing
-                    # Step 3 in this sequence of events is both slow and API rate-limited by Cesium, so we take great
-                    # pain to ensure that we're only querying the absolute minimum
-                    core_record["producedBy_samplingSite_location_h3_15"] = thing.h3
-                    # core_record["producedBy_samplingSite_location_cesium_height"] = h3_to_height.get(thing.h3)
-                    if ("producedBy_samplingSite_location_cesium_height" in core_record):
-                        core_record.pop("producedBy_samplingSite_location_cesium_height")
-                    core_records.append(core_record)
-                for r in core_records:
-                    allkeys.add(r["id"])
-                batch_size = len(core_records)
-                if batch_size > self._solr_batch_size:
-                    solrAddRecords(
-                        rsession,
-                        core_records,
-                        url=self._solr_url,
-                    )
-                    getLogger().info(
-                        "Just added solr records, length of all keys is %d",
-                        len(allkeys),
-                    )
-                    core_records = []
-            if len(core_records) > 0:
-                solrAddRecords(
-                    rsession,
-                    core_records,
-                    url=self._solr_url,
+            reader.start()
+            poster.start()
+            try:
+                self._transform_stage(core_record_function, page_queue, solr_batch_queue, abort, allkeys)
+            except _PipelineAborted:
+                pass
+            except BaseException:
+                abort.set()
+                raise
+            finally:
+                poster.join()
+                reader.join()
+            for stage in (reader, poster):
+                if stage.exception is not None:
+                    raise stage.exception
+            for stats in self.stage_stats.values():
+                getLogger().info("Import stage %s", stats)
+            getLogger().info("Skipped %d unchanged solr documents", self.num_unchanged)
+            if self._transform_cache is not None:
+                getLogger().info(
+                    "Transform cache hits: %d, misses: %d", self._transform_cache.hits, self._transform_cache.misses
                 )
-            solrCommit(rsession, url=self._solr_url)
-            # verify records
-            # for verifying that all records were added to solr
-            # found = 0
-            # for _id in allkeys:
-            #    res = rsession.get(f"http://localhost:8983/solr/isb_rel/get?id={_id}").json()
-            #    if res.get("doc",{}).get("id") == _id:
-            #        found = found +1
-            #    else:
-            #        print(f"Missed: {_id}")
-            # print(f"Found = {found}")
+            getLogger().info(
+                "Import %s checkpointed at primary key %s: %d things, %d solr documents, %d excluded, %d failed",
+                self.checkpoint.name,
+                self.checkpoint.last_primary_key,
+                self.checkpoint.num_things,
+                self.checkpoint.num_records,
+                self.checkpoint.num_excluded,
+                self.checkpoint.num_failures,
+            )
         finally:
             self._db_session.close()
         return allkeys
+
+
+def _run_import_shard(importer_kwargs: typing.Dict, core_record_function: typing.Callable) -> typing.Set[str]:
+    return CoreSolrImporter(**importer_kwargs).run_solr_import(core_record_function)
+
+
+class ShardedCoreSolrImporter:
+    """Splits the import of an authority into num_shards ranges of primary keys holding roughly equal numbers of Things.
+
+    Each shard is imported by its own CoreSolrImporter with its own checkpoint, so shards can be resumed independently.
+    With shard set, only that shard is imported -- e.g. four containers started with num_shards=4 and shards 0 through 3
+    split an authority evenly.  Otherwise all shards are imported concurrently in separate processes.  Either way, the
+    key sets of the shards that ran are merged, and the combined progress of all shards is logged from their checkpoints.
+
+    The ranges are planned once, by the first shard to start, and stored as the checkpoints of all the shards.  Shards
+    started later read their range from those checkpoints rather than planning again, so Things harvested in between
+    can't shift the boundaries and every primary key belongs to exactly one shard.  The last shard has no upper bound,
+    so Things added during the import are still picked up.  A plan is kept until all of its shards have completed, or
+    when resuming, after which the next start plans again.  All other keyword arguments are passed through to
+    CoreSolrImporter.
+    """
+
+    def __init__(self, num_shards: int = 1, shard: Optional[int] = None, **importer_kwargs):
+        if num_shards < 1:
+            raise ValueError(f"num_shards must be at least 1, got {num_shards}")
+        if shard is not None and not 0 <= shard < num_shards:
+            raise ValueError(f"shard must be between 0 and {num_shards - 1}, got {shard}")
+        self._num_shards = num_shards
+        self._shard = shard
+        self._importer_kwargs = importer_kwargs
+        self._authority_id = importer_kwargs["authority_id"]
+        self._db_dao = SQLModelDAO(importer_kwargs["db_url"])
+
+    def checkpoint_name(self, shard: int) -> str:
+        if self._num_shards == 1:
+            # An unsharded import shares the regular checkpoint
+            return self._authority_id
+        return f"{self._authority_id}-shard-{shard}-of-{self._num_shards}"
+
+    def shard_ranges(self) -> typing.List[typing.Tuple[int, Optional[int]]]:
+        """Returns the (offset, max_id) primary key range of each shard, planning them if there's no current plan"""
+        offset = self._importer_kwargs.get("offset", 0)
+        if self._num_shards == 1:
+            return [(offset, None)]
+        names = [self.checkpoint_name(shard) for shard in range(self._num_shards)]
+        with self._db_dao.get_session() as session:
+            checkpoints = sqlmodel_database.solr_import_checkpoints_for_update(session, names)
+            if not self._is_current_plan(checkpoints):
+                planned = self._plan_checkpoints(session, offset)
+                if sqlmodel_database.save_solr_import_checkpoint_plan(session, planned):
+                    return [(checkpoint.min_primary_key, checkpoint.max_primary_key) for checkpoint in planned]
+                # Another shard planned at the same time, so use its plan
+                checkpoints = sqlmodel_database.solr_import_checkpoints_for_update(session, names)
+            ranges = [
+                (checkpoint.min_primary_key, checkpoint.max_primary_key)
+                for checkpoint in checkpoints
+                if checkpoint is not None
+            ]
+            # Release the locks on the checkpoints
+            session.commit()
+        return ranges
+
+    def _is_current_plan(self, checkpoints: typing.List[Optional[SolrImportCheckpoint]]) -> bool:
+        if any(checkpoint is None for checkpoint in checkpoints):
+            return False
+        if self._importer_kwargs.get("resume", False):
+            return True
+        return any(checkpoint is not None and checkpoint.tcompleted is None for checkpoint in checkpoints)
+
+    def _plan_checkpoints(self, session, offset: int) -> typing.List[SolrImportCheckpoint]:
+        min_time_created = self._importer_kwargs.get("min_time_created")
+        bounds = sqlmodel_database.thing_primary_key_shard_bounds(
+            session, self._num_shards, self._authority_id, min_time_created=min_time_created
+        )
+        # With fewer Things than shards, the extra shards get an empty range
+        bounds = bounds + [bounds[-1] if len(bounds) > 0 else offset] * (self._num_shards - len(bounds))
+        lower_bounds = [offset] + [max(bound, offset) for bound in bounds[:-1]]
+        upper_bounds: typing.List[Optional[int]] = [max(bound, offset) for bound in bounds[:-1]] + [None]
+        return [
+            SolrImportCheckpoint(
+                name=self.checkpoint_name(shard),
+                authority_id=self._authority_id,
+                min_time_created=min_time_created,
+                min_primary_key=lower_bounds[shard],
+                max_primary_key=upper_bounds[shard],
+                last_primary_key=lower_bounds[shard],
+                failed_ids=[],
+            )
+            for shard in range(self._num_shards)
+        ]
+
+    def _checkpoints(self, session) -> typing.List[Optional[SolrImportCheckpoint]]:
+        return [
+            sqlmodel_database.solr_import_checkpoint(session, self.checkpoint_name(shard))
+            for shard in range(self._num_shards)
+        ]
+
+    def progress(self) -> typing.Dict[str, int]:
+        """Sums the checkpointed progress of all shards, wherever they ran"""
+        progress = {
+            "num_shards": self._num_shards,
+            "num_started": 0,
+            "num_completed": 0,
+            "num_things": 0,
+            "num_records": 0,
+            "num_excluded": 0,
+            "num_failures": 0,
+        }
+        with self._db_dao.get_session() as session:
+            for checkpoint in self._checkpoints(session):
+                if checkpoint is None or checkpoint.tstarted is None:
+                    continue
+                progress["num_started"] += 1
+                progress["num_completed"] += 1 if checkpoint.tcompleted is not None else 0
+                progress["num_things"] += checkpoint.num_things
+                progress["num_records"] += checkpoint.num_records
+                progress["num_excluded"] += checkpoint.num_excluded
+                progress["num_failures"] += checkpoint.num_failures
+        return progress
+
+    def _shard_importer_kwargs(self, shard: int, offset: int, max_id: Optional[int]) -> typing.Dict:
+        importer_kwargs = dict(self._importer_kwargs)
+        importer_kwargs.update(offset=offset, max_id=max_id, checkpoint_name=self.checkpoint_name(shard))
+        return importer_kwargs
+
+    def run_solr_import(self, core_record_function: typing.Callable) -> typing.Set[str]:
+        ranges = self.shard_ranges()
+        shards = [self._shard] if self._shard is not None else list(range(self._num_shards))
+        for shard in shards:
+            getLogger().info(
+                "Shard %d of %d imports primary keys in (%s, %s]", shard, self._num_shards, *ranges[shard]
+            )
+        if len(shards) == 1:
+            allkeys = _run_import_shard(self._shard_importer_kwargs(shards[0], *ranges[shards[0]]), core_record_function)
+        else:
+            allkeys = self._run_shards_concurrently(shards, ranges, core_record_function)
+        getLogger().info("Sharded import progress: %s", self.progress())
+        return allkeys
+
+    def _run_shards_concurrently(
+        self,
+        shards: typing.List[int],
+        ranges: typing.List[typing.Tuple[int, Optional[int]]],
+        core_record_function: typing.Callable,
+    ) -> typing.Set[str]:
+        allkeys: typing.Set[str] = set()
+        first_exception: Optional[BaseException] = None
+        with concurrent.futures.ProcessPoolExecutor(max_workers=len(shards)) as executor:
+            futures = {
+                executor.submit(
+                    _run_import_shard, self._shard_importer_kwargs(shard, *ranges[shard]), core_record_function
+                ): shard
+                for shard in shards
+            }
+            # Let the other shards finish if one fails, their checkpoints mean only the failed one needs resuming
+            for future in concurrent.futures.as_completed(futures):
+                shard = futures[future]
+                try:
+                    allkeys.update(future.result())
+                    getLogger().info("Shard %d finished, progress: %s", shard, self.progress())
+                except Exception as e:
+                    getLogger().error("Shard %d failed: %s", shard, e)
+                    first_exception = first_exception or e
+        if first_exception is not None:
+            raise first_exception
+        return allkeys
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import struct
+import typing
+from typing import Optional
+
+import numpy as np
+from sqlmodel import Session
+
+from isb_lib.models.thing import Thing
+from isb_web import sqlmodel_database
+
+MAGIC = b"ISBIDX01"
+# magic, number of identifiers, largest primary key indexed, size of the padded metadata JSON
+HEADER = struct.Struct("<8sQqQ")
+
+
+def identifier_hashes(identifiers: typing.Sequence[str]) -> np.ndarray:
+    """The 64 bit hashes the index stores in place of the identifiers"""
+    digests = b"".join(
+        hashlib.blake2b(identifier.encode("utf-8"), digest_size=8).digest() for identifier in identifiers
+    )
+    return np.frombuffer(digests, dtype="<u8")
+
+
+def write_identifier_index(
+    path: str,
+    hashes: np.ndarray,
+    primary_keys: np.ndarray,
+    max_primary_key: int,
+    metadata: typing.Dict[str, typing.Any],
+) -> int:
+    """Sorts the identifier hashes with their primary keys and writes them to path, returns the number written.
+
+    When a hash is repeated the last one wins, so an identifier moved to a newer Thing resolves to the newer one.
+    """
+    order = np.argsort(hashes, kind="stable")
+    sorted_hashes = hashes[order]
+    sorted_primary_keys = primary_keys[order]
+    # The last of each run of equal hashes
+    keep = np.append(sorted_hashes[1:] != sorted_hashes[:-1], True) if len(sorted_hashes) > 0 else np.ones(0, dtype=bool)
+    sorted_hashes = sorted_hashes[keep]
+    sorted_primary_keys = sorted_primary_keys[keep]
+    metadata_json = json.dumps(metadata).encode("utf-8")
+    metadata_json += b" " * (-len(metadata_json) % 8)
+    # Write then rename so readers never map a partially written index
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as index_file:
+        index_file.write(HEADER.pack(MAGIC, len(sorted_hashes), max_primary_key, len(metadata_json)))
+        index_file.write(metadata_json)
+        index_file.write(sorted_hashes.astype("<u8").tobytes())
+        index_file.write(sorted_primary_keys.astype("<i8").tobytes())
+    os.replace(temp_path, path)
+    return len(sorted_hashes)
+
+
+class IdentifierIndex:
+    """Read-only identifier to Thing primary key lookup for an authority, memory-mapped from a file.
+
+    The index holds a sorted array of 64 bit identifier hashes with a parallel array of primary keys, 16 bytes per
+    identifier on disk and nothing in memory beyond the pages the lookups touch.  Lookups are binary searches, and
+    primary_keys checks a whole page of identifiers with a single vectorized search.  An identifier missing from the
+    index definitely had no Thing when the index was last refreshed, while a hit could in principle be a hash
+    collision, so callers that need the Thing itself should still fetch it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as index_file:
+            header = index_file.read(HEADER.size)
+            magic, self._num_identifiers, self.max_primary_key, metadata_size = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not an identifier index")
+            self.metadata = json.loads(index_file.read(metadata_size))
+        hashes_offset = HEADER.size + metadata_size
+        primary_keys_offset = hashes_offset + self._num_identifiers * 8
+        if self._num_identifiers == 0:
+            # numpy can't map an empty array
+            self._hashes = np.empty(0, dtype="<u8")
+            self._primary_keys = np.empty(0, dtype="<i8")
+        else:
+            self._hashes = np.memmap(path, dtype="<u8", mode="r", offset=hashes_offset, shape=(self._num_identifiers,))
+            self._primary_keys = np.memmap(
+                path, dtype="<i8", mode="r", offset=primary_keys_offset, shape=(self._num_identifiers,)
+            )
+        self._new_identifiers: typing.Set[str] = set()
+
+    @property
+    def authority_id(self) -> Optional[str]:
+        return self.metadata.get("authority_id")
+
+    def __len__(self) -> int:
+        return self._num_identifiers
+
+    def __contains__(self, identifier: str) -> bool:
+        return self.primary_key(identifier) is not None
+
+    def primary_key(self, identifier: str) -> Optional[int]:
+        return self.primary_keys([identifier]).get(identifier)
+
+    def primary_keys(self, identifiers: typing.Sequence[str]) -> typing.Dict[str, int]:
+        """Returns the primary keys of whichever of the identifiers are in the index"""
+        if self._num_identifiers == 0 or len(identifiers) == 0:
+            return {}
+        hashes = identifier_hashes(identifiers)
+        positions = np.minimum(np.searchsorted(self._hashes, hashes), self._num_identifiers - 1)
+        found = self._hashes[positions] == hashes
+        primary_keys = self._primary_keys[positions]
+        return {
+            identifier: int(primary_key)
+            for identifier, is_found, primary_key in zip(identifiers, found, primary_keys)
+            if is_found
+        }
+
+    def is_new(self, identifier: str) -> bool:
+        """Whether the identifier had no Thing when the index was refreshed, and hasn't been asked about since.
+
+        Callers save a Thing for an identifier they're told is new, and the index isn't updated when they do, so an
+        identifier that comes up again may well have a Thing by then.
+        """
+        if identifier in self or identifier in self._new_identifiers:
+            return False
+        self._new_identifiers.add(identifier)
+        return True
+
+    def arrays(self) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """In-memory copies of the (hashes, primary keys) arrays"""
+        return np.array(self._hashes), np.array(self._primary_keys)
+
+
+def _collect_identifier_rows(
+    rows: typing.Iterable[typing.Tuple[int, str, typing.Optional[list]]]
+) -> typing.Tuple[np.ndarray, np.ndarray, int]:
+    hash_chunks = []
+    primary_key_chunks = []
+    chunk_identifiers: typing.List[str] = []
+    chunk_primary_keys: typing.List[int] = []
+    max_primary_key = 0
+    for primary_key, thing_id, identifiers in rows:
+        max_primary_key = max(max_primary_key, primary_key)
+        for identifier in {thing_id, *(identifiers or [])}:
+            chunk_identifiers.append(identifier)
+            chunk_primary_keys.append(primary_key)
+        # Hash in chunks so only the compact arrays grow with the number of Things
+        if len(chunk_identifiers) >= 100000:
+            hash_chunks.append(identifier_hashes(chunk_identifiers))
+            primary_key_chunks.append(np.array(chunk_primary_keys, dtype="<i8"))
+            chunk_identifiers = []
+            chunk_primary_keys = []
+    hash_chunks.append(identifier_hashes(chunk_identifiers))
+    primary_key_chunks.append(np.array(chunk_primary_keys, dtype="<i8"))
+    return np.concatenate(hash_chunks), np.concatenate(primary_key_chunks), max_primary_key
+
+
+def refresh_identifier_index(session: Session, path: str, authority_id: Optional[str]) -> IdentifierIndex:
+    """Brings the identifier index at path up to date with the authority's Things, and returns it.
+
+    The first refresh indexes every Thing of the authority.  Later ones only read the Things added since, by primary
+    key, and merge them into the existing index.  Identifiers added to an existing Thing aren't picked up by a
+    refresh, delete the index file to rebuild it from scratch.
+    """
+    hashes = np.empty(0, dtype="<u8")
+    primary_keys = np.empty(0, dtype="<i8")
+    min_primary_key = 0
+    if os.path.exists(path):
+        existing_index = IdentifierIndex(path)
+        if existing_index.authority_id == authority_id:
+            hashes, primary_keys = existing_index.arrays()
+            min_primary_key = existing_index.max_primary_key
+        del existing_index
+    new_hashes, new_primary_keys, max_primary_key = _collect_identifier_rows(
+        sqlmodel_database.stream_thing_identifiers(session, authority_id, min_primary_key)
+    )
+    write_identifier_index(
+        path,
+        np.concatenate([hashes, new_hashes]),
+        np.concatenate([primary_keys, new_primary_keys]),
+        max(min_primary_key, max_primary_key),
+        {"authority_id": authority_id},
+    )
+    return IdentifierIndex(path)
+
+
+def get_existing_thing(session: Session, identifier_index: Optional[IdentifierIndex], identifier: str) -> Optional[Thing]:
+    """Like get_thing_with_id, but identifiers missing from the index don't touch the database at all, the first time
+    they're asked about.  Later lookups go to the database, as the Thing may have been saved in the meantime.
+
+    get_thing_with_id makes a second query of the identifiers lookup table for ids it can't find, which is the common
+    case when harvesting new records.
+    """
+    if identifier_index is not None and identifier_index.is_new(identifier):
+        return None
+    return sqlmodel_database.get_thing_with_id(session, identifier)
@@ -0,0 +1,45 @@
+from datetime import datetime
+from typing import Any, Optional
+
+import sqlalchemy
+from sqlmodel import SQLModel, Field
+
+from isb_lib.models.conditional_jsonb_type import ConditionalJSONB
+
+
+class ModelPrediction(SQLModel, table=True):
+    key: Optional[str] = Field(
+        primary_key=True,
+        default=None,
+        nullable=False,
+        description="Digest of the model type, model version and input hash",
+    )
+    model_type: Optional[str] = Field(
+        default=None,
+        nullable=True,
+        index=True,
+        description="The model server endpoint and model type, e.g. sesar/material",
+    )
+    model_version: Optional[str] = Field(
+        default=None,
+        nullable=True,
+        description="Version of the model that made the prediction",
+    )
+    input_hash: Optional[str] = Field(
+        default=None,
+        nullable=True,
+        description="Digest of the normalized model server request",
+    )
+    prediction: Optional[Any] = Field(
+        sa_column=sqlalchemy.Column(
+            ConditionalJSONB,
+            nullable=True,
+            default=None,
+            doc="The model server response",
+        ),
+    )
+    tstamp: Optional[datetime] = Field(
+        default=None,
+        nullable=True,
+        description="When the prediction was made",
+    )
@@ -0,0 +1,31 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlmodel import SQLModel, Field
+
+
+class SolrDocumentDigest(SQLModel, table=True):
+    id: Optional[str] = Field(
+        primary_key=True,
+        default=None,
+        nullable=False,
+        description="The solr document id",
+    )
+    authority_id: Optional[str] = Field(
+        default=None,
+        nullable=True,
+        index=True,
+        description="Authority of the Thing the solr document was generated from",
+    )
+    digest: Optional[str] = Field(
+        default=None,
+        nullable=False,
+        index=False,
+        description="Digest of the solr document as last posted to solr, excluding indexUpdatedTime",
+    )
+    tstamp: Optional[datetime] = Field(
+        default=None,
+        nullable=True,
+        index=False,
+        description="When the solr document was last posted to solr",
+    )
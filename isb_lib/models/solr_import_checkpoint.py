@@ -0,0 +1,85 @@
+from datetime import datetime
+from typing import Optional
+
+import sqlalchemy
+from sqlmodel import SQLModel, Field
+
+from isb_lib.models.string_list_type import StringListType
+
+
+class SolrImportCheckpoint(SQLModel, table=True):
+    name: Optional[str] = Field(
+        primary_key=True,
+        default=None,
+        nullable=False,
+        description="Name of the import run, the authority id unless the run was given an explicit name",
+    )
+    authority_id: Optional[str] = Field(
+        default=None,
+        nullable=True,
+        index=True,
+        description="Authority of the Things being imported",
+    )
+    min_time_created: Optional[datetime] = Field(
+        default=None,
+        nullable=True,
+        description="Only Things created at or after this time are imported by the run",
+    )
+    min_primary_key: int = Field(
+        default=0,
+        nullable=False,
+        description="The run imports Things with a primary key greater than this",
+    )
+    max_primary_key: Optional[int] = Field(
+        default=None,
+        nullable=True,
+        description="The run imports Things with a primary key up to and including this, None for no upper bound",
+    )
+    last_primary_key: int = Field(
+        default=0,
+        nullable=False,
+        description="Primary key of the last Thing whose solr documents were successfully posted",
+    )
+    num_things: int = Field(
+        default=0,
+        nullable=False,
+        description="Number of Things processed so far",
+    )
+    num_records: int = Field(
+        default=0,
+        nullable=False,
+        description="Number of solr documents posted so far",
+    )
+    num_excluded: int = Field(
+        default=0,
+        nullable=False,
+        description="Number of Things deliberately excluded from the index so far",
+    )
+    num_failures: int = Field(
+        default=0,
+        nullable=False,
+        description="Number of Things that failed to transform so far",
+    )
+    failed_ids: Optional[list] = Field(
+        sa_column=sqlalchemy.Column(
+            StringListType,
+            nullable=True,
+            default=None,
+            doc="Ids of the Things that failed to transform",
+        )
+    )
+    tstarted: Optional[datetime] = Field(
+        default=None,
+        nullable=True,
+        description="When the import run was started",
+    )
+    tstamp: Optional[datetime] = Field(
+        default=None,
+        nullable=True,
+        description="When the checkpoint was last saved",
+    )
+    tcompleted: Optional[datetime] = Field(
+        default=None,
+        nullable=True,
+        description="When the last invocation of the import run finished, None while one is in progress",
+    )
@@ -5,6 +5,7 @@ import typing
 from sqlmodel import Field, SQLModel
 from datetime import datetime
 import sqlalchemy
+import sqlalchemy.orm
 
 from isb_lib.models.conditional_jsonb_type import ConditionalJSONB
 from isb_lib.models.string_list_type import StringListType
@@ -142,6 +143,65 @@ class ThingIdentifier(SQLModel, table=True):
     )
 
 
+def thing_identifier_keys(thing_id: typing.Optional[str], identifiers: typing.Optional[typing.Iterable[str]]) -> typing.Set[str]:
+    """The identifiers a Thing is looked up by, its id and its additional identifiers"""
+    return {identifier for identifier in (thing_id, *(identifiers or [])) if identifier is not None}
+
+
+def upsert_thing_identifiers(connection: sqlalchemy.engine.Connection, primary_keys: typing.Dict[str, int]):
+    """Points the ThingIdentifier rows of the identifiers at the Things with the given primary keys.
+
+    ThingIdentifier mirrors Thing.identifiers with one row per identifier, so alias lookups are a probe of its primary
+    key instead of a scan of every Thing's identifiers.  Rows that already point at the right Thing aren't written.
+    When an identifier moves to another Thing the last write wins, and identifiers removed from a Thing keep pointing
+    at it.
+    """
+    table = SQLModel.metadata.tables["thingidentifier"]
+    now = igsn_lib.time.dtnow()
+    identifiers = list(primary_keys.keys())
+    for start in range(0, len(identifiers), 1000):
+        batch = identifiers[start:start + 1000]
+        existing_select = sqlalchemy.select(table.c.guid, table.c.thing_id).where(table.c.guid.in_(batch))
+        existing = {row[0]: row[1] for row in connection.execute(existing_select)}
+        new_rows = [
+            {"guid": identifier, "tstamp": now, "thing_id": primary_keys[identifier]}
+            for identifier in batch
+            if identifier not in existing
+        ]
+        moved_rows = [
+            {"b_guid": identifier, "b_thing_id": primary_keys[identifier]}
+            for identifier, thing_id in existing.items()
+            if thing_id != primary_keys[identifier]
+        ]
+        if len(new_rows) > 0:
+            connection.execute(table.insert(), new_rows)
+        if len(moved_rows) > 0:
+            connection.execute(
+                table.update()
+                .where(table.c.guid == sqlalchemy.bindparam("b_guid"))
+                .values(thing_id=sqlalchemy.bindparam("b_thing_id"), tstamp=now),
+                moved_rows,
+            )
+
+
+def _thing_primary_keys(thing: Thing) -> typing.Dict[str, int]:
+    # Only called once the Thing is flushed, so it has its primary key
+    assert thing.primary_key is not None
+    return dict.fromkeys(thing_identifier_keys(thing.id, thing.identifiers), thing.primary_key)
+
+
+@sqlalchemy.event.listens_for(Thing, "after_insert")
+def _index_inserted_thing_identifiers(mapper, connection, thing: Thing):
+    upsert_thing_identifiers(connection, _thing_primary_keys(thing))
+
+
+@sqlalchemy.event.listens_for(Thing, "after_update")
+def _index_updated_thing_identifiers(mapper, connection, thing: Thing):
+    attributes = sqlalchemy.orm.attributes.instance_state(thing).attrs
+    if attributes.identifiers.history.has_changes() or attributes.id.history.has_changes():
+        upsert_thing_identifiers(connection, _thing_primary_keys(thing))
+
+
 class Point(SQLModel, table=True):
     h3: Optional[str] = Field(
         primary_key=True,
@@ -0,0 +1,46 @@
+from datetime import datetime
+from typing import Any, Optional
+
+import sqlalchemy
+from sqlmodel import SQLModel, Field
+
+from isb_lib.models.conditional_jsonb_type import ConditionalJSONB
+
+
+class TransformCacheEntry(SQLModel, table=True):
+    key: Optional[str] = Field(
+        primary_key=True,
+        default=None,
+        nullable=False,
+        description="Digest of the authority, identifier, content hash, transformer version and kind of output",
+    )
+    authority_id: Optional[str] = Field(
+        default=None,
+        nullable=True,
+        index=True,
+        description="Authority of the Thing that was transformed",
+    )
+    identifier: Optional[str] = Field(
+        default=None,
+        nullable=True,
+        index=True,
+        description="Identifier the Thing was transformed for",
+    )
+    transformer_version: int = Field(
+        default=0,
+        nullable=False,
+        description="Transformer.VERSION of the code that did the transform",
+    )
+    content: Optional[Any] = Field(
+        sa_column=sqlalchemy.Column(
+            ConditionalJSONB,
+            nullable=True,
+            default=None,
+            doc="The transformer output",
+        ),
+    )
+    tstamp: Optional[datetime] = Field(
+        default=None,
+        nullable=True,
+        description="When the entry was cached",
+    )
@@ -0,0 +1,75 @@
+import datetime
+import hashlib
+import os
+import typing
+from typing import Optional
+
+from isb_web import config
+from isb_web import sqlmodel_database
+from isb_web.sqlmodel_database import SQLModelDAO
+
+
+class PredictionStore:
+    """Persists model server predictions in the ModelPrediction table so they survive restarts and reindexes.
+
+    Predictions are keyed by model type, model version and a digest of the normalized request, so after a model's
+    version is bumped in modelserver_model_versions only the predictions of that model are made again.  The store is
+    consulted by ModelServerClient between its in-process cache and the model server.  Each process connects to the
+    database on first use, so a store may be handed to forked worker processes.
+    """
+
+    def __init__(self, db_url: str, model_versions: Optional[typing.Dict[str, str]] = None):
+        self._db_url = db_url
+        self._model_versions = model_versions if model_versions is not None else config.Settings().modelserver_model_versions
+        self._dao: Optional[SQLModelDAO] = None
+        self._pid: Optional[int] = None
+
+    def __getstate__(self) -> dict:
+        # Worker processes connect on their own
+        return {**self.__dict__, "_dao": None, "_pid": None}
+
+    def _session(self):
+        # Database connections can't be shared with a forked process, so connect again in each one
+        if self._dao is None or self._pid != os.getpid():
+            self._dao = SQLModelDAO(self._db_url)
+            self._pid = os.getpid()
+        return self._dao.get_session()
+
+    def model_version(self, model_type: str) -> str:
+        return self._model_versions.get(model_type, "0")
+
+    def _key(self, model_type: str, input_hash: str) -> str:
+        key_str = f"{model_type}\x1f{self.model_version(model_type)}\x1f{input_hash}"
+        return hashlib.sha256(key_str.encode("utf-8")).hexdigest()
+
+    def get_many(self, model_type: str, input_hashes: typing.List[str]) -> typing.Dict[str, typing.Any]:
+        """Returns the stored predictions of whichever input hashes have one"""
+        keys = {self._key(model_type, input_hash): input_hash for input_hash in input_hashes}
+        session = self._session()
+        try:
+            stored = sqlmodel_database.model_predictions(session, list(keys.keys()))
+        finally:
+            session.close()
+        return {keys[key]: prediction for key, prediction in stored.items()}
+
+    def put_many(self, model_type: str, predictions: typing.Dict[str, typing.Any]):
+        """Stores predictions, a dictionary of input hash to model server response"""
+        if len(predictions) == 0:
+            return
+        now = datetime.datetime.now()
+        mappings = [
+            {
+                "key": self._key(model_type, input_hash),
+                "model_type": model_type,
+                "model_version": self.model_version(model_type),
+                "input_hash": input_hash,
+                "prediction": prediction,
+                "tstamp": now,
+            }
+            for input_hash, prediction in predictions.items()
+        ]
+        session = self._session()
+        try:
+            sqlmodel_database.save_model_predictions(session, mappings)
+        finally:
+            session.close()
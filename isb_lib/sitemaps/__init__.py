@@ -4,15 +4,18 @@ Module for parsing sitemap.xml documents.
 Chunks of this code based on https://github.com/scrapy/scrapy/blob/master/scrapy/utils/sitemap.py
 """
 import asyncio
+import contextlib
 import datetime
 import types
 import logging
 import re
 import struct
 import io
+import itertools
 import gzip
 import typing
 import urllib.parse
+import zlib
 import lxml.etree
 import requests
 import dateparser
@@ -75,26 +78,45 @@ def xmlesc(txt):
     return txt.translate(table)
 
 
-# adapted from https://github.com/Haikson/sitemap-generator/blob/master/pysitemap/format_processors/xml.py
-async def write_urlset_file(dest_path: str, host: str, urls: typing.List[UrlSetEntry]):
-    async with AIOFile(dest_path, "w") as aiodf:
-        writer = Writer(aiodf)
-        header = """<?xml version="1.0" encoding="utf-8"?>
+URLSET_HEADER = """<?xml version="1.0" encoding="utf-8"?>
 <urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" \
 xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" \
 xsi:schemaLocation="http://www.sitemaps.org/schemas/sitemap/0.9 \
 http://www.sitemaps.org/schemas/sitemap/0.9/sitemap.xsd">\n"""
-        await writer(header)
+
+SITEMAP_INDEX_HEADER = """<?xml version="1.0" encoding="utf-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" \
+xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" \
+xsi:schemaLocation="http://www.sitemaps.org/schemas/sitemap/0.9 \
+https://www.sitemaps.org/schemas/sitemap/0.9/siteindex.xsd">\n"""
+
+
+def urlset_entry_xml(host: str, entry: UrlSetEntry) -> str:
+    loc_str = xmlesc(
+        os.path.join(host, entry.loc_suffix())
+    )
+    lastmod_str = ""
+    if entry.last_mod_str is not None:
+        lastmod_str = f"\n    <lastmod>{xmlesc(entry.last_mod_str)}</lastmod>"
+    return f"  <url>\n    <loc>{loc_str}</loc>{lastmod_str}\n  </url>\n"
+
+
+def sitemap_index_entry_xml(host: str, sitemap_index_entry: SitemapIndexEntry) -> str:
+    loc_str = xmlesc(
+        os.path.join(host, sitemap_index_entry.loc_suffix())
+    )
+    lastmod_str = xmlesc(sitemap_index_entry.last_mod_str)
+    return f"  <sitemap>\n    <loc>{loc_str}</loc>\n    <lastmod>{lastmod_str}</lastmod>\n  </sitemap>\n"
+
+
+# adapted from https://github.com/Haikson/sitemap-generator/blob/master/pysitemap/format_processors/xml.py
+async def write_urlset_file(dest_path: str, host: str, urls: typing.List[UrlSetEntry]):
+    async with AIOFile(dest_path, "w") as aiodf:
+        writer = Writer(aiodf)
+        await writer(URLSET_HEADER)
         await aiodf.fsync()
         for entry in urls:
-            loc_str = xmlesc(
-                os.path.join(host, entry.loc_suffix())
-            )
-            lastmod_str = ""
-            if entry.last_mod_str is not None:
-                lastmod_str = f"\n    <lastmod>{xmlesc(entry.last_mod_str)}</lastmod>"
-            url_str = f"  <url>\n    <loc>{loc_str}</loc>{lastmod_str}\n  </url>\n"
-            await writer(url_str)
+            await writer(urlset_entry_xml(host, entry))
         await aiodf.fsync()
 
         await writer("</urlset>")
@@ -107,27 +129,56 @@ async def write_sitemap_index_file(
     index_file_path = os.path.join(base_path, INDEX_XML)
     async with AIOFile(index_file_path, "w") as aiodf:
         writer = Writer(aiodf)
-        header = """<?xml version="1.0" encoding="utf-8"?>
-<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" \
-xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" \
-xsi:schemaLocation="http://www.sitemaps.org/schemas/sitemap/0.9 \
-https://www.sitemaps.org/schemas/sitemap/0.9/siteindex.xsd">\n"""
-        await writer(header)
+        await writer(SITEMAP_INDEX_HEADER)
         await aiodf.fsync()
         for sitemap_index_entry in sitemap_index_entries:
-            loc_str = xmlesc(
-                os.path.join(host, sitemap_index_entry.loc_suffix())
-            )
-            lastmod_str = xmlesc(sitemap_index_entry.last_mod_str)
-            await writer(
-                f"  <sitemap>\n    <loc>{loc_str}</loc>\n    <lastmod>{lastmod_str}</lastmod>\n  </sitemap>\n"
-            )
+            await writer(sitemap_index_entry_xml(host, sitemap_index_entry))
         await aiodf.fsync()
 
         await writer("</sitemapindex>")
         await aiodf.fsync()
 
 
+@contextlib.contextmanager
+def atomic_sitemap_file(dest_path: str) -> typing.Iterator[typing.TextIO]:
+    """Opens a temporary file for writing that replaces dest_path once it has been written without error.
+
+    Readers of dest_path see either the previous version or the complete new one.  The file is gzipped if dest_path
+    ends in .gz.
+    """
+    temp_path = f"{dest_path}.tmp"
+    try:
+        if dest_path.endswith(".gz"):
+            # mtime=0 so the same urls always compress to the same bytes
+            with gzip.GzipFile(temp_path, "wb", mtime=0) as gzip_file, io.TextIOWrapper(gzip_file, "utf-8") as f:
+                yield f
+        else:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                yield f
+        os.replace(temp_path, dest_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def write_urlset(dest_path: str, host: str, urls: typing.Iterable[UrlSetEntry]):
+    """Writes an urlset file like write_urlset_file, but synchronously, atomically and gzipped for .gz paths"""
+    with atomic_sitemap_file(dest_path) as f:
+        f.write(URLSET_HEADER)
+        for entry in urls:
+            f.write(urlset_entry_xml(host, entry))
+        f.write("</urlset>")
+
+
+def write_sitemap_index(dest_path: str, host: str, sitemap_index_entries: typing.Iterable[SitemapIndexEntry]):
+    """Writes a sitemap index file like write_sitemap_index_file, but synchronously and atomically"""
+    with atomic_sitemap_file(dest_path) as f:
+        f.write(SITEMAP_INDEX_HEADER)
+        for sitemap_index_entry in sitemap_index_entries:
+            f.write(sitemap_index_entry_xml(host, sitemap_index_entry))
+        f.write("</sitemapindex>")
+
+
 def build_sitemap(base_path: str, host: str, iterator: typing.Iterator):
     loop = asyncio.get_event_loop()
     future = asyncio.ensure_future(_build_sitemap(base_path, host, iterator))
@@ -239,21 +290,131 @@ class SiteMapIterator(object):
 
     def __iter__(self):
         for elem in self._root.getchildren():
-            d = {}
-            for el in elem.getchildren():
-                tag = el.tag
-                name = tag.split("}", 1)[1] if "}" in tag else tag
+            d = _sitemap_entry(elem)
+            if "loc" in d:
+                yield d
+
+
+def _sitemap_entry(elem) -> dict:
+    d: dict[str, typing.Any] = {}
+    for el in elem.getchildren():
+        tag = el.tag
+        if not isinstance(tag, str):
+            # comments and processing instructions
+            continue
+        name = tag.split("}", 1)[1] if "}" in tag else tag
+
+        if name == "link":
+            if "href" in el.attrib:
+                d.setdefault("alternate", []).append(el.get("href"))
+        else:
+            d[name] = el.text.strip() if el.text else ""
+    return d
+
+
+def _gunzip_chunks(chunks: typing.Iterable[bytes], chunk_size: int, url: str) -> typing.Iterator[bytes]:
+    decompressor = None
+    for chunk in chunks:
+        while chunk:
+            if decompressor is None:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            try:
+                yield decompressor.decompress(chunk, chunk_size)
+            except zlib.error as e:
+                L.warning("Stopped reading corrupt gzip sitemap %s: %s", url, e)
+                return
+            # concatenated gzip members continue with a new decompressor
+            chunk = decompressor.unconsumed_tail or decompressor.unused_data
+            if decompressor.eof:
+                decompressor = None
+    if decompressor is not None:
+        yield decompressor.flush()
+
+
+def iter_sitemap_chunks(response: requests.Response, chunk_size: int = 65536) -> typing.Iterator[bytes]:
+    """Yields the sitemap document in the response as it arrives, gunzipping it on the fly if it's gzipped.
 
-                if name == "link":
-                    if "href" in el.attrib:
-                        d.setdefault("alternate", []).append(el.get("href"))
-                else:
-                    d[name] = el.text.strip() if el.text else ""
+    Chunks are at most chunk_size bytes after decompression, so a highly compressed sitemap doesn't get parsed far
+    ahead of its consumer.  Like gunzip, a truncated or corrupt gzip stream yields as much as could be decompressed
+    instead of raising.
+    """
+    if not response.ok:
+        L.warning("Got status %s for sitemap %s", response.status_code, response.url)
+        # Read the error body so the connection can be reused
+        response.content
+        return
+    chunks = response.iter_content(chunk_size)
+    first_chunk = next(chunks, b"")
+    chunks = itertools.chain([first_chunk], chunks)
+    if first_chunk[:3] == b"\x1f\x8b\x08":
+        yield from _gunzip_chunks(chunks, chunk_size, response.url)
+    else:
+        yield from chunks
+
+
+class SiteMapStreamIterator(object):
+    '''Iterates over a single XML sitemap document while it is being read.
+
+    Unlike SiteMapIterator, the document doesn't have to be in memory: chunks are fed to a pull parser as the
+    iteration needs them, and each entry is dropped from the tree once it has been yielded, so memory use doesn't
+    grow with the size of the sitemap.
+    '''
+    def __init__(self, chunks: typing.Iterable[bytes]):
+        self._chunks = iter(chunks)
+        # Only report the root and its entries, the elements within the entries are read from the entries
+        self._parser = lxml.etree.XMLPullParser(
+            events=("start", "end"),
+            tag=("{*}urlset", "{*}sitemapindex", "{*}url", "{*}sitemap"),
+            recover=True,
+            remove_comments=True,
+            resolve_entities=False,
+        )
+        self._events = self._read_events()
+        self._root = None
+        self.type = None
+        # Read just far enough to know what kind of sitemap this is
+        for event, elem in self._events:
+            if event == "start":
+                self._root = elem
+                rt = elem.tag
+                self.type = rt.split("}", 1)[1] if "}" in rt else rt
+                break
+
+    def _read_events(self):
+        for chunk in self._chunks:
+            self._parser.feed(chunk)
+            yield from self._parser.read_events()
+        try:
+            self._parser.close()
+        except lxml.etree.XMLSyntaxError:
+            # nothing parseable at all, e.g. an empty response
+            pass
+        yield from self._parser.read_events()
 
+    def __iter__(self):
+        if self._root is None:
+            return
+        for event, elem in self._events:
+            if event != "end" or elem is self._root:
+                continue
+            d = _sitemap_entry(elem)
+            # Free the entry and any siblings before it
+            elem.clear()
+            while elem.getprevious() is not None:
+                del self._root[0]
             if "loc" in d:
                 yield d
 
 
+def iterparse_sitemap(response: requests.Response) -> typing.Iterator[typing.Tuple[str, typing.Optional[str]]]:
+    """Yields (loc, lastmod) for each entry of the sitemap or sitemap index in response, as it is read.
+
+    Request the response with stream=True to overlap fetching with parsing.
+    """
+    for d in SiteMapStreamIterator(iter_sitemap_chunks(response)):
+        yield d["loc"], d.get("lastmod")
+
+
 class SiteMap(object):
     def __init__(self, url, start_from: datetime.datetime, alt_rules=None, session=requests.Session(), url_prefix=None):
         self.sitemap_url = url
@@ -305,15 +466,18 @@ class SiteMap(object):
             for url in sitemapUrlsFromRobots(response.text, base_url=response.url):
                 yield {"task": "request", "body": {"url": url, "cb": self.parseSitemap}}
         else:
-            body = self.getSitemapBody(response)
-            if body is None:
+            s = SiteMapStreamIterator(iter_sitemap_chunks(response))
+            if s.type is None:
                 L.warning("Ignoring invalid sitemap: %s", response.url)
                 return
-            s = SiteMapIterator(body)
             L.info("Sitemap type = %s", s.type)
             s_it = self.sitemapFilter(s)
             if s.type == "sitemapindex":
-                for (loc, ts) in iterloc(s_it, self.sitemap_alternate_links):
+                # Read the whole index before following it, rather than holding its response open while the
+                # sitemaps it lists are scanned
+                locs = [loc for (loc, ts) in iterloc(s_it, self.sitemap_alternate_links)]
+                response.close()
+                for loc in locs:
                     if any(x.search(loc) for x in self._follow):
                         yield {
                             "task": "sitemap",
@@ -344,7 +508,7 @@ class SiteMap(object):
 
     def scanItems(self, iter=None):
         if iter is None:
-            response = self._session.get(self.sitemap_url)
+            response = self._session.get(self.sitemap_url, stream=True)
             iter = self.parseSitemap(response)
         # if handed an iterator, iterate...
         if isinstance(iter, types.GeneratorType):
@@ -353,9 +517,9 @@ class SiteMap(object):
                 if task == "sitemap":
                     url = action["body"]["url"]
                     url = self._prepare_sitemap_url(url)
-                    r = self._session.get(url)
-                    for item in self.scanItems(action["body"]["cb"](r)):
-                        yield item
+                    with self._session.get(url, stream=True) as r:
+                        for item in self.scanItems(action["body"]["cb"](r)):
+                            yield item
                 elif task == "load":
                     cb = action["body"].pop("cb")
                     params = action["body"]
@@ -0,0 +1,147 @@
+import logging
+import queue
+import threading
+import time
+import typing
+from typing import Optional
+
+# Latencies shorter than this are treated as this long, differences below it are noise rather than congestion
+MIN_LATENCY = 0.01
+
+
+class AIMDConcurrencyLimiter:
+    """Limits the number of concurrent requests to a remote server, adapting the limit to what the server can handle.
+
+    The limit follows additive increase, multiplicative decrease like TCP congestion control.  Each request that
+    succeeds without slowing down raises the limit by 1 / limit, so about one more request per round of requests, up
+    to max_limit.  A 5xx response, a failed request or a response more than latency_tolerance times slower (per unit
+    of size) than the fastest one seen multiplies the limit by backoff_factor, down to min_limit.  Only requests
+    started after the last decrease can decrease it again, so the requests that were already in flight when the server
+    started struggling don't compound the decrease.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 1,
+        min_limit: int = 1,
+        max_limit: int = 8,
+        backoff_factor: float = 0.5,
+        latency_tolerance: float = 2.0,
+    ):
+        self._condition = threading.Condition()
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._backoff_factor = backoff_factor
+        self._latency_tolerance = latency_tolerance
+        self._min_unit_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self.in_flight = 0
+        self.num_requests = 0
+        self.num_failures = 0
+        self.num_decreases = 0
+
+    def acquire(self) -> float:
+        """Waits for a free slot under the current limit, and returns the start time to pass to release"""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+        return time.monotonic()
+
+    def _is_congested(self, unit_latency: float, succeeded: bool) -> bool:
+        if not succeeded:
+            return True
+        if self._min_unit_latency is None or unit_latency < self._min_unit_latency:
+            self._min_unit_latency = unit_latency
+        return unit_latency > self._min_unit_latency * self._latency_tolerance
+
+    def release(self, started: float, succeeded: bool, size: int = 1):
+        """Frees the request's slot and adjusts the limit.
+
+        Args:
+            started: The time returned by acquire
+            succeeded: False for 5xx responses and requests that failed outright
+            size: How much the request asked for, latencies are compared per unit of size
+        """
+        now = time.monotonic()
+        with self._condition:
+            self.in_flight -= 1
+            self.num_requests += 1
+            if not succeeded:
+                self.num_failures += 1
+            if self._is_congested(max(now - started, MIN_LATENCY) / max(size, 1), succeeded):
+                if started >= self._last_decrease:
+                    self.limit = max(float(self._min_limit), self.limit * self._backoff_factor)
+                    self._last_decrease = now
+                    self.num_decreases += 1
+                    logging.info(f"Reduced the request concurrency limit to {int(self.limit)}")
+            else:
+                self.limit = min(float(self._max_limit), self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def __str__(self) -> str:
+        return (
+            f"concurrency limit {int(self.limit)}, {self.num_requests} requests, {self.num_failures} failed, "
+            f"{self.num_decreases} limit decreases"
+        )
+
+
+class OrderedQueueWriter:
+    """Hands results to write_function on a single background thread, in the order they were reserved.
+
+    Producers call reserve() to get the next sequence number before starting the work that produces a result, and
+    put() the result (None if there isn't one) when it's done, from any thread.  Results that finish early wait for
+    the earlier ones, so writes happen in the same order as they would serially.  At most max_pending results can be
+    reserved and not yet written, reserve() blocks until an earlier one has been written.  If write_function raises,
+    the error is re-raised by the next reserve() or by close().
+    """
+
+    def __init__(self, write_function: typing.Callable[[typing.Any], None], max_pending: int):
+        self._write_function = write_function
+        self._queue: queue.Queue = queue.Queue()
+        self._slots = threading.Semaphore(max_pending)
+        self._next_sequence_number = 0
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name="ordered_queue_writer", daemon=True)
+        self._thread.start()
+
+    def reserve(self) -> int:
+        self._slots.acquire()
+        if self._error is not None:
+            raise self._error
+        sequence_number = self._next_sequence_number
+        self._next_sequence_number += 1
+        return sequence_number
+
+    def put(self, sequence_number: int, result: typing.Any):
+        self._queue.put((sequence_number, result))
+
+    def _write(self, result: typing.Any):
+        if result is None or self._error is not None:
+            return
+        try:
+            self._write_function(result)
+        except BaseException as e:
+            logging.critical(f"Error writing result, no more results will be written: {e}")
+            self._error = e
+
+    def _run(self):
+        pending: typing.Dict[int, typing.Any] = {}
+        next_to_write = 0
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            pending[item[0]] = item[1]
+            while next_to_write in pending:
+                self._write(pending.pop(next_to_write))
+                next_to_write += 1
+                self._slots.release()
+
+    def close(self):
+        """Waits for every reserved result to be written.  All of them must have been put first."""
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
@@ -1,67 +1,244 @@
 from __future__ import annotations
+import collections
 import re
+import threading
 import urllib.parse
 from abc import ABC
 import datetime
+import gzip
+import tempfile
 from typing import Iterator, Optional
 
-import lxml.etree
+import ijson
 import requests
 import typing
+import urllib3
 import logging
 
 import isb_lib.core
+import isb_lib.sitemaps
 import json
+from isb_lib.core import MEDIA_JSON, MEDIA_NDJSON
+from isb_lib.sitemaps.concurrency import AIMDConcurrencyLimiter
 
 
 IDENTIFIER_REGEX = re.compile(r".*/thing/(.*)")
 
 NUM_RETRIES = 5
 
+# Prefer streamed newline delimited JSON, and only gzip so the body can always be decoded as it arrives
+REQUEST_HEADERS = {
+    "Accept": f"{MEDIA_NDJSON}, {MEDIA_JSON};q=0.9",
+    "Accept-Encoding": "gzip",
+}
+
+# Fetched things are handed to the consumer in pages of this many
+THINGS_PAGE_SIZE = 100
+
+# The most pages of fetched things kept in memory until the consumer takes them.  Things that arrive while that many
+# are waiting are kept in a temporary file instead, in memory unless it's bigger than SPOOL_MAX_SIZE.
+MAX_QUEUED_PAGES = 20
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+
+def _ndjson_things(chunks: typing.Iterable[bytes]) -> typing.Iterator[dict]:
+    """Decodes newline delimited JSON from chunks of bytes that needn't end at line ends"""
+    partial_line = b""
+    for chunk in chunks:
+        lines = (partial_line + chunk).split(b"\n")
+        partial_line = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if partial_line.strip():
+        yield json.loads(partial_line)
+
 
 class ThingsFetcher:
+    """Fetches a batch of things from an iSamples /things endpoint.
+
+    The things are requested as gzipped newline delimited JSON, and servers that don't support it answer with a
+    plain JSON array.  fetch_things decodes the things from the response as it arrives and hands them over in pages,
+    and iter_json_things yields them on the consuming thread as they're handed over, so a consumer started alongside
+    the fetch saves things while the rest are still being transferred.  Pages the consumer hasn't taken yet are kept
+    in memory up to MAX_QUEUED_PAGES, and the things after that are written to a temporary file, so a batch waiting
+    for its turn neither holds the server's response open nor has to be held as a whole list of parsed things.  When
+    reading a response fails part of the way through, the request is retried and only the things that weren't handed
+    over yet are.
+    """
+
     def __init__(
         self,
         url: str,
         sitemap_url: str,
         identifiers: set[str],
         session: requests.Session = requests.session(),
+        concurrency_limiter: Optional[AIMDConcurrencyLimiter] = None,
     ):
         self.url = url
         self.sitemap_url = sitemap_url
         self._session = session
+        self._concurrency_limiter = concurrency_limiter
         self.identifiers = list(identifiers)
-        self.json_things: list[dict] = []
-        self.primary_keys_fetched: Optional[list[str]] = None
+        self._condition = threading.Condition()
+        self._pages: typing.Deque[list[dict]] = collections.deque()
+        self._page: list[dict] = []
+        self._spool: Optional[typing.IO[bytes]] = None
+        self._delivered_ids: set[str] = set()
+        self._done = False
+        self._closed = False
+        self._fetched = False
+
+    def _deliver(self, thing: dict):
+        if thing.get("id") in self._delivered_ids:
+            # Already handed over before a retry
+            return
+        self._page.append(thing)
+        if len(self._page) >= THINGS_PAGE_SIZE:
+            self._flush_page()
+
+    def _flush_page(self):
+        page = self._page
+        self._page = []
+        if len(page) == 0:
+            return
+        self._delivered_ids.update(thing.get("id") for thing in page)
+        with self._condition:
+            if self._closed:
+                return
+            if self._spool is None and len(self._pages) < MAX_QUEUED_PAGES:
+                self._pages.append(page)
+                self._condition.notify_all()
+                return
+            if self._spool is None:
+                self._spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+            # Once things spill over, all the later ones do too so they stay in order
+            for thing in page:
+                self._spool.write(json.dumps(thing).encode("utf-8") + b"\n")
+
+    def _json_array_things(self, response: requests.Response) -> typing.Iterator[dict]:
+        content_encoding = response.headers.get("Content-Encoding")
+        stream: typing.Union[typing.IO[bytes], gzip.GzipFile]
+        if content_encoding == "gzip":
+            stream = gzip.GzipFile(fileobj=response.raw, mode="rb")
+        elif content_encoding in (None, "identity"):
+            stream = response.raw
+        else:
+            raise ValueError(f"Unsupported content encoding {content_encoding} from {self.url}")
+        return ijson.items(stream, "item", use_float=True)
+
+    def _deliver_body(self, response: requests.Response):
+        if response.headers.get("Content-Type", MEDIA_JSON).startswith(MEDIA_NDJSON):
+            # Chunks are gunzipped and returned as soon as they arrive rather than once a buffer is full
+            things = _ndjson_things(response.iter_content(chunk_size=None))
+        else:
+            things = self._json_array_things(response)
+        for thing in things:
+            if self._closed:
+                return
+            self._deliver(thing)
+        self._flush_page()
+
+    def _post(self, data: bytes) -> int:
+        """Posts the request, hands over the things of a successful response and returns the status code"""
+        started = None
+        if self._concurrency_limiter is not None:
+            started = self._concurrency_limiter.acquire()
+        succeeded = False
+        try:
+            with self._session.post(
+                self.url, data=data, headers=REQUEST_HEADERS, stream=True, timeout=90
+            ) as response:
+                if response.status_code == 200:
+                    self._deliver_body(response)
+                # Only server errors mean the server is struggling, client errors would fail at any concurrency
+                succeeded = response.status_code < 500
+                return response.status_code
+        finally:
+            if self._concurrency_limiter is not None and started is not None:
+                self._concurrency_limiter.release(started, succeeded, len(self.identifiers))
 
     def fetch_things(self) -> ThingsFetcher:
         try:
             for i in range(NUM_RETRIES):
-                # headers = {"Content-Type": "application/json"}
                 params = {
                     "identifiers": self.identifiers,
                 }
                 data = json.dumps(params).encode("utf-8")
                 logging.info(f"Going to fetch {len(self.identifiers)} things from {self.sitemap_url} at {self.url}")
-                response = self._session.post(self.url, data=data, timeout=90)
-                if response.status_code != 200:
-                    logging.error(f"Got response code {response.status_code} from {self.url}, will retry")
+                try:
+                    status_code = self._post(data)
+                except (OSError, EOFError, ValueError, urllib3.exceptions.HTTPError, ijson.JSONError) as e:
+                    # Besides failed requests, these are what a body cut off part of the way through raises
+                    logging.error(f"Error reading response from {self.url}, will retry: {e}")
+                    # The things of the unfinished page weren't handed over, so they're decoded again
+                    self._page = []
+                    continue
+                if status_code != 200:
+                    logging.error(f"Got response code {status_code} from {self.url}, will retry")
                     continue
                 else:
-                    self.json_things = response.json()
                     logging.info(f"Completed fetching {len(self.identifiers)} things from {self.sitemap_url} at {self.url}")
-                    self.primary_keys_fetched = [
-                        json_thing["primary_key"] for json_thing in self.json_things
-                    ]
+                    self._fetched = True
                     break
-            if len(self.json_things) == 0:
+            if not self._fetched:
                 raise RuntimeError(f"Didn't receive a valid response from {self.url} after {NUM_RETRIES} attempts.")
         except Exception as e:
             logging.critical(
                 f"Error fetching things from: url: {self.url} exception is {e}"
             )
+        finally:
+            with self._condition:
+                self._done = True
+                self._condition.notify_all()
         return self
 
+    @property
+    def fetched(self) -> bool:
+        """Whether the whole response was received, waits for the fetch to finish"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._done)
+        return self._fetched
+
+    def _next_page(self) -> Optional[list[dict]]:
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._pages) > 0 or self._done or self._closed)
+            if len(self._pages) > 0 and not self._closed:
+                return self._pages.popleft()
+        return None
+
+    def iter_json_things(self) -> typing.Iterator[dict]:
+        """Yields the fetched things as they're handed over, until the fetch finishes or the fetcher is closed.
+
+        Things can only be iterated once, they're discarded as they're yielded.
+        """
+        while (page := self._next_page()) is not None:
+            yield from page
+        with self._condition:
+            spool = None if self._closed else self._spool
+            self._spool = None
+        if spool is None:
+            return
+        try:
+            spool.seek(0)
+            for line in spool:
+                yield json.loads(line)
+        finally:
+            spool.close()
+
+    @property
+    def json_things(self) -> list[dict]:
+        return list(self.iter_json_things())
+
+    def close(self):
+        """Discards the fetched things, and stops handing over any still being fetched"""
+        with self._condition:
+            self._closed = True
+            self._pages.clear()
+            if self._spool is not None:
+                self._spool.close()
+            self._condition.notify_all()
+
 
 class ThingFetcher:
     def __init__(self, url: str, session: requests.Session = requests.session()):
@@ -114,10 +291,7 @@ class SitemapFetcher(ABC):
 
     def _fetch_file(self):
         logging.info(f"Going to fetch sitemap at {self._url}")
-        res = self._session.get(self._url)
-        root = lxml.etree.fromstring(res.content)
-        sitemap_list = root.getchildren()
-        """These sitemap children look like this:
+        """The sitemap entries look like this:
               <sitemap>
                 <loc>http://mars.cyverse.org/sitemaps/sitemap-5.xml</loc>
                 <lastmod>2006-08-10T12:00:00Z</lastmod>
@@ -129,28 +303,15 @@ class SitemapFetcher(ABC):
                     <lastmod>2021-07-02T22:49:54Z</lastmod>
                   </url>
                 </urlset>
-            Either way, we can parse them the same way
+            Either way, we can parse them the same way.  They're parsed as the response streams in, so only the urls
+            are kept in memory rather than the whole document.
         """
-        for sitemap_child in sitemap_list:
-            loc = (
-                sitemap_child.iterchildren(
-                    "{http://www.sitemaps.org/schemas/sitemap/0.9}loc"
-                )
-                .__next__()
-                .text
-            )
-            lastmod = (
-                sitemap_child.iterchildren(
-                    "{http://www.sitemaps.org/schemas/sitemap/0.9}lastmod"
-                )
-                .__next__()
-                .text
-            )
-            lastmod_date = isb_lib.core.parsed_datetime_from_isamples_format(lastmod)
-            if (
-                self._last_modified is None
-                or lastmod_date.timestamp() >= self._last_modified.timestamp()
-            ):
+        with self._session.get(self._url, stream=True) as res:
+            for loc, lastmod in isb_lib.sitemaps.iterparse_sitemap(res):
+                if self._last_modified is not None and lastmod is not None:
+                    lastmod_date = isb_lib.core.parsed_datetime_from_isamples_format(lastmod)
+                    if lastmod_date.timestamp() < self._last_modified.timestamp():
+                        continue
                 self.urls_to_fetch.append(loc)
 
     def url_iterator(self) -> Iterator:
@@ -194,12 +355,6 @@ class SitemapIndexFetcher(SitemapFetcher):
         super().__init__(url, authority, last_modified, session)
 
     def fetch_index_file(self):
-        xmlp = lxml.etree.XMLParser(
-            recover=True,
-            remove_comments=True,
-            resolve_entities=False,
-        )
-        lxml.etree.set_default_parser(xmlp)
         self._fetch_file()
 
     def fetch_child_files(self) -> typing.List[SitemapFileFetcher]:
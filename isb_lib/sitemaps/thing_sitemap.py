@@ -1,12 +1,26 @@
+import collections
+import concurrent.futures
 import datetime
+import itertools
+import json
+import logging
+import os
 import typing
 from typing import Optional
 
 from sqlmodel import Session
 
 from isb_lib.core import datetimeToSolrStr
-from isb_lib.sitemaps import SitemapIndexEntry, UrlSetEntry, ThingUrlSetEntry, ThingSitemapIndexEntry
-from isb_web.sqlmodel_database import things_for_sitemap
+from isb_lib.sitemaps import (
+    INDEX_XML,
+    SitemapIndexEntry,
+    UrlSetEntry,
+    ThingUrlSetEntry,
+    ThingSitemapIndexEntry,
+    write_sitemap_index,
+    write_urlset,
+)
+from isb_web.sqlmodel_database import count_things_for_sitemap, stream_things_for_sitemap, things_for_sitemap
 
 MAX_URLS_IN_SITEMAP = 50000
 
@@ -92,3 +106,147 @@ class ThingSitemapIndexIterator:
         self.num_url_sets = self.num_url_sets + 1
         self._offset = self._offset + self._num_things_per_file
         return next_url_set_iterator
+
+
+SITEMAP_MANIFEST = "sitemap-manifest.json"
+
+
+class ThingSitemapBuilder:
+    """Builds the sitemap of Things, optionally reusing the sitemap files of the previous build.
+
+    Things are listed in tstamp then primary key order, num_things_per_file to a sitemap file.  Saving a Thing moves it
+    to the end of that order, so a file's contents only change when a Thing in it or in an earlier file is updated or
+    removed, and new Things only extend the last files.  Each build records the position of the last Thing of every
+    file in a manifest next to the sitemap.  An incremental build counts the Things up to those positions to find the
+    leading files that still hold the same Things, keeps them, and only streams and rewrites the rest.  Files are
+    written by max_workers threads while the Things are read, gzipped if compress is set, and the index is replaced
+    atomically once they're all written.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        base_path: str,
+        host: str,
+        authority: Optional[str] = None,
+        num_things_per_file: int = MAX_URLS_IN_SITEMAP,
+        compress: bool = False,
+        max_workers: int = 4,
+        status: int = 200,
+    ):
+        self._session = session
+        self._base_path = base_path
+        self._host = host
+        self._authority = authority
+        self._num_things_per_file = num_things_per_file
+        self._compress = compress
+        self._max_workers = max_workers
+        self._status = status
+
+    def _settings(self) -> dict:
+        return {
+            "host": self._host,
+            "authority": self._authority,
+            "status": self._status,
+            "num_things_per_file": self._num_things_per_file,
+            "compress": self._compress,
+        }
+
+    def _read_manifest(self) -> Optional[dict]:
+        manifest_path = os.path.join(self._base_path, SITEMAP_MANIFEST)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path) as manifest_file:
+            return json.load(manifest_file)
+
+    def _write_manifest(self, files: list[dict]):
+        manifest_path = os.path.join(self._base_path, SITEMAP_MANIFEST)
+        with open(f"{manifest_path}.tmp", "w") as manifest_file:
+            json.dump({"settings": self._settings(), "files": files}, manifest_file)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+
+    @staticmethod
+    def _last_position(file: dict) -> tuple[datetime.datetime, int]:
+        return datetime.datetime.fromisoformat(file["last_tstamp"]), file["last_primary_key"]
+
+    def _num_unchanged_files(self, files: list[dict]) -> int:
+        """The number of leading files whose Things are unchanged, found with a binary search over the full files"""
+        num_full_files = 0
+        while num_full_files < len(files) and files[num_full_files]["num_urls"] == self._num_things_per_file:
+            num_full_files += 1
+        low = 0
+        high = num_full_files
+        while low < high:
+            middle = (low + high + 1) // 2
+            count = count_things_for_sitemap(
+                self._session, self._authority, self._status, self._last_position(files[middle - 1])
+            )
+            if count == middle * self._num_things_per_file:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def _write_file(self, index: int, things: list[tuple[str, datetime.datetime, int]]) -> dict:
+        filename = f"sitemap-{index}.xml.gz" if self._compress else f"sitemap-{index}.xml"
+        write_urlset(
+            os.path.join(self._base_path, filename),
+            self._host,
+            (ThingUrlSetEntry(thing_id, datetimeToSolrStr(tstamp)) for thing_id, tstamp, _ in things),
+        )
+        last_id, last_tstamp, last_primary_key = things[-1]
+        return {
+            "filename": filename,
+            "num_urls": len(things),
+            "last_mod": datetimeToSolrStr(last_tstamp),
+            "last_tstamp": last_tstamp.isoformat(),
+            "last_primary_key": last_primary_key,
+        }
+
+    def _write_files(self, first_index: int, after: Optional[tuple[datetime.datetime, int]]) -> list[dict]:
+        things = stream_things_for_sitemap(self._session, self._authority, self._status, after)
+        pending_files: typing.Deque[concurrent.futures.Future] = collections.deque()
+        files: list[dict] = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            while True:
+                batch = list(itertools.islice(things, self._num_things_per_file))
+                if len(batch) == 0:
+                    break
+                pending_files.append(executor.submit(self._write_file, first_index + len(files) + len(pending_files), batch))
+                # Don't read too far ahead of the writers
+                if len(pending_files) >= 2 * self._max_workers:
+                    files.append(pending_files.popleft().result())
+            while len(pending_files) > 0:
+                files.append(pending_files.popleft().result())
+        return files
+
+    def build(self, incremental: bool = False) -> int:
+        """Builds the sitemap and returns the number of sitemap files written"""
+        os.makedirs(self._base_path, exist_ok=True)
+        previous_manifest = self._read_manifest()
+        previous_files = previous_manifest["files"] if previous_manifest is not None else []
+        num_unchanged_files = 0
+        if incremental and previous_manifest is not None and previous_manifest["settings"] == self._settings():
+            num_unchanged_files = self._num_unchanged_files(previous_files)
+        elif incremental:
+            logging.info("No previous sitemap built with the same settings, building all of it")
+        unchanged_files = previous_files[:num_unchanged_files]
+        after = self._last_position(unchanged_files[-1]) if len(unchanged_files) > 0 else None
+        written_files = self._write_files(num_unchanged_files, after)
+        files = unchanged_files + written_files
+        write_sitemap_index(
+            os.path.join(self._base_path, INDEX_XML),
+            self._host,
+            [ThingSitemapIndexEntry(file["filename"], file["last_mod"]) for file in files],
+        )
+        self._write_manifest(files)
+        # Only remove files the new index no longer lists once it's in place
+        filenames = {file["filename"] for file in files}
+        for previous_file in previous_files:
+            stale_path = os.path.join(self._base_path, previous_file["filename"])
+            if previous_file["filename"] not in filenames and os.path.exists(stale_path):
+                os.remove(stale_path)
+        logging.info(
+            f"Kept {num_unchanged_files} unchanged sitemap files and wrote {len(written_files)}, {len(files)} in total"
+        )
+        return len(written_files)
@@ -0,0 +1,221 @@
+import collections
+import concurrent.futures
+import json
+import logging
+import os
+import threading
+import typing
+from typing import Optional
+
+import requests
+
+import isb_lib.core
+from isb_web.isb_solr_query import SolrCursorPage, solr_cursor_pages
+
+ComputeFieldsFunction = typing.Callable[[typing.Dict], Optional[typing.Dict[str, typing.Any]]]
+ComputePageFieldsFunction = typing.Callable[[typing.List[typing.Dict]], typing.List[Optional[typing.Dict[str, typing.Any]]]]
+
+
+def atomic_update_document(record: typing.Dict, changed_fields: typing.Dict[str, typing.Any]) -> typing.Dict:
+    """Builds a solr atomic update that sets only the changed fields of record.  A value of None removes the field."""
+    update: typing.Dict[str, typing.Any] = {"id": record["id"]}
+    # Nested child documents can only be updated in place when solr is told which root document they belong to
+    root = record.get("_root_")
+    if root is not None and root != record["id"]:
+        update["_root_"] = root
+    for field, value in changed_fields.items():
+        update[field] = {"set": value}
+    return update
+
+
+class SolrBackfillCheckpoint:
+    """Progress of a backfill, saved to a JSON file so an interrupted run can be resumed"""
+
+    def __init__(self, path: str, query: str):
+        self.path = path
+        self.query = query
+        self.cursor_mark = "*"
+        self.num_visited = 0
+        self.num_updated = 0
+        self.complete = False
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as checkpoint_file:
+            checkpoint_dict = json.load(checkpoint_file)
+        if checkpoint_dict["query"] != self.query:
+            raise ValueError(f"Checkpoint {self.path} is for query {checkpoint_dict['query']}, not {self.query}")
+        self.cursor_mark = checkpoint_dict["cursor_mark"]
+        self.num_visited = checkpoint_dict["num_visited"]
+        self.num_updated = checkpoint_dict["num_updated"]
+        self.complete = checkpoint_dict["complete"]
+        return True
+
+    def save(self):
+        checkpoint_dict = {
+            "query": self.query,
+            "cursor_mark": self.cursor_mark,
+            "num_visited": self.num_visited,
+            "num_updated": self.num_updated,
+            "complete": self.complete,
+        }
+        # Write then rename so a crash mid-write can't leave a truncated checkpoint behind
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as checkpoint_file:
+            json.dump(checkpoint_dict, checkpoint_file)
+        os.replace(temp_path, self.path)
+
+
+class SolrBackfill:
+    """
+    Backfills computed fields onto existing solr documents with atomic updates.
+
+    Documents matching query are visited with a cursorMark, fetching only the fields listed in fields.  compute_fields
+    is called with each one and returns a dictionary of just the fields to change, or None to leave the document alone.
+    Alternatively, compute_page_fields is called with a whole page of documents and returns those for each of them.
+    The changes are sent as atomic set updates in batches posted from workers threads, so the other stored fields are
+    never refetched or rewritten.  Solr rebuilds the rest of each document from its stored fields, skipping copy field
+    targets, so every field that isn't a copy field target must be stored or have docValues.  There is a single commit
+    at the end.
+
+    Progress is saved to checkpoint_path after every page whose updates have all been accepted.  With resume, the run
+    continues from the page after the last checkpoint -- updates are idempotent, so reposting the pages that were in
+    flight is harmless.  With dry_run, nothing is posted or checkpointed, and the updates are only counted and logged.
+    """
+
+    def __init__(
+        self,
+        solr_url: str,
+        query: str,
+        compute_fields: Optional[ComputeFieldsFunction],
+        fields: Optional[typing.List[str]] = None,
+        page_size: int = 10000,
+        batch_size: int = 1000,
+        workers: int = 4,
+        dry_run: bool = False,
+        resume: bool = False,
+        checkpoint_path: Optional[str] = None,
+        compute_page_fields: Optional[ComputePageFieldsFunction] = None,
+    ):
+        if (compute_fields is None) == (compute_page_fields is None):
+            raise ValueError("Exactly one of compute_fields and compute_page_fields must be given")
+        self._solr_url = solr_url
+        self._query = query
+        self._compute_fields = compute_fields
+        self._compute_page_fields = compute_page_fields
+        self._fields = None if fields is None else ",".join(sorted(set(fields) | {"id", "_root_"}))
+        self._page_size = page_size
+        self._batch_size = batch_size
+        self._workers = workers
+        self._dry_run = dry_run
+        self._thread_local = threading.local()
+        self.checkpoint = SolrBackfillCheckpoint(checkpoint_path or "solr_backfill_checkpoint.json", query)
+        if resume and self.checkpoint.load():
+            logging.info(
+                "Resuming backfill at cursor mark %s, %d visited and %d updated so far",
+                self.checkpoint.cursor_mark,
+                self.checkpoint.num_visited,
+                self.checkpoint.num_updated,
+            )
+        self.checkpoint.complete = False
+
+    def _rsession(self) -> requests.Session:
+        # requests sessions aren't thread safe, so each worker gets its own
+        if not hasattr(self._thread_local, "rsession"):
+            self._thread_local.rsession = requests.session()
+        return self._thread_local.rsession
+
+    def _post_updates(self, updates: typing.List[typing.Dict]) -> int:
+        isb_lib.core.solrAddRecords(self._rsession(), updates, self._solr_url)
+        return len(updates)
+
+    def _changed_fields(
+        self, page: typing.Iterable[typing.Dict]
+    ) -> typing.Iterator[typing.Tuple[typing.Dict, Optional[typing.Dict[str, typing.Any]]]]:
+        if self._compute_page_fields is not None:
+            records = list(page)
+            yield from zip(records, self._compute_page_fields(records))
+        elif self._compute_fields is not None:
+            for record in page:
+                yield record, self._compute_fields(record)
+
+    def _page_updates(self, page: typing.Iterable[typing.Dict]) -> typing.Tuple[int, typing.List[typing.Dict]]:
+        num_visited = 0
+        updates = []
+        for record, changed_fields in self._changed_fields(page):
+            num_visited += 1
+            if changed_fields:
+                updates.append(atomic_update_document(record, changed_fields))
+        return num_visited, updates
+
+    def _complete_page(self, next_cursor_mark: str, num_visited: int, futures: typing.List[concurrent.futures.Future]):
+        num_updated = 0
+        for future in futures:
+            num_updated += future.result()
+        self.checkpoint.cursor_mark = next_cursor_mark
+        self.checkpoint.num_visited += num_visited
+        self.checkpoint.num_updated += num_updated
+        self.checkpoint.save()
+        logging.info(
+            "Backfilled %d documents so far, %d visited", self.checkpoint.num_updated, self.checkpoint.num_visited
+        )
+
+    def _dry_run_page(self, num_visited: int, updates: typing.List[typing.Dict]):
+        if len(updates) > 0 and self.checkpoint.num_updated == 0:
+            logging.info("Dry run, first update would be %s", json.dumps(updates[0]))
+        self.checkpoint.num_visited += num_visited
+        self.checkpoint.num_updated += len(updates)
+
+    def _post_page(
+        self, executor: concurrent.futures.Executor, page: SolrCursorPage, pending: typing.Deque
+    ):
+        num_visited, updates = self._page_updates(page)
+        if self._dry_run:
+            self._dry_run_page(num_visited, updates)
+            return
+        futures = []
+        for start in range(0, len(updates), self._batch_size):
+            futures.append(executor.submit(self._post_updates, updates[start:start + self._batch_size]))
+        # Resuming from the next cursor mark skips this page, fall back to its own if solr didn't return one
+        pending.append((page.next_cursor_mark or page.cursor_mark, num_visited, futures))
+        # Bound the number of pages in flight, and checkpoint the ones that are done in order
+        while len(pending) > self._workers or (len(pending) > 0 and all(f.done() for f in pending[0][2])):
+            self._complete_page(*pending.popleft())
+
+    def _finish(self, rsession: requests.Session):
+        if self._dry_run:
+            logging.info(
+                "Dry run complete, would have updated %d of %d documents",
+                self.checkpoint.num_updated,
+                self.checkpoint.num_visited,
+            )
+            return
+        if self.checkpoint.num_updated > 0:
+            isb_lib.core.solrCommit(rsession, self._solr_url)
+        self.checkpoint.complete = True
+        self.checkpoint.save()
+        logging.info(
+            "Backfill complete, updated %d of %d documents", self.checkpoint.num_updated, self.checkpoint.num_visited
+        )
+
+    def run(self) -> SolrBackfillCheckpoint:
+        rsession = requests.session()
+        pages = solr_cursor_pages(
+            rsession, self._query, self._page_size, None, self._fields, self.checkpoint.cursor_mark
+        )
+        # (next cursor mark, docs visited, futures posting the page's updates), oldest page first
+        pending: typing.Deque = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._workers) as executor:
+            try:
+                for page in pages:
+                    self._post_page(executor, page, pending)
+                while len(pending) > 0:
+                    self._complete_page(*pending.popleft())
+            except BaseException:
+                for _, _, futures in pending:
+                    for future in futures:
+                        future.cancel()
+                raise
+        self._finish(rsession)
+        return self.checkpoint
@@ -22,6 +22,9 @@ consistently, and conveniently identify material samples, record metadata about
 other samples and derived digital content, including images, data, and publications."""
 COLLECTION_TITLE = "iSamples Stac Collection"
 COLLECTION_LICENSE = "CC-BY-4.0"
+# Bump whenever a change alters the output of stac_item_from_solr_dict, so that clients revalidating stac items made by
+# older code don't get a 304 (see isb_web.main.get_stac_item)
+ITEM_VERSION = 1
 
 
 def stac_item_from_solr_dict(
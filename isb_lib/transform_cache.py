@@ -0,0 +1,112 @@
+import collections
+import datetime
+import hashlib
+import json
+import threading
+import typing
+from typing import Optional
+
+from isamples_metadata.Transformer import Transformer
+from isb_web import sqlmodel_database
+
+
+def content_hash(*values: typing.Any) -> str:
+    """A stable digest of JSON serializable values, e.g. a Thing's resolved_content"""
+    serialized = json.dumps(values, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def transform_cache_key(authority_id: str, identifier: str, digest: str, kind: str) -> str:
+    """The cache key of a transform.
+
+    Args:
+        authority_id: The authority of the Thing
+        identifier: The identifier the Thing was transformed for
+        digest: content_hash of everything the transform reads from the Thing
+        kind: Distinguishes different outputs for the same Thing, e.g. core metadata and solr documents
+    """
+    return content_hash(authority_id, identifier, digest, Transformer.VERSION, kind)
+
+
+class TransformCache:
+    """Caches transformer output, keyed by transform_cache_key.
+
+    Entries are held in an in-process LRU of up to maxsize entries, and with persistent also in the TransformCacheEntry
+    table for whichever calls pass a database session.  Since the key covers the transformed content and
+    Transformer.VERSION, entries never need to be invalidated -- changed content simply gets a new key.  Values are
+    stored serialized and every lookup returns a fresh copy, so callers are free to modify what they get back.
+    """
+
+    def __init__(self, maxsize: int = 10000, persistent: bool = False):
+        self._maxsize = maxsize
+        self._persistent = persistent
+        self._entries: collections.OrderedDict[str, str] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_local(self, key: str) -> Optional[str]:
+        with self._lock:
+            serialized = self._entries.get(key)
+            if serialized is not None:
+                self._entries.move_to_end(key)
+            return serialized
+
+    def _put_local(self, key: str, serialized: str):
+        if self._maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = serialized
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def get_many(self, keys: typing.List[str], session=None) -> typing.Dict[str, typing.Any]:
+        """Returns the cached values of whichever keys are in the cache"""
+        values = {}
+        missing_keys = []
+        for key in keys:
+            serialized = self._get_local(key)
+            if serialized is not None:
+                values[key] = json.loads(serialized)
+            else:
+                missing_keys.append(key)
+        if self._persistent and session is not None and len(missing_keys) > 0:
+            for key, value in sqlmodel_database.transform_cache_entries(session, missing_keys).items():
+                self._put_local(key, json.dumps(value))
+                values[key] = value
+        self.hits += len(values)
+        self.misses += len(keys) - len(values)
+        return values
+
+    def get(self, key: str, session=None) -> Optional[typing.Any]:
+        return self.get_many([key], session).get(key)
+
+    def put_many(self, entries: typing.List[typing.Tuple[str, str, str, typing.Any]], session=None):
+        """Caches (key, authority id, identifier, value) tuples"""
+        persist = self._persistent and session is not None
+        now = datetime.datetime.now()
+        mappings = []
+        for key, authority_id, identifier, value in entries:
+            serialized = json.dumps(value)
+            self._put_local(key, serialized)
+            if persist:
+                mappings.append({
+                    "key": key,
+                    "authority_id": authority_id,
+                    "identifier": identifier,
+                    "transformer_version": Transformer.VERSION,
+                    # Store a copy, since the caller may go on to modify value
+                    "content": json.loads(serialized),
+                    "tstamp": now,
+                })
+        if len(mappings) > 0:
+            sqlmodel_database.save_transform_cache_entries(session, mappings)
+
+    def put(self, key: str, authority_id: str, identifier: str, value: typing.Any, session=None):
+        self.put_many([(key, authority_id, identifier, value)], session)
+
+    def clear(self):
+        """Empties the in-process tier"""
+        with self._lock:
+            self._entries.clear()
@@ -10,11 +10,18 @@
     ]
 }
 """
+import datetime
+import hashlib
+import json
 import logging
+import typing
+
 from term_store import TermRepository
 from term_store.db import Term
 
 VOCAB_CACHE: dict = {}
+# (digest of the cached vocabulary, when it was cached) for each VOCAB_CACHE entry, the validators for HTTP caching
+VOCAB_CACHE_GENERATIONS: dict = {}
 
 
 def _read_descendants(term: Term, repository: TermRepository) -> dict:
@@ -49,4 +56,14 @@ def uijson_vocabulary_dict(top_level_uri: str, repository: TermRepository) -> di
     else:
         full_dict = _read_descendants(root_term, repository)
         VOCAB_CACHE[top_level_uri] = full_dict
+        serialized = json.dumps(full_dict, sort_keys=True, separators=(",", ":"))
+        VOCAB_CACHE_GENERATIONS[top_level_uri] = (
+            hashlib.sha256(serialized.encode("utf-8")).hexdigest(),
+            datetime.datetime.now(datetime.timezone.utc),
+        )
         return full_dict
+
+
+def uijson_vocabulary_generation(top_level_uri: str) -> typing.Optional[typing.Tuple[str, datetime.datetime]]:
+    """(digest, when cached) of the cached vocabulary under top_level_uri, None if it isn't cached"""
+    return VOCAB_CACHE_GENERATIONS.get(top_level_uri)
@@ -0,0 +1,102 @@
+"""Support for HTTP conditional requests, so clients and caches can revalidate responses with a 304 Not Modified
+
+Routes compute the validators of the representation they would send from something cheap, e.g. Thing.tstamp,
+and check them with is_not_modified before doing the expensive part of building the response.  Responses with
+validators are sent with Cache-Control: no-cache, so caches revalidate them on every use rather than guessing a
+freshness lifetime from Last-Modified (RFC 9111 section 4.2.2).
+"""
+import datetime
+import email.utils
+import typing
+from typing import Optional
+
+import fastapi
+import fastapi.responses
+
+from isb_lib.transform_cache import content_hash
+
+
+def entity_tag(*values: typing.Any) -> str:
+    """A strong ETag for the representation derived from values.  Anything the response bytes depend on, other than
+    the request URL, needs to be one of the values.
+    """
+    return f'"{content_hash(*values)[:32]}"'
+
+
+def _utc(value: datetime.datetime) -> datetime.datetime:
+    # Naive timestamps in the database are UTC
+    if value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value.astimezone(datetime.timezone.utc)
+
+
+def http_date(value: datetime.datetime) -> str:
+    return email.utils.format_datetime(_utc(value).replace(microsecond=0), usegmt=True)
+
+
+def parse_http_date(value: str) -> Optional[datetime.datetime]:
+    try:
+        return _utc(email.utils.parsedate_to_datetime(value))
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def validator_headers(etag: Optional[str], last_modified: Optional[datetime.datetime] = None) -> dict[str, str]:
+    """The ETag and Last-Modified headers, along with the Cache-Control that makes caches revalidate with them.
+
+    Only pass last_modified for representations that is_not_modified is also given it for.
+    """
+    headers = {}
+    if etag is not None:
+        headers["ETag"] = etag
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    if len(headers) > 0:
+        headers["Cache-Control"] = "no-cache"
+    return headers
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison, so W/ prefixes added by compressing proxies still match
+    opaque_tag = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque_tag for candidate in if_none_match.split(","))
+
+
+def is_conditional(request: fastapi.Request) -> bool:
+    """Whether the request has validators to check at all, so routes only look up their own when it's worth it"""
+    return request.method in ("GET", "HEAD") and (
+        "If-None-Match" in request.headers or "If-Modified-Since" in request.headers
+    )
+
+
+def is_not_modified(
+    request: fastapi.Request, etag: Optional[str], last_modified: Optional[datetime.datetime] = None
+) -> bool:
+    """Whether the client's copy of the representation is current, per If-None-Match or If-Modified-Since.
+
+    Args:
+        request: The GET or HEAD request
+        etag: The ETag of the representation that would be sent, None if it doesn't have one
+        last_modified: Only pass this if the representation can't change without it changing.  Leave it out for
+        representations that also depend on code, e.g. transformer output, so that If-Modified-Since is ignored and
+        only the ETag is used.
+
+    If-Modified-Since is only evaluated when there is no If-None-Match, as RFC 9110 requires.
+    """
+    if request.method not in ("GET", "HEAD"):
+        return False
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        return etag is not None and _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_modified_since is not None and last_modified is not None:
+        since = parse_http_date(if_modified_since)
+        return since is not None and _utc(last_modified).replace(microsecond=0) <= since
+    return False
+
+
+def not_modified_response(headers: dict[str, str]) -> fastapi.responses.Response:
+    """A 304 response, headers should include the validators and any other headers the 200 response would vary on"""
+    return fastapi.responses.Response(status_code=304, headers=headers)
@@ -17,6 +17,12 @@ class Settings(BaseSettings):
     # The Solr service URL, must end in "/"
     # e.g. http://localhost:8983/solr/isb_core_records/
     solr_url: str = "UNSET"
+    # Timeouts in seconds and connection pool limits of the web application's async solr client, see
+    # isb_web.solr_client.  The read timeout is the longest solr may go without sending anything, not the total time.
+    solr_connect_timeout: float = 5.0
+    solr_read_timeout: float = 120.0
+    solr_max_connections: int = 100
+    solr_max_keepalive_connections: int = 20
 
     thing_url_path: str = "thing"
 
@@ -97,6 +103,16 @@ class Settings(BaseSettings):
 
     modelserver_url = "http://localhost:9000/"
     modelserver_lru_cache_size = 10000
+    # Whether the web application keeps model server predictions in the database, see isb_lib.prediction_store
+    modelserver_prediction_store: bool = False
+    # Version of each model by model type, e.g. {"sesar/material": "2"}.  Bump a model's version after upgrading it so
+    # that its stored predictions are made again.
+    modelserver_model_versions: dict[str, str] = {}
+
+    # Number of transformed things the web application keeps in memory
+    transform_cache_size: int = 10000
+    # Whether transformed things are also cached in the database, so they survive restarts and are shared by workers
+    transform_cache_persistent: bool = False
 
     class Config:
         env_file = "isb_web_config.env"
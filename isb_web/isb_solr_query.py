@@ -1,16 +1,17 @@
+import itertools
 import typing
 from typing import Optional, Tuple, Mapping, Any
 
+import ijson
 import requests
 import geojson
 import fastapi
 import logging
 import urllib.parse
 
-from requests import Response
-
 import isb_web.config
 from isb_lib.core import MEDIA_JSON
+from isb_web.solr_client import SOLR_CLIENT
 
 BASE_URL = isb_web.config.Settings().solr_url
 _RPT_FIELD = "producedBy_samplingSite_location_rpt"
@@ -173,7 +174,7 @@ def get_solr_params_from_request_as_dict(request: fastapi.Request, defparams: di
     return params, properties
 
 
-def _get_heatmap(
+async def _async_get_heatmap(
     q: str,
     bb: typing.Dict,
     dist_err_pct: float,
@@ -211,7 +212,7 @@ def _get_heatmap(
         params["facet.heatmap.gridLevel"] = grid_level
     # Get the solr heatmap for the provided bounds
     url = get_solr_url("select")
-    response = requests.get(url, headers=headers, params=params)
+    response = await SOLR_CLIENT.get(url, headers=headers, params=params)
 
     # logging.debug("Got: %s", response.url)
     res = response.json()
@@ -231,10 +232,10 @@ def _solr_heatmap_geom_params_str(bb):
 # that has a count value over 0.
 # Returns the generated features as a GeoJSON FeatureCollection,
 # https://datatracker.ietf.org/doc/html/rfc7946#section-3.3
-def solr_geojson_heatmap(
+async def async_solr_geojson_heatmap(
     q, bb, fq=None, grid_level=None, show_bounds=False, show_solr_bounds=False
 ):
-    hm = _get_heatmap(q, bb, _GEOJSON_ERR_PCT, fq=fq, grid_level=grid_level)
+    hm = await _async_get_heatmap(q, bb, _GEOJSON_ERR_PCT, fq=fq, grid_level=grid_level)
     # print(hm)
     gl = hm.get("gridLevel", -1)
     # logging.warning(hm)
@@ -368,8 +369,8 @@ def solr_geojson_heatmap(
 # centers of the solr heatmap grid cells. The value is the count
 # for the grid cell.
 # Suitable for consumption by leaflet: https://leafletjs.com
-def solr_leaflet_heatmap(q, bb, fq=None, grid_level=None):
-    hm = _get_heatmap(q, bb, _LEAFLET_ERR_PCT, fq=fq, grid_level=grid_level)
+async def async_solr_leaflet_heatmap(q, bb, fq=None, grid_level=None):
+    hm = await _async_get_heatmap(q, bb, _LEAFLET_ERR_PCT, fq=fq, grid_level=grid_level)
     # logging.warning(hm)
     d_lat = hm["maxY"] - hm["minY"]
     dd_lat = d_lat / (hm["rows"])
@@ -400,7 +401,7 @@ def solr_leaflet_heatmap(q, bb, fq=None, grid_level=None):
     }
 
 
-def solr_query(params, query=None, handler: str = "select", wrap_response: bool = True):
+async def async_solr_query(params, query=None, handler: str = "select"):
     """
     Issue a request against the solr select endpoint.
 
@@ -411,7 +412,7 @@ def solr_query(params, query=None, handler: str = "select", wrap_response: bool
         params: list of list, see https://solr.apache.org/guide/8_9/common-query-parameters.html
 
     Returns:
-        Iterator for the solr response.
+        StreamingResponse passing on the solr response.
     """
     url = get_solr_url(handler)
     headers = {"Accept": MEDIA_JSON}
@@ -429,14 +430,8 @@ def solr_query(params, query=None, handler: str = "select", wrap_response: bool
                 content_type = wt_map.get(v.lower(), "json")
 
     if query is None:
-        response = requests.get(url, headers=headers, params=params, stream=True)
-    else:
-        response = requests.post(
-            url, headers=headers, params=params, json=query, stream=True
-        )
-    return fastapi.responses.StreamingResponse(
-        response.iter_content(chunk_size=2048), media_type=content_type
-    )
+        return await SOLR_CLIENT.stream("GET", url, content_type, headers=headers, params=params)
+    return await SOLR_CLIENT.stream("POST", url, content_type, headers=headers, params=params, json=query)
 
 
 def reliquery_solr_query(query: str) -> dict:
@@ -459,7 +454,7 @@ def reliquery_solr_query(query: str) -> dict:
     return response.json()
 
 
-def solr_get_record(identifier):
+async def async_solr_get_record(identifier):
     """
     Retrieve the solr document for the specified identifier.
 
@@ -480,7 +475,7 @@ def solr_get_record(identifier):
     }
     url = get_solr_url("select")
     headers = {"Accept": MEDIA_JSON}
-    response = requests.get(url, headers=headers, params=params)
+    response = await SOLR_CLIENT.get(url, headers=headers, params=params)
     if response.status_code != 200:
         return response.status_code, None
     docs = response.json()
@@ -489,7 +484,9 @@ def solr_get_record(identifier):
     return 200, docs["response"]["docs"][0]
 
 
-def solr_searchStream(params: list[list[str]], collection: str = DEFAULT_COLLECTION_NAME) -> Response:  # noqa: C901
+async def async_solr_searchStream(  # noqa: C901
+    params: list[list[str]], collection: str = DEFAULT_COLLECTION_NAME
+) -> fastapi.responses.StreamingResponse:
     """
     Requests a streaming search response from solr.
 
@@ -536,7 +533,7 @@ def solr_searchStream(params: list[list[str]], collection: str = DEFAULT_COLLECT
         collection: name of collection to search
 
     Returns:
-        Stream of records from solr
+        StreamingResponse passing on the stream of records from solr
     """
     # TODO: Test coverage, need to mock solr?
     # TODO: C901 -- need to examine computational complexity
@@ -587,28 +584,32 @@ def solr_searchStream(params: list[list[str]], collection: str = DEFAULT_COLLECT
     # Post the request to solr
     # The response is an open stream that is read in chunks to
     # be passed on to the client as they are received
-    response = requests.post(
-        url, headers=headers, params=qparams, data=request, stream=True
-    )
     logging.info("Returning response")
-    return response
+    return await SOLR_CLIENT.stream("POST", url, MEDIA_JSON, headers=headers, params=qparams, data=request)
 
 
-def solr_luke():
+async def async_solr_luke():
     """
     Information about the solr isb_core_records schema
     See: https://solr.apache.org/guide/8_9/luke-request-handler.html
 
     Returns:
-        JSON document iterator
+        StreamingResponse passing on the JSON document
     """
     url = get_solr_url("admin/luke")
     params = {"show": "schema", "wt": "json"}
     headers = {"Accept": MEDIA_JSON}
-    response = requests.get(url, headers=headers, params=params, stream=True)
-    return fastapi.responses.StreamingResponse(
-        response.iter_content(chunk_size=2048), media_type=MEDIA_JSON
-    )
+    return await SOLR_CLIENT.stream("GET", url, MEDIA_JSON, headers=headers, params=params)
+
+
+def _solr_records_query(authority_id: typing.Optional[str], additional_query: typing.Optional[str]) -> str:
+    if additional_query is not None:
+        if authority_id is not None:
+            return f"{additional_query} AND source:{authority_id}"
+        return additional_query
+    elif authority_id is None:
+        return "*:*"
+    return f"source:{authority_id}"
 
 
 def _fetch_solr_records(
@@ -621,17 +622,8 @@ def _fetch_solr_records(
     additional_query: typing.Optional[str] = None,
 ):
     headers = {"Content-Type": MEDIA_JSON}
-    if additional_query is not None:
-        if authority_id is not None:
-            query = f"{additional_query} AND source:{authority_id}"
-        else:
-            query = additional_query
-    elif authority_id is None:
-        query = "*:*"
-    else:
-        query = f"source:{authority_id}"
     params = {
-        "q": query,
+        "q": _solr_records_query(authority_id, additional_query),
         "rows": batch_size,
         "start": start_index,
     }
@@ -739,6 +731,97 @@ def solr_counts_by_authority(rsession=requests.session()) -> dict[str, int]:
     return facet_counts_dict
 
 
+def _sort_with_unique_key(sort: Optional[str]) -> str:
+    """cursorMark requires the sort to end with the uniqueKey field as a tie-breaker"""
+    if sort is None:
+        return "id asc"
+    sort_fields = [clause.split()[0] for clause in sort.split(",") if clause.strip() != ""]
+    if "id" in sort_fields:
+        return sort
+    return f"{sort}, id asc"
+
+
+class SolrCursorPage:
+    """
+    One page of a cursorMark solr query.  Iterating it parses the docs incrementally off the response stream, so a page
+    is never fully materialized.  next_cursor_mark is set once the page has been iterated to the end.
+    """
+
+    def __init__(self, response: requests.Response, cursor_mark: str):
+        self._response = response
+        self.cursor_mark = cursor_mark
+        self.next_cursor_mark: Optional[str] = None
+        self.num_docs = 0
+
+    def __iter__(self) -> typing.Iterator[typing.Dict]:
+        try:
+            self._response.raw.decode_content = True
+            builder = None
+            for prefix, event, value in ijson.parse(self._response.raw, use_float=True):
+                if prefix == "response.docs.item" and event == "start_map":
+                    builder = ijson.ObjectBuilder()
+                if builder is not None:
+                    builder.event(event, value)
+                    if prefix == "response.docs.item" and event == "end_map":
+                        self.num_docs += 1
+                        yield builder.value
+                        builder = None
+                elif prefix == "nextCursorMark":
+                    self.next_cursor_mark = value
+        finally:
+            self._response.close()
+
+
+def _fetch_solr_cursor_page(
+    rsession: requests.Session, query: str, batch_size: int, sort: str, fields: Optional[str], cursor_mark: str
+) -> SolrCursorPage:
+    params: typing.Dict[str, typing.Any] = {
+        "q": query,
+        "rows": batch_size,
+        "sort": sort,
+        "cursorMark": cursor_mark,
+    }
+    if fields is not None:
+        params["fl"] = fields
+    res = rsession.get(get_solr_url("select"), headers={"Accept": MEDIA_JSON}, params=params, stream=True)
+    if res.status_code != 200:
+        res.close()
+        raise ValueError(f"Solr cursorMark query failed with status {res.status_code}: {res.text}")
+    return SolrCursorPage(res, cursor_mark)
+
+
+def solr_cursor_pages(
+    rsession: requests.Session,
+    query: Optional[str] = None,
+    batch_size: int = 50000,
+    sort: Optional[str] = None,
+    fields: Optional[str] = None,
+    cursor_mark: str = "*",
+) -> typing.Iterator[SolrCursorPage]:
+    """
+    Yields the pages of a cursorMark query over the ISB core records.  Each page must be iterated to the end before the
+    next one is requested.
+
+    Args:
+        rsession: The requests.session object to use for sending the solr requests
+        query: The solr query, defaults to all records
+        batch_size: Number of documents per page
+        sort: The solr sort parameter, id is added as the tie-breaker cursorMark requires.  Defaults to id asc.
+        fields: The solr fl parameter, defaults to all stored fields
+        cursor_mark: The cursor mark to start from -- a page's cursor_mark may be saved and passed back to resume
+    """
+    query = _solr_records_query(None, query)
+    sort = _sort_with_unique_key(sort)
+    while True:
+        page = _fetch_solr_cursor_page(rsession, query, batch_size, sort, fields, cursor_mark)
+        yield page
+        logging.info(f"Just fetched {page.num_docs} ISB Core solr records at cursor mark {cursor_mark}")
+        # A short page is the last one, otherwise solr signals the end by returning the same cursor mark
+        if page.num_docs < batch_size or page.next_cursor_mark in (None, cursor_mark):
+            return
+        cursor_mark = typing.cast(str, page.next_cursor_mark)
+
+
 class ISBCoreSolrRecordIterator:
     """
     Iterator class for looping over all the Solr records in the ISB core Solr schema
@@ -751,6 +834,7 @@ class ISBCoreSolrRecordIterator:
         batch_size: int = 50000,
         offset: int = 0,
         sort: Optional[str] = None,
+        cursor_mark: bool = True,
     ):
         """
 
@@ -760,19 +844,29 @@ class ISBCoreSolrRecordIterator:
             batch_size: Number of documents to fetch at a time
             offset: The offset into the records to begin iterating
             sort: The solr sort parameter to use
+            cursor_mark: Whether to page with a solr cursorMark rather than start offsets, which avoids solr collecting
+              and sorting every preceding record on each request.  Ignored when starting from an offset.  The sort is
+              extended with id as a tie-breaker, and defaults to id asc.
         """
         self.rsession = rsession
         self.query = query
         self.batch_size = batch_size
         self.offset = offset
-        self.sort = sort
+        self.use_cursor_mark = cursor_mark and offset == 0
+        self.sort = _sort_with_unique_key(sort) if self.use_cursor_mark else sort
         self._current_batch: list[dict] = []
         self._current_batch_index = -1
+        self._cursor_records: Optional[typing.Iterator[typing.Dict]] = None
 
     def __iter__(self):
         return self
 
     def __next__(self) -> typing.Dict:
+        if self.use_cursor_mark:
+            if self._cursor_records is None:
+                pages = solr_cursor_pages(self.rsession, self.query, self.batch_size, self.sort)
+                self._cursor_records = itertools.chain.from_iterable(pages)
+            return next(self._cursor_records)
         if len(self._current_batch) == 0 or self._current_batch_index == len(
             self._current_batch
         ):
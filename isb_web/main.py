@@ -1,5 +1,6 @@
 import os
 import datetime
+import zlib
 from json import JSONDecodeError
 from typing import Optional
 
@@ -21,22 +22,27 @@ import geojson
 
 import isb_web
 import isamples_metadata.GEOMETransformer
-from isb_lib.core import MEDIA_GEO_JSON, MEDIA_JSON, MEDIA_NQUADS, SOLR_TIME_FORMAT
+from isb_lib.core import MEDIA_GEO_JSON, MEDIA_JSON, MEDIA_NDJSON, MEDIA_NQUADS, SOLR_TIME_FORMAT
 from isb_lib.models.thing import Thing
+from isb_lib.prediction_store import PredictionStore
+from isb_lib.transform_cache import TransformCache, content_hash, transform_cache_key
 from isb_lib.utilities import h3_utilities
 from isb_lib.utilities.url_utilities import full_url_from_suffix
 from isb_lib.vocabulary import vocab_adapter
-from isb_web import sqlmodel_database, analytics, manage, debug, metrics, vocabulary, export, auth
+from isb_web import sqlmodel_database, analytics, manage, debug, metrics, vocabulary, export, auth, conditional_requests
 from isb_web.analytics import AnalyticsEvent
 from isb_web import schemas
 from isb_web import crud
 from isb_web import config
 from isb_web import isb_enums
 from isb_web import isb_solr_query
+from isb_web import solr_client
 from isb_web import profiles
 from isamples_metadata.SESARTransformer import SESARTransformer
 from isamples_metadata.OpenContextTransformer import OpenContextTransformer
 from isamples_metadata.SmithsonianTransformer import SmithsonianTransformer
+from isamples_metadata.Transformer import Transformer
+from isamples_metadata.taxonomy.metadata_model_client import MODEL_SERVER_CLIENT
 
 import logging
 
@@ -67,6 +73,9 @@ tags_metadata = [
 THING_URL_PATH = config.Settings().thing_url_path
 STAC_ITEM_URL_PATH = config.Settings().stac_item_url_path
 STAC_COLLECTION_URL_PATH = config.Settings().stac_collection_url_path
+TRANSFORM_CACHE = TransformCache(
+    config.Settings().transform_cache_size, config.Settings().transform_cache_persistent
+)
 
 app = fastapi.FastAPI(openapi_tags=tags_metadata)
 dao = SQLModelDAO(None)
@@ -105,6 +114,8 @@ app.mount(
 templates = fastapi.templating.Jinja2Templates(
     directory=os.path.join(THIS_PATH, "templates")
 )
+with open(os.path.join(THIS_PATH, "templates", "thing.html")) as thing_page_template:
+    THING_PAGE_TEMPLATE_DIGEST = content_hash(thing_page_template.read())
 app.mount(
     "/ui",
     fastapi.staticfiles.StaticFiles(
@@ -122,6 +133,8 @@ app.mount(export.EXPORT_PREFIX, export.export_app)
 @app.on_event("startup")
 def on_startup():
     dao.connect_sqlmodel(isb_web.config.Settings().database_url)
+    if isb_web.config.Settings().modelserver_prediction_store:
+        MODEL_SERVER_CLIENT.prediction_store = PredictionStore(isb_web.config.Settings().database_url)
     session = dao.get_session()
     orcid_ids = sqlmodel_database.all_orcid_ids(session)
     # preload each of these into memory to avoid performance issues on hyde
@@ -138,6 +151,11 @@ def on_startup():
     term_store.create_database(dao.engine)
 
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    await solr_client.SOLR_CLIENT.aclose()
+
+
 def get_session():
     with dao.get_session() as session:
         yield session
@@ -177,8 +195,28 @@ async def login():
 """
 
 
+def _thing_page_entity_tag(tstamp: datetime.datetime, base_url: str) -> str:
+    return conditional_requests.entity_tag(
+        tstamp,
+        Transformer.VERSION,
+        THING_PAGE_TEMPLATE_DIGEST,
+        base_url,
+        config.Settings().hypothesis_authority,
+        config.Settings().hypothesis_server_url,
+    )
+
+
 @app.get("/thingpage/{identifier:path}", include_in_schema=False)
 async def get_thing_page(request: fastapi.Request, identifier: str, session: Session = Depends(get_session)):
+    base_url = str(request.url)
+    # The page embeds the core metadata, so it's only revalidated by ETag
+    if conditional_requests.is_conditional(request):
+        tstamp = sqlmodel_database.get_thing_tstamp_with_id(session, identifier)
+        if tstamp is not None:
+            etag = _thing_page_entity_tag(tstamp, base_url)
+            if conditional_requests.is_not_modified(request, etag):
+                return conditional_requests.not_modified_response(conditional_requests.validator_headers(etag))
+
     # Retrieve record from the database
     item = sqlmodel_database.get_thing_with_id(session, identifier)
     if item is None:
@@ -192,7 +230,6 @@ async def get_thing_page(request: fastapi.Request, identifier: str, session: Ses
         item_ispartof = "https://igsn.org"
     content = await thing_resolved_content(identifier, item, session)
     content_str = json.dumps(content)
-    base_url = str(request.url)
 
     jwt_url = full_url_from_suffix(base_url, "/manage/hypothesis_jwt")
     login_url = full_url_from_suffix(base_url, f"/manage/login?thing={identifier}")
@@ -209,7 +246,8 @@ async def get_thing_page(request: fastapi.Request, identifier: str, session: Ses
             "hypothesis_api_url": config.Settings().hypothesis_server_url,
             "login_url": login_url,
             "logout_url": logout_url,
-        }
+        },
+        headers=conditional_requests.validator_headers(_thing_page_entity_tag(item.tstamp, base_url)),
     )
 
 
@@ -282,7 +320,7 @@ async def _get_solr_select(request: fastapi.Request):
     # for the streaming response as otherwise the iterator is consumed
     # before returning here, hence defeating the purpose of the streaming
     # response.
-    return isb_solr_query.solr_query(params)
+    return await isb_solr_query.async_solr_query(params)
 
 
 async def _handle_post_solr_select(params, properties, request):
@@ -356,7 +394,7 @@ async def get_solr_query(
     request: fastapi.Request, query: typing.Any = fastapi.Body(...)
 ):
     # logging.warning(query)
-    return isb_solr_query.solr_query(request.query_params, query=query)
+    return await isb_solr_query.async_solr_query(request.query_params.multi_items(), query=query)
 
 
 @app.get(f"/{THING_URL_PATH}/stream", response_model=typing.Any)
@@ -408,10 +446,7 @@ async def get_solr_stream(request: fastapi.Request):
     params = isb_solr_query.set_default_params(params, defparams)
     # L.debug("Params: %s", params)
     analytics.attach_analytics_state_to_request(AnalyticsEvent.THING_SOLR_STREAM, request, properties)
-    response = isb_solr_query.solr_searchStream(params)
-    return fastapi.responses.StreamingResponse(
-        response.iter_content(chunk_size=4096), media_type=MEDIA_JSON
-    )
+    return await isb_solr_query.async_solr_searchStream(params)
 
 
 @app.get(f"/{THING_URL_PATH}/select/info", response_model=typing.Any)
@@ -421,7 +456,7 @@ async def get_solr_luke_info(request: fastapi.Request):
     Returns: JSON
     """
     analytics.attach_analytics_state_to_request(AnalyticsEvent.THING_SOLR_LUKE_INFO, request)
-    return isb_solr_query.solr_luke()
+    return await isb_solr_query.async_solr_luke()
 
 
 resolution_q = fastapi.Query(
@@ -466,18 +501,40 @@ def get_h3_grid(
     )
 
 
+def gzipped_ndjson_things(session: Session, identifiers: list[str]) -> typing.Iterator[bytes]:
+    """Yields the things with the identifiers as gzipped newline delimited JSON, straight from a database cursor"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for thing in sqlmodel_database.stream_thing_dicts_with_ids(session, identifiers):
+        line = json.dumps(thing, default=datetime.datetime.isoformat) + "\n"
+        compressed = compressor.compress(line.encode("utf-8"))
+        if len(compressed) > 0:
+            yield compressed
+    yield compressor.flush()
+
+
 @app.post("/things", response_model=typing.Any)
 async def get_things_for_sitemap(
     request: fastapi.Request,
     params: ThingsSitemapParams,
     session: Session = Depends(get_session),
+    accept: typing.Optional[str] = fastapi.Header(MEDIA_JSON),
 ):
     """Returns batched things suitable for sitemap ingestion
     Args:
         request: The fastapi request
-        params: Class that contains the identifier list, JSON-encoded in the request body
+        params: Class that contains the identifier list, JSON-encoded in the request body.  Things are matched by
+        their id or by any of their other identifiers.
         session: The database session to use to fetch things
+        accept: application/x-ndjson to stream the things as gzipped newline delimited JSON, one thing per line,
+        rather than load them all into a single JSON array
     """
+    if accept_types.get_best_match(accept, [MEDIA_JSON, MEDIA_NDJSON]) == MEDIA_NDJSON:
+        # The session dependency isn't closed until the response has been sent
+        return fastapi.responses.StreamingResponse(
+            gzipped_ndjson_things(session, params.identifiers),
+            media_type=MEDIA_NDJSON,
+            headers={"Content-Encoding": "gzip"},
+        )
     content = sqlmodel_database.get_things_with_ids(session, params.identifiers)
     # things
     # for identifier in params.identifiers:
@@ -499,11 +556,11 @@ def all_profiles_json_response(request_url: str):
     )
 
 
-def solr_thing_response(identifier: str):
+async def solr_thing_response(identifier: str):
     # Return solr representation of the record
     # Get the solr response, and return the doc portion or
     # and appropriate error condition
-    status, doc = isb_solr_query.solr_get_record(identifier)
+    status, doc = await isb_solr_query.async_solr_get_record(identifier)
     if status == 200:
         return fastapi.responses.JSONResponse(
             content=doc, media_type="application/json"
@@ -514,10 +571,62 @@ def solr_thing_response(identifier: str):
     )
 
 
+THING_FULL_REPRESENTATION = "full"
+THING_CORE_REPRESENTATION = "core"
+THING_SOURCE_REPRESENTATION = "source"
+
+
+def _thing_representation(
+    format: typing.Optional[isb_enums.ISBFormat], request_profile: Optional[profiles.Profile]
+) -> tuple[str, Optional[profiles.Profile]]:
+    """Which representation of a Thing get_thing sends, and the profile it's sent with"""
+    if format == isb_enums.ISBFormat.FULL:
+        return THING_FULL_REPRESENTATION, request_profile
+    if request_profile == profiles.ISAMPLES_PROFILE or format == isb_enums.ISBFormat.CORE:
+        return THING_CORE_REPRESENTATION, request_profile or profiles.ISAMPLES_PROFILE
+    # If no profile explicitly requested, use the default profile here (currently original source)
+    return THING_SOURCE_REPRESENTATION, request_profile or profiles.DEFAULT_PROFILE
+
+
+def _thing_entity_tag(
+    tstamp: datetime.datetime, representation: str, request_profile: Optional[profiles.Profile]
+) -> str:
+    # Core metadata also changes when the transformers do
+    profile_uri = request_profile.uri if request_profile is not None else None
+    return conditional_requests.entity_tag(tstamp, Transformer.VERSION, representation, profile_uri)
+
+
+def _thing_last_modified(tstamp: datetime.datetime, representation: str) -> Optional[datetime.datetime]:
+    # Only the source record can't change without the tstamp changing, the others are only validated by ETag
+    return tstamp if representation == THING_SOURCE_REPRESENTATION else None
+
+
+def _thing_not_modified_response(
+    request: fastapi.Request,
+    session: Session,
+    identifier: str,
+    representation: str,
+    request_profile: Optional[profiles.Profile],
+    headers: dict[str, str],
+) -> Optional[fastapi.responses.Response]:
+    """A 304 response if the client's copy of the Thing is current, checked without loading the Thing"""
+    tstamp = sqlmodel_database.get_thing_tstamp_with_id(session, identifier)
+    if tstamp is None:
+        return None
+    etag = _thing_entity_tag(tstamp, representation, request_profile)
+    last_modified = _thing_last_modified(tstamp, representation)
+    if not conditional_requests.is_not_modified(request, etag, last_modified):
+        return None
+    return conditional_requests.not_modified_response(
+        {**headers, **conditional_requests.validator_headers(etag, last_modified)}
+    )
+
+
 @app.head(f"/{THING_URL_PATH}/{{identifier:path}}", response_model=typing.Any)
 @app.get(f"/{THING_URL_PATH}/{{identifier:path}}", response_model=typing.Any)
 async def get_thing(
     request: fastapi.Request,
+    response: fastapi.Response,
     identifier: str,
     format: typing.Optional[isb_enums.ISBFormat] = None,
     _profile: Optional[str] = None,
@@ -529,7 +638,7 @@ async def get_thing(
     analytics.attach_analytics_state_to_request(AnalyticsEvent.THING_BY_IDENTIFIER, request, properties)
     """Record for the specified identifier"""
     if format == isb_enums.ISBFormat.SOLR:
-        return solr_thing_response(identifier)
+        return await solr_thing_response(identifier)
 
     if _profile == profiles.ALL_PROFILES_QSA_VALUE or _profile == profiles.ALT_PROFILES_QSA_VALUE \
             or request.method == "HEAD":
@@ -538,6 +647,18 @@ async def get_thing(
     if request_profile is None:
         # didn't find in qsa, check headers
         request_profile = profiles.get_profile_from_http(request)
+    representation, request_profile = _thing_representation(format, request_profile)
+    headers = {"Vary": "Accept-Profile"}
+    if representation != THING_FULL_REPRESENTATION:
+        headers.update(profiles.content_profile_headers(request_profile))
+
+    # Check whether the client already has the current representation before loading the record
+    if conditional_requests.is_conditional(request):
+        not_modified_response = _thing_not_modified_response(
+            request, session, identifier, representation, request_profile, headers
+        )
+        if not_modified_response is not None:
+            return not_modified_response
 
     # Retrieve record from the database
     item = sqlmodel_database.get_thing_with_id(session, identifier)
@@ -545,21 +666,19 @@ async def get_thing(
         raise fastapi.HTTPException(
             status_code=404, detail=f"Thing not found: {identifier}"
         )
-    if format == isb_enums.ISBFormat.FULL:
+    headers.update(
+        conditional_requests.validator_headers(
+            _thing_entity_tag(item.tstamp, representation, request_profile),
+            _thing_last_modified(item.tstamp, representation),
+        )
+    )
+    if representation == THING_FULL_REPRESENTATION:
+        response.headers.update(headers)
         return item
-    if (request_profile is not None and request_profile == profiles.ISAMPLES_PROFILE) or \
-            format == isb_enums.ISBFormat.CORE:
-        if request_profile is None:
-            request_profile = profiles.ISAMPLES_PROFILE
+    if representation == THING_CORE_REPRESENTATION:
         content = await thing_resolved_content(identifier, item, session)
     else:
-        # If no profile explicitly requested, use the default profile here (currently original source)
-        if request_profile is None:
-            request_profile = profiles.DEFAULT_PROFILE
         content = item.resolved_content
-    headers = {}
-    if request_profile is not None:
-        headers.update(profiles.content_profile_headers(request_profile))
     return fastapi.responses.JSONResponse(
         content=content, media_type=item.resolved_media_type, headers=headers
     )
@@ -584,7 +703,7 @@ async def resolve_thing(
     return fastapi.responses.RedirectResponse(url=url_str, status_code=302, headers=headers)
 
 
-async def thing_resolved_content(identifier: str, item: Thing, session: Session) -> dict:
+def _transform_resolved_content(identifier: str, item: Thing, session: Session) -> dict:
     authority_id = item.authority_id
     if authority_id == "SESAR":
         content = SESARTransformer(item.resolved_content).transform()
@@ -606,6 +725,25 @@ async def thing_resolved_content(identifier: str, item: Thing, session: Session)
     return content
 
 
+async def thing_resolved_content(identifier: str, item: Thing, session: Session) -> dict:
+    key = transform_cache_key(item.authority_id, identifier, content_hash(item.resolved_content), "core")
+    content = TRANSFORM_CACHE.get(key, session)
+    if content is None:
+        content = _transform_resolved_content(identifier, item, session)
+        TRANSFORM_CACHE.put(key, item.authority_id, identifier, content, session)
+    return content
+
+
+def _stac_item_validator_headers(solr_doc: dict) -> dict[str, str]:
+    # solr assigns the document a new _version_ whenever it's updated, by any indexer or migration
+    version = solr_doc.get("_version_")
+    if version is None:
+        return {}
+    # The item also changes with the code that builds it, so it's only validated by ETag
+    etag = conditional_requests.entity_tag(version, isb_lib.stac.ITEM_VERSION)
+    return conditional_requests.validator_headers(etag)
+
+
 @app.get(f"/{STAC_ITEM_URL_PATH}/{{identifier:path}}", response_model=typing.Any)
 async def get_stac_item(
     request: fastapi.Request,
@@ -619,14 +757,17 @@ async def get_stac_item(
     # stac wants things to have filenames, so let these requests work, too.
     if identifier.endswith(".json"):
         identifier = identifier.removesuffix(".json")
-    status, doc = isb_solr_query.solr_get_record(identifier)
+    status, doc = await isb_solr_query.async_solr_get_record(identifier)
     if status == 200:
+        headers = _stac_item_validator_headers(doc)
+        if conditional_requests.is_not_modified(request, headers.get("ETag")):
+            return conditional_requests.not_modified_response(headers)
         stac_item = isb_lib.stac.stac_item_from_solr_dict(
             doc, "http://isamples.org/stac/", "http://isamples.org/thing/"
         )
         if stac_item is not None:
             return fastapi.responses.JSONResponse(
-                content=stac_item, media_type=MEDIA_GEO_JSON
+                content=stac_item, media_type=MEDIA_GEO_JSON, headers=headers
             )
         else:
             # We don't have location data to make a stac item, return a 404
@@ -701,7 +842,7 @@ async def get_things_geojson_heatmap(
         isb_solr_query.MIN_LON: min_lon,
         isb_solr_query.MAX_LON: max_lon,
     }
-    results = isb_solr_query.solr_geojson_heatmap(
+    results = await isb_solr_query.async_solr_geojson_heatmap(
         query, bounds, fq=fq, grid_level=None, show_bounds=False, show_solr_bounds=False
     )
     return fastapi.responses.JSONResponse(content=results, media_type=MEDIA_GEO_JSON)
@@ -750,7 +891,7 @@ async def get_things_leaflet_heatmap(
         isb_solr_query.MIN_LON: min_lon,
         isb_solr_query.MAX_LON: max_lon,
     }
-    results = isb_solr_query.solr_leaflet_heatmap(query, bounds, fq=fq, grid_level=None)
+    results = await isb_solr_query.async_solr_leaflet_heatmap(query, bounds, fq=fq, grid_level=None)
     return fastapi.responses.JSONResponse(content=results, media_type=MEDIA_JSON)
 
 
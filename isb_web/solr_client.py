@@ -0,0 +1,78 @@
+import asyncio
+import typing
+from typing import Optional
+
+import fastapi.responses
+import httpx
+import starlette.background
+
+import isb_web.config
+
+
+class AsyncSolrClient:
+    """The process-wide async HTTP client the web application talks to solr with.
+
+    All requests share one httpx.AsyncClient, so connections to solr are pooled and kept alive across requests
+    instead of opened per call, within the configured limits.  httpx connections belong to the event loop they were
+    opened on, so the underlying client is created on first use and replaced if it's used from another loop, which
+    only happens outside of the server, e.g. in tests.
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 120.0,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self._timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self._limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_keepalive_connections
+        )
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            self._client = httpx.AsyncClient(timeout=self._timeout, limits=self._limits, transport=self._transport)
+            self._loop = loop
+        return self._client
+
+    async def get(self, url: str, **kwargs: typing.Any) -> httpx.Response:
+        return await self.client.get(url, **kwargs)
+
+    async def post(self, url: str, **kwargs: typing.Any) -> httpx.Response:
+        return await self.client.post(url, **kwargs)
+
+    async def stream(
+        self, method: str, url: str, media_type: str, **kwargs: typing.Any
+    ) -> fastapi.responses.StreamingResponse:
+        """Sends the request and passes the solr response body on as it arrives, with solr's status code.
+
+        The solr response is closed once the body has been sent, or if the client goes away first.
+        """
+        response = await self.client.send(self.client.build_request(method, url, **kwargs), stream=True)
+        return fastapi.responses.StreamingResponse(
+            response.aiter_bytes(),
+            status_code=response.status_code,
+            media_type=media_type,
+            background=starlette.background.BackgroundTask(response.aclose),
+        )
+
+    async def aclose(self):
+        if self._client is not None and self._loop is asyncio.get_running_loop():
+            await self._client.aclose()
+        self._client = None
+        self._loop = None
+
+
+SOLR_CLIENT = AsyncSolrClient(
+    isb_web.config.Settings().solr_connect_timeout,
+    isb_web.config.Settings().solr_read_timeout,
+    isb_web.config.Settings().solr_max_connections,
+    isb_web.config.Settings().solr_max_keepalive_connections,
+)
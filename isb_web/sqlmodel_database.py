@@ -1,4 +1,5 @@
 import datetime
+import io
 import typing
 import json
 import uuid
@@ -10,7 +11,11 @@ from typing import Optional, List
 
 from isb_lib.identifiers.noidy.n2tminter import N2TMinter
 from isb_lib.models.export_job import ExportJob
+from isb_lib.models.model_prediction import ModelPrediction
 from isb_lib.models.namespace import Namespace
+from isb_lib.models.solr_document_digest import SolrDocumentDigest
+from isb_lib.models.solr_import_checkpoint import SolrImportCheckpoint
+from isb_lib.models.transform_cache_entry import TransformCacheEntry
 from sqlalchemy import Index, update, or_
 from sqlalchemy.exc import ProgrammingError
 from sqlmodel import SQLModel, create_engine, Session, select
@@ -19,7 +24,7 @@ from sqlmodel.sql.expression import SelectOfScalar
 import isb_lib
 from isb_lib.models.person import Person
 from isb_lib.models.taxonomy_name import TaxonomyName
-from isb_lib.models.thing import Thing, ThingIdentifier, Point
+from isb_lib.models.thing import Thing, ThingIdentifier, Point, thing_identifier_keys, upsert_thing_identifiers
 from isb_web.schemas import ThingPage
 
 
@@ -28,23 +33,134 @@ DRAFT_AUTHORITY_ID = "DRAFT"
 DRAFT_RESOLVED_STATUS = -1
 
 
+def _copy_text_value(value: typing.Any) -> str:
+    """Formats a value as a column of a COPY text format row"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    elif isinstance(value, datetime.datetime):
+        value = value.isoformat(sep=" ")
+    else:
+        value = str(value)
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def _copy_upsert_things(session: Session, columns: list[str], things: list[dict]) -> tuple[int, int]:
+    # thing.id has no unique constraint for ON CONFLICT to use, so merge the staged rows with an update and an insert
+    column_names = [sqlalchemy.inspect(Thing).columns[column].name for column in columns]
+    column_list = ", ".join(f'"{column_name}"' for column_name in column_names)
+    session.execute(
+        sqlalchemy.text(f"CREATE TEMP TABLE thing_staging ON COMMIT DROP AS SELECT {column_list} FROM thing WITH NO DATA")
+    )
+    rows = io.StringIO()
+    for thing in things:
+        rows.write("\t".join(_copy_text_value(thing.get(column)) for column in columns))
+        rows.write("\n")
+    rows.seek(0)
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY thing_staging ({column_list}) FROM STDIN", rows)
+    finally:
+        cursor.close()
+    assignments = ", ".join(
+        f'"{column_name}" = s."{column_name}"' for column_name in column_names if column_name != "id"
+    )
+    num_updated = session.execute(
+        sqlalchemy.text(f"UPDATE thing SET {assignments} FROM thing_staging s WHERE thing.id = s.id")
+    ).rowcount
+    num_inserted = session.execute(
+        sqlalchemy.text(
+            f"INSERT INTO thing ({column_list}) SELECT {column_list} FROM thing_staging s "
+            "WHERE NOT EXISTS (SELECT 1 FROM thing t WHERE t.id = s.id)"
+        )
+    ).rowcount
+    return num_inserted, num_updated
+
+
+def _primary_keys_by_id(session: Session, ids: list[str]) -> dict[str, int]:
+    primary_keys_by_id = {}
+    for start in range(0, len(ids), 1000):
+        pk_select = select(Thing.id, Thing.primary_key).where(Thing.id.in_(ids[start:start + 1000]))
+        for row in session.execute(pk_select).fetchall():
+            primary_keys_by_id[row[0]] = row[1]
+    return primary_keys_by_id
+
+
+def _mapping_upsert_things(session: Session, things: list[dict]) -> tuple[int, int]:
+    primary_keys_by_id = _primary_keys_by_id(session, [thing["id"] for thing in things])
+    new_things = []
+    existing_things = []
+    for thing in things:
+        primary_key = primary_keys_by_id.get(thing["id"])
+        if primary_key is None:
+            new_things.append(thing)
+        else:
+            existing_things.append({**thing, "primary_key": primary_key})
+    if len(new_things) > 0:
+        session.bulk_insert_mappings(mapper=Thing, mappings=new_things, return_defaults=False)
+    if len(existing_things) > 0:
+        session.bulk_update_mappings(mapper=Thing, mappings=existing_things)
+    return len(new_things), len(existing_things)
+
+
+def _upsert_thing_identifiers_for_things(session: Session, things: list[dict]):
+    # The bulk paths don't go through the ORM, so the Thing mapper events don't see these Things
+    primary_keys_by_id = _primary_keys_by_id(session, [thing["id"] for thing in things])
+    primary_keys = {}
+    for thing in things:
+        identifiers = thing.get("identifiers")
+        if isinstance(identifiers, str):
+            identifiers = json.loads(identifiers)
+        primary_key = primary_keys_by_id.get(thing["id"])
+        if primary_key is not None:
+            primary_keys.update(dict.fromkeys(thing_identifier_keys(thing["id"], identifiers), primary_key))
+    upsert_thing_identifiers(session.connection(), primary_keys)
+
+
+def upsert_things(session: Session, things: list[dict]) -> tuple[int, int]:
+    """Inserts or updates a batch of Things by id, and returns the number of (inserted, updated) rows.
+
+    Args:
+        session: The database session
+        things: Dictionaries of Thing attribute values, all with the same keys.  The primary key and any keys that
+        aren't Thing attributes are ignored -- the existing Thing with the same id is updated, otherwise a new one is
+        inserted.  When an id is repeated, the last dictionary wins.
+
+    On PostgreSQL the batch is streamed with COPY into a temporary staging table and merged into thing with two set
+    based statements, so nothing is looked up or built through the ORM.  Other databases look up the primary keys
+    of the batch's ids and fall back to bulk insert and update mappings.  Either way the ids and identifiers of the
+    batch are then added to the ThingIdentifier lookup table.
+    """
+    thing_columns = sqlalchemy.inspect(Thing).columns
+    things_by_id = {
+        thing["id"]: {key: value for key, value in thing.items() if key in thing_columns and key != "primary_key"}
+        for thing in things
+    }
+    if len(things_by_id) == 0:
+        return 0, 0
+    unique_things = list(things_by_id.values())
+    if session.get_bind().dialect.name == "postgresql":
+        counts = _copy_upsert_things(session, list(unique_things[0].keys()), unique_things)
+    else:
+        counts = _mapping_upsert_things(session, unique_things)
+    _upsert_thing_identifiers_for_things(session, unique_things)
+    session.commit()
+    return counts
+
+
 class DatabaseBulkUpdater:
-    def __init__(self, db_session: Session, authority_id: str, batch_size: int, resolved_media_type: str, primary_keys_by_id: Optional[dict]):
+    def __init__(self, db_session: Session, authority_id: str, batch_size: int, resolved_media_type: str):
         self.db_session = db_session
         self.authority_id = authority_id
         self.batch_size = batch_size
         self.resolved_media_type = resolved_media_type
-        self.current_new_things_batch = []
-        self.current_existing_things_batch = []
+        self.current_things_batch = []
         self.num_inserts = 0
         self.num_updates = 0
         self.unique_ids = set()
-        if primary_keys_by_id is not None:
-            self.primary_keys_by_id = primary_keys_by_id
-        else:
-            self.primary_keys_by_id = {}
 
-    def add_thing(self, resolved_content: dict, thing_id: str, resolved_url: str, resolved_status: int, h3: str, t_created: Optional[datetime.datetime] = None):
+    def add_thing(self, resolved_content: dict, thing_id: str, resolved_url: str, resolved_status: int, h3: Optional[str], t_created: Optional[datetime.datetime] = None):
         tstamp = datetime.datetime.now()
         if t_created is None:
             t_created = tstamp
@@ -63,13 +179,9 @@ class DatabaseBulkUpdater:
             "identifiers": json.dumps([thing_id]),
             "h3": h3
         }
-        if thing_id in self.primary_keys_by_id:
-            thing_dict["primary_key"] = self.primary_keys_by_id[thing_id]
-            self.current_existing_things_batch.append(thing_dict)
-        else:
-            self.current_new_things_batch.append(thing_dict)
+        self.current_things_batch.append(thing_dict)
         self.unique_ids.add(thing_id)
-        if (len(self.current_new_things_batch) + len(self.current_existing_things_batch)) == self.batch_size:
+        if len(self.current_things_batch) == self.batch_size:
             self._save_to_db()
 
     def finish(self):
@@ -78,23 +190,12 @@ class DatabaseBulkUpdater:
         print(f"Finished at {datetime.datetime.now()}.")
 
     def _save_to_db(self):
-        self.num_inserts += len(self.current_new_things_batch)
-        self.num_updates += len(self.current_existing_things_batch)
         print(f"\n\nInserting into the database because we've hit the batch size of {self.batch_size}")
-        if len(self.current_new_things_batch) > 0:
-            self.db_session.bulk_insert_mappings(
-                mapper=Thing,
-                mappings=self.current_new_things_batch,
-                return_defaults=False,
-            )
-        if len(self.current_existing_things_batch) > 0:
-            self.db_session.bulk_update_mappings(
-                mapper=Thing, mappings=self.current_existing_things_batch
-            )
-        self.db_session.commit()
+        num_inserts, num_updates = upsert_things(self.db_session, self.current_things_batch)
+        self.num_inserts += num_inserts
+        self.num_updates += num_updates
         print(f"\n\nSave complete.  Have inserted {self.num_inserts} rows, updated {self.num_updates} rows, seen {len(self.unique_ids)} unique ids.")
-        self.current_new_things_batch = []
-        self.current_existing_things_batch = []
+        self.current_things_batch = []
 
 
 class SQLModelDAO:
@@ -192,26 +293,65 @@ def read_things_summary(
     return overall_count, overall_pages, things_results.all()
 
 
-def get_thing_with_id(session: Session, identifier: str) -> Optional[Thing]:
-    statement = (
-        select(Thing).filter(Thing.id == identifier).order_by(Thing.primary_key.asc())
-    )
-    result = session.exec(statement).first()
+def _first_with_id(session: Session, statement: SelectOfScalar, identifier: str) -> typing.Any:
+    result = session.exec(
+        statement.filter(Thing.id == identifier).order_by(Thing.primary_key.asc())
+    ).first()
     if result is None:
-        # Fall back to querying the Identifiers table
-        identifiers_statement = select(Thing).where(
-            Thing.identifiers.like(f"%{identifier}%")
-        )
+        # Fall back to the identifiers lookup table for the Thing's other identifiers
+        identifiers_statement = statement.join(
+            ThingIdentifier, ThingIdentifier.thing_id == Thing.primary_key
+        ).where(ThingIdentifier.guid == identifier)
         result = session.exec(identifiers_statement).first()
     return result
 
 
+def get_thing_with_id(session: Session, identifier: str) -> Optional[Thing]:
+    return _first_with_id(session, select(Thing), identifier)
+
+
+def get_thing_tstamp_with_id(session: Session, identifier: str) -> Optional[datetime.datetime]:
+    """The tstamp of the Thing get_thing_with_id returns, without loading the rest of the Thing"""
+    return _first_with_id(session, select(Thing.tstamp), identifier)
+
+
+def _things_with_ids_filter(identifiers: list[str]):
+    """Matches the Things with any of the identifiers as their id or as one of their other identifiers"""
+    return or_(
+        Thing.id.in_(identifiers),
+        Thing.primary_key.in_(select(ThingIdentifier.thing_id).where(ThingIdentifier.guid.in_(identifiers))),
+    )
+
+
 def get_things_with_ids(session: Session, identifiers: list[str]) -> list[Thing]:
-    statement = select(Thing).where(Thing.id.in_(identifiers))
+    """Batched get_thing_with_id, the Things with any of the identifiers, each Thing once"""
+    statement = select(Thing).where(_things_with_ids_filter(identifiers))
     things = session.exec(statement).all()
     return things
 
 
+def stream_thing_dicts_with_ids(
+    session: Session, identifiers: list[str], yield_per: int = 1000
+) -> typing.Iterator[dict[str, typing.Any]]:
+    """Streams the Things with the given ids or other identifiers as dictionaries of their attribute values.
+
+    Rows come from a server-side cursor yield_per at a time and are never built into ORM instances, so memory use
+    doesn't grow with the number of identifiers.
+    """
+    thing_columns = sqlalchemy.inspect(Thing).columns
+    statement = (
+        select(*[column.label(key) for key, column in thing_columns.items()])
+        .where(_things_with_ids_filter(identifiers))
+        .execution_options(stream_results=True, yield_per=yield_per)
+    )
+    result = session.execute(statement)
+    try:
+        for row in result:
+            yield row._asdict()
+    finally:
+        result.close()
+
+
 def get_thing_identifiers_for_thing(session: Session, thing_id: int) -> list[str]:
     statement = select(Thing.identifiers).where(Thing.primary_key == thing_id)
     session_exec = session.exec(statement)
@@ -248,6 +388,7 @@ def _base_thing_select(
     limit: int = 100,
     offset: int = 0,
     min_id: int = 0,
+    max_id: Optional[int] = None,
 ) -> SelectOfScalar[Thing]:
     thing_select = select(Thing).filter(Thing.resolved_status == status)
     if authority is not None:
@@ -258,6 +399,8 @@ def _base_thing_select(
         thing_select = thing_select.limit(limit)
     if min_id > 0:
         thing_select = thing_select.filter(Thing.primary_key > min_id)
+    if max_id is not None:
+        thing_select = thing_select.filter(Thing.primary_key <= max_id)
     return thing_select
 
 
@@ -269,8 +412,9 @@ def paged_things_with_ids(
     offset: int = 0,
     min_time_created: Optional[datetime.datetime] = None,
     min_id: int = 0,
+    max_id: Optional[int] = None,
 ) -> List[Thing]:
-    thing_select = _base_thing_select(authority, status, limit, offset, min_id)
+    thing_select = _base_thing_select(authority, status, limit, offset, min_id, max_id)
 
     if min_time_created is not None:
         thing_select = thing_select.filter(Thing.tcreated >= min_time_created)
@@ -278,6 +422,70 @@ def paged_things_with_ids(
     return session.exec(thing_select).all()
 
 
+def stream_things_with_ids(
+    session: Session,
+    authority: Optional[str] = None,
+    status: int = 200,
+    min_time_created: Optional[datetime.datetime] = None,
+    min_id: int = 0,
+    columns: Optional[list[str]] = None,
+    yield_per: int = 1000,
+    max_id: Optional[int] = None,
+) -> typing.Iterator[typing.Any]:
+    """Streams Things in primary key order through a single server-side cursor.
+
+    Rows are fetched from the cursor yield_per at a time rather than issuing a new LIMIT query per page.  Without
+    columns, detached Thing instances are yielded and nothing accumulates in the session's identity map.  With columns
+    (Thing attribute names, e.g. ["id", "resolved_content", "h3"]), only those columns are selected and plain rows with
+    matching attribute names are yielded, skipping ORM instance construction entirely.
+    """
+    thing_select = _base_thing_select(authority, status, -1, 0, min_id, max_id)
+    if min_time_created is not None:
+        thing_select = thing_select.filter(Thing.tcreated >= min_time_created)
+    thing_select = thing_select.order_by(Thing.primary_key.asc())
+    if columns is not None:
+        thing_select = thing_select.with_only_columns(*[getattr(Thing, column).label(column) for column in columns])
+    thing_select = thing_select.execution_options(stream_results=True, yield_per=yield_per)
+    if columns is not None:
+        result = session.execute(thing_select)
+    else:
+        result = session.exec(thing_select)
+    try:
+        for row in result:
+            if columns is None:
+                session.expunge(row)
+            yield row
+    finally:
+        result.close()
+
+
+def thing_primary_key_shard_bounds(
+    session: Session,
+    num_shards: int,
+    authority: Optional[str] = None,
+    status: int = 200,
+    min_time_created: Optional[datetime.datetime] = None,
+) -> list[int]:
+    """Splits the matching Things into num_shards runs of consecutive primary keys holding roughly equal numbers of
+    Things, and returns the largest primary key in each run.  Fewer bounds are returned if there are fewer Things than
+    shards."""
+    tile_select = select(
+        Thing.primary_key.label("primary_key"),
+        sqlalchemy.func.ntile(num_shards).over(order_by=Thing.primary_key).label("tile"),
+    ).filter(Thing.resolved_status == status)
+    if authority is not None:
+        tile_select = tile_select.filter(Thing.authority_id == authority)
+    if min_time_created is not None:
+        tile_select = tile_select.filter(Thing.tcreated >= min_time_created)
+    tiles = tile_select.subquery()
+    bounds_select = (
+        select(sqlalchemy.func.max(tiles.c.primary_key))
+        .group_by(tiles.c.tile)
+        .order_by(sqlalchemy.func.max(tiles.c.primary_key))
+    )
+    return list(session.execute(bounds_select).scalars().all())
+
+
 def things_for_sitemap(
     session: Session,
     authority: Optional[str] = None,
@@ -300,6 +508,47 @@ def things_for_sitemap(
     return things_result.all()
 
 
+def stream_things_for_sitemap(
+    session: Session,
+    authority: Optional[str] = None,
+    status: int = 200,
+    after: Optional[tuple[datetime.datetime, int]] = None,
+    yield_per: int = 10000,
+) -> typing.Iterator[tuple[str, datetime.datetime, int]]:
+    """Streams (id, tstamp, primary key) of the Things in sitemap order, by tstamp then primary key.
+
+    Unlike things_for_sitemap, the rows come from a single server-side cursor, and a build resumes after a
+    (tstamp, primary key) position instead of an offset the database has to count through.
+    """
+    thing_select = _base_thing_select(authority, status, -1, 0)
+    thing_select = thing_select.with_only_columns(Thing.id, Thing.tstamp, Thing.primary_key)
+    if after is not None:
+        thing_select = thing_select.filter(sqlalchemy.tuple_(Thing.tstamp, Thing.primary_key) > after)
+    thing_select = thing_select.order_by(Thing.tstamp.asc(), Thing.primary_key.asc())
+    thing_select = thing_select.execution_options(stream_results=True, yield_per=yield_per)
+    result = session.execute(thing_select)
+    try:
+        for row in result:
+            yield row[0], row[1], row[2]
+    finally:
+        result.close()
+
+
+def count_things_for_sitemap(
+    session: Session,
+    authority: Optional[str] = None,
+    status: int = 200,
+    through: Optional[tuple[datetime.datetime, int]] = None,
+) -> int:
+    """Counts the Things in sitemap order up to and including the (tstamp, primary key) position through"""
+    count_select = select(sqlalchemy.func.count(Thing.primary_key)).filter(Thing.resolved_status == status)
+    if authority is not None:
+        count_select = count_select.filter(Thing.authority_id == authority)
+    if through is not None:
+        count_select = count_select.filter(sqlalchemy.tuple_(Thing.tstamp, Thing.primary_key) <= through)
+    return session.exec(count_select).one()
+
+
 def things_by_authority_count(session: Session) -> list[tuple]:
     dbq = session.query(
         sqlalchemy.sql.label("authority", Thing.authority_id),
@@ -480,6 +729,26 @@ def all_thing_identifiers(session: Session, authority: typing.Optional[str] = No
     return thing_identifiers_dict
 
 
+def stream_thing_identifiers(
+    session: Session, authority: typing.Optional[str] = None, min_primary_key: int = 0, yield_per: int = 10000
+) -> typing.Iterator[typing.Tuple[int, str, typing.Optional[list]]]:
+    """Streams (primary key, id, identifiers) of the Things with a primary key greater than min_primary_key, in order"""
+    identifiers_select = select(Thing.primary_key, Thing.id, Thing.identifiers).where(
+        Thing.primary_key > min_primary_key
+    )
+    if authority is not None:
+        identifiers_select = identifiers_select.where(Thing.authority_id == authority)
+    identifiers_select = identifiers_select.order_by(Thing.primary_key.asc()).execution_options(
+        stream_results=True, yield_per=yield_per
+    )
+    result = session.execute(identifiers_select)
+    try:
+        for row in result:
+            yield row[0], row[1], row[2]
+    finally:
+        result.close()
+
+
 def all_thing_primary_keys(session: Session, authority: typing.Optional[str] = None) -> typing.Dict[str, int]:
     thing_pk_select = select(Thing.primary_key, Thing.id)
     if authority is not None:
@@ -604,11 +873,103 @@ def taxonomy_name_to_kingdom_map(session: Session) -> dict:
     return name_dict
 
 
+def taxonomy_name_rows(session: Session, yield_per: int = 10000) -> typing.Iterator[typing.Tuple[str, str]]:
+    """Streams (name, kingdom) rows sorted by the bytes of the name, then by primary key, for write_taxonomy_index"""
+    name_column = TaxonomyName.name
+    if session.get_bind().dialect.name == "postgresql":
+        # The database's default collation isn't byte order, SQLite already compares strings as bytes
+        name_column = sqlalchemy.collate(TaxonomyName.name, "C")
+    name_select = (
+        select(TaxonomyName.name, TaxonomyName.kingdom)
+        .order_by(name_column, TaxonomyName.primary_key)
+        .execution_options(stream_results=True, yield_per=yield_per)
+    )
+    result = session.execute(name_select)
+    try:
+        for row in result:
+            yield row[0], row[1]
+    finally:
+        result.close()
+
+
 def kingdom_for_taxonomy_name(session: Session, name: str) -> Optional[str]:
     kingdom_select = select(TaxonomyName.kingdom).where(or_(TaxonomyName.name == name, TaxonomyName.kingdom == name))
     return session.exec(kingdom_select).first()
 
 
+def solr_document_digests(session: Session, ids: list[str]) -> dict[str, str]:
+    digest_select = select(SolrDocumentDigest.id, SolrDocumentDigest.digest).where(SolrDocumentDigest.id.in_(ids))
+    digest_rows = session.execute(digest_select).fetchall()
+    digests_dict = {}
+    for row in digest_rows:
+        digests_dict[row[0]] = row[1]
+    return digests_dict
+
+
+def save_solr_document_digests(
+    session: Session, authority_id: Optional[str], digests: dict[str, str], existing_ids: typing.Collection[str]
+):
+    """Records the digests of solr documents that were just posted.
+
+    Args:
+        session: The database session
+        authority_id: The authority the documents belong to
+        digests: Dictionary of solr document id to document digest
+        existing_ids: The ids in digests that already have a row, as returned by solr_document_digests
+    """
+    now = datetime.datetime.now()
+    new_digests = []
+    existing_digests = []
+    for id, digest in digests.items():
+        digest_dict = {"id": id, "authority_id": authority_id, "digest": digest, "tstamp": now}
+        if id in existing_ids:
+            existing_digests.append(digest_dict)
+        else:
+            new_digests.append(digest_dict)
+    if len(new_digests) > 0:
+        session.bulk_insert_mappings(mapper=SolrDocumentDigest, mappings=new_digests, return_defaults=False)
+    if len(existing_digests) > 0:
+        session.bulk_update_mappings(mapper=SolrDocumentDigest, mappings=existing_digests)
+    session.commit()
+
+
+def solr_import_checkpoint(session: Session, name: str) -> Optional[SolrImportCheckpoint]:
+    checkpoint_select = select(SolrImportCheckpoint).where(SolrImportCheckpoint.name == name)
+    return session.exec(checkpoint_select).first()
+
+
+def solr_import_checkpoints_for_update(session: Session, names: list[str]) -> list[Optional[SolrImportCheckpoint]]:
+    """Returns the checkpoints with the names, None for those that don't exist, and locks their rows until the session's
+    transaction ends."""
+    checkpoint_select = select(SolrImportCheckpoint).where(SolrImportCheckpoint.name.in_(names)).with_for_update()
+    checkpoints = {checkpoint.name: checkpoint for checkpoint in session.exec(checkpoint_select)}
+    return [checkpoints.get(name) for name in names]
+
+
+def save_solr_import_checkpoint_plan(session: Session, checkpoints: list[SolrImportCheckpoint]) -> bool:
+    """Saves the checkpoints in a single transaction.  Returns False, saving none of them, if one was inserted
+    concurrently by another process."""
+    now = datetime.datetime.now()
+    try:
+        for checkpoint in checkpoints:
+            checkpoint.tstamp = now
+            session.merge(checkpoint)
+        session.commit()
+    except sqlalchemy.exc.IntegrityError:
+        session.rollback()
+        return False
+    return True
+
+
+def save_solr_import_checkpoint(session: Session, checkpoint: SolrImportCheckpoint) -> SolrImportCheckpoint:
+    """Saves the checkpoint.  The state is merged into the session, so the passed checkpoint is left detached and may
+    be saved again from a different session."""
+    checkpoint.tstamp = datetime.datetime.now()
+    session.merge(checkpoint)
+    session.commit()
+    return checkpoint
+
+
 def save_or_update_export_job(session: Session, export_job: ExportJob) -> ExportJob:
     now = igsn_lib.time.dtnow()
     if export_job.primary_key is None:
@@ -623,3 +984,58 @@ def export_job_with_uuid(session: Session, uuid: str) -> Optional[ExportJob]:
     export_job_select = select(ExportJob).where(ExportJob.uuid == uuid)
     result = session.exec(export_job_select)
     return result.first()
+
+
+def transform_cache_entries(session: Session, keys: list[str]) -> dict[str, typing.Any]:
+    entry_select = select(TransformCacheEntry.key, TransformCacheEntry.content).where(TransformCacheEntry.key.in_(keys))
+    entries_dict = {}
+    for row in session.execute(entry_select).fetchall():
+        entries_dict[row[0]] = row[1]
+    return entries_dict
+
+
+def save_transform_cache_entries(session: Session, entries: list[dict]):
+    """Inserts cached transforms.  Entries are immutable since the key covers everything the content depends on, so
+    entries whose key already has a row are skipped, including ones inserted concurrently by another process.
+
+    Args:
+        session: The database session
+        entries: Dictionaries of TransformCacheEntry column values
+    """
+    existing_keys = transform_cache_entries(session, [entry["key"] for entry in entries]).keys()
+    new_entries = {entry["key"]: entry for entry in entries if entry["key"] not in existing_keys}
+    if len(new_entries) == 0:
+        return
+    try:
+        session.bulk_insert_mappings(mapper=TransformCacheEntry, mappings=list(new_entries.values()), return_defaults=False)
+        session.commit()
+    except sqlalchemy.exc.IntegrityError:
+        session.rollback()
+
+
+def model_predictions(session: Session, keys: list[str]) -> dict[str, typing.Any]:
+    prediction_select = select(ModelPrediction.key, ModelPrediction.prediction).where(ModelPrediction.key.in_(keys))
+    predictions_dict = {}
+    for row in session.execute(prediction_select).fetchall():
+        predictions_dict[row[0]] = row[1]
+    return predictions_dict
+
+
+def save_model_predictions(session: Session, predictions: list[dict]):
+    """Inserts model server predictions, skipping those whose key already has a row like save_transform_cache_entries
+
+    Args:
+        session: The database session
+        predictions: Dictionaries of ModelPrediction column values
+    """
+    existing_keys = model_predictions(session, [prediction["key"] for prediction in predictions]).keys()
+    new_predictions = {
+        prediction["key"]: prediction for prediction in predictions if prediction["key"] not in existing_keys
+    }
+    if len(new_predictions) == 0:
+        return
+    try:
+        session.bulk_insert_mappings(mapper=ModelPrediction, mappings=list(new_predictions.values()), return_defaults=False)
+        session.commit()
+    except sqlalchemy.exc.IntegrityError:
+        session.rollback()
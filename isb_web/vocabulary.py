@@ -1,11 +1,13 @@
 import logging
 from typing import Optional
 
+import fastapi
 import term_store
 from term_store import TermRepository
 from fastapi import APIRouter, Depends
 from sqlmodel import Session
 from isb_lib.vocabulary import vocab_adapter
+from isb_web import conditional_requests
 from isb_web.sqlmodel_database import SQLModelDAO
 
 SAMPLEDFEATURE_URI = "https://w3id.org/isample/vocabulary/sampledfeature/1.0/anysampledfeature"
@@ -27,16 +29,29 @@ def get_repository(session: Session = Depends(get_session)) -> TermRepository:
     return term_store.get_repository(session)
 
 
+def _vocabulary_response(request: fastapi.Request, top_level_uri: str, repository: TermRepository):
+    vocabulary_dict = vocab_adapter.uijson_vocabulary_dict(top_level_uri, repository)
+    generation = vocab_adapter.uijson_vocabulary_generation(top_level_uri)
+    if generation is None:
+        # Nothing was cached, because there's no such vocabulary
+        return vocabulary_dict
+    digest, cached_time = generation
+    headers = conditional_requests.validator_headers(conditional_requests.entity_tag(digest), cached_time)
+    if conditional_requests.is_not_modified(request, headers["ETag"], cached_time):
+        return conditional_requests.not_modified_response(headers)
+    return fastapi.responses.JSONResponse(content=vocabulary_dict, headers=headers)
+
+
 @router.get("/material_sample_type")
-def material_sample_type(repository: TermRepository = Depends(get_repository)) -> dict:
-    return vocab_adapter.uijson_vocabulary_dict(PHYSICALSPECIMEN_URI, repository)
+def material_sample_type(request: fastapi.Request, repository: TermRepository = Depends(get_repository)) -> dict:
+    return _vocabulary_response(request, PHYSICALSPECIMEN_URI, repository)
 
 
 @router.get("/material_type")
-def material_type(repository: TermRepository = Depends(get_repository)) -> dict:
-    return vocab_adapter.uijson_vocabulary_dict(MATERIAL_URI, repository)
+def material_type(request: fastapi.Request, repository: TermRepository = Depends(get_repository)) -> dict:
+    return _vocabulary_response(request, MATERIAL_URI, repository)
 
 
 @router.get("/sampled_feature_type")
-def sampled_feature_type(repository: TermRepository = Depends(get_repository)) -> dict:
-    return vocab_adapter.uijson_vocabulary_dict(SAMPLEDFEATURE_URI, repository)
+def sampled_feature_type(request: fastapi.Request, repository: TermRepository = Depends(get_repository)) -> dict:
+    return _vocabulary_response(request, SAMPLEDFEATURE_URI, repository)
@@ -0,0 +1,77 @@
+import random
+import timeit
+import typing
+
+import click
+
+from isamples_metadata import OpenContextTransformer, SESARTransformer
+from isamples_metadata.Transformer import (
+    AbstractCategoryMapper,
+    AbstractCategoryMetaMapper,
+    StringEndsWithCategoryMapper,
+    StringEqualityCategoryMapper,
+    StringOrderedCategoryMapper,
+)
+
+META_MAPPERS: typing.Dict[str, typing.Type[AbstractCategoryMetaMapper]] = {
+    "SESAR material": SESARTransformer.MaterialCategoryMetaMapper,
+    "SESAR specimen": SESARTransformer.SpecimenCategoryMetaMapper,
+    "OpenContext material": OpenContextTransformer.MaterialCategoryMetaMapper,
+    "OpenContext specimen": OpenContextTransformer.SpecimenCategoryMetaMapper,
+}
+
+
+def _mapper_strings(mapper: AbstractCategoryMapper) -> typing.List[str]:
+    if isinstance(mapper, StringOrderedCategoryMapper):
+        return [string for submapper in mapper.submappers for string in _mapper_strings(submapper)]
+    if isinstance(mapper, StringEqualityCategoryMapper):
+        return [category.title() for category in mapper._categories]
+    if isinstance(mapper, StringEndsWithCategoryMapper):
+        return [f"Igneous>{mapper._endsWith.title()}"]
+    return []
+
+
+def _source_categories(meta_mapper: typing.Type[AbstractCategoryMetaMapper], num_inputs: int) -> typing.List[str]:
+    """A mix of values that match one of the mappers and values that match none, like real source records"""
+    matching = [string for mapper in meta_mapper.categories_mappers() for string in _mapper_strings(mapper)]
+    missing = [f"Unmapped category {i}" for i in range(len(matching))]
+    return [random.choice(matching if random.random() < 0.8 else missing) for _ in range(num_inputs)]
+
+
+def _uncompiled(meta_mapper: typing.Type[AbstractCategoryMetaMapper], source_categories: typing.List[str]):
+    mappers = meta_mapper.categories_mappers()
+    for source_category in source_categories:
+        categories: list = []
+        for mapper in mappers:
+            mapper.append_if_matched(source_category, None, categories)
+
+
+def _compiled(meta_mapper: typing.Type[AbstractCategoryMetaMapper], source_categories: typing.List[str]):
+    for source_category in source_categories:
+        meta_mapper.categories(source_category)
+
+
+@click.command()
+@click.option("-n", "--num_inputs", type=int, default=100000, help="Number of source categories per run", show_default=True)
+@click.option("-r", "--repeat", type=int, default=5, help="Number of timed runs, the best is reported", show_default=True)
+def main(num_inputs: int, repeat: int):
+    """Compares testing every category mapper in turn against the compiled lookup index"""
+    random.seed(42)
+    for name, meta_mapper in META_MAPPERS.items():
+        source_categories = _source_categories(meta_mapper, num_inputs)
+        baseline = None
+        for function_name, function in [("every mapper", _uncompiled), ("compiled", _compiled)]:
+            best = min(timeit.repeat(lambda: function(meta_mapper, source_categories), number=1, repeat=repeat))
+            if baseline is None:
+                baseline = best
+            print(
+                f"{name:<22} {function_name:<14} {best * 1e6 / num_inputs:8.2f} µs/category "
+                f"{num_inputs / best:12.0f} categories/s {baseline / best:6.2f}x"
+            )
+
+
+"""
+Micro-benchmark for mapping source categories to iSamples vocabulary terms
+"""
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import random
+import timeit
+
+import click
+
+from isamples_metadata.Transformer import geo_to_h3, geo_to_h3_all_resolutions, geo_to_h3_all_resolutions_batch, \
+    H3_MAX_RESOLUTION
+
+
+def _per_resolution(coordinates: list[tuple[float, float]]):
+    for latitude, longitude in coordinates:
+        [geo_to_h3(latitude, longitude, resolution) for resolution in range(0, H3_MAX_RESOLUTION + 1)]
+
+
+def _all_resolutions(coordinates: list[tuple[float, float]]):
+    for latitude, longitude in coordinates:
+        geo_to_h3_all_resolutions(latitude, longitude)
+
+
+def _all_resolutions_batch(coordinates: list[tuple[float, float]]):
+    geo_to_h3_all_resolutions_batch(coordinates)
+
+
+@click.command()
+@click.option("-n", "--num_points", type=int, default=10000, help="Number of random points per run", show_default=True)
+@click.option("-r", "--repeat", type=int, default=5, help="Number of timed runs, the best is reported", show_default=True)
+def main(num_points: int, repeat: int):
+    """Compares computing all 16 h3 resolutions per point with one lookup per resolution against deriving them from
+    the finest cell."""
+    random.seed(42)
+    coordinates = [(random.uniform(-90.0, 90.0), random.uniform(-180.0, 180.0)) for _ in range(num_points)]
+    baseline = None
+    for name, function in [
+        ("geo_to_h3 per resolution", _per_resolution),
+        ("geo_to_h3_all_resolutions", _all_resolutions),
+        ("geo_to_h3_all_resolutions_batch", _all_resolutions_batch),
+    ]:
+        best = min(timeit.repeat(lambda: function(coordinates), number=1, repeat=repeat))
+        if baseline is None:
+            baseline = best
+        print(
+            f"{name:<35} {best * 1e6 / num_points:8.2f} µs/point {num_points / best:12.0f} points/s "
+            f"{baseline / best:6.2f}x"
+        )
+
+
+"""
+Micro-benchmark for computing the h3 solr fields at every resolution
+"""
+if __name__ == "__main__":
+    main()
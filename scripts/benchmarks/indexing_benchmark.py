@@ -0,0 +1,274 @@
+import copy
+import http.server
+import json
+import os
+import resource
+import tempfile
+import threading
+import time
+import typing
+import urllib.parse
+
+import click
+
+import isamples_metadata.OpenContextTransformer
+import isb_lib.core
+import isb_lib.geome_adapter
+import isb_lib.opencontext_adapter
+from isamples_metadata.GEOMETransformer import GEOMETransformer
+from isamples_metadata.taxonomy.metadata_model_client import MODEL_SERVER_CLIENT
+from isb_web.sqlmodel_database import SQLModelDAO, DatabaseBulkUpdater
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "tests", "test_data")
+
+
+def _geome_copy(resolved_content: dict, suffix: str) -> typing.Tuple[str, dict]:
+    content = copy.deepcopy(resolved_content)
+    content["record"]["bcid"] = f"{content['record']['bcid']}{suffix}"
+    for child in content.get("children", []):
+        child["bcid"] = f"{child['bcid']}{suffix}"
+    return content["record"]["bcid"], content
+
+
+def _opencontext_copy(resolved_content: dict, suffix: str) -> typing.Tuple[str, dict]:
+    content = copy.deepcopy(resolved_content)
+    content["citation uri"] = f"{content['citation uri']}{suffix}"
+    content["uri"] = f"{content['uri']}{suffix}"
+    return content["citation uri"], content
+
+
+# authority id -> (directory of raw test records, function making a uniquely identified copy, core record function,
+# function computing the h3 the loader stores with the thing)
+# SESAR isn't included: SESARTransformer.keywords isn't implemented yet, so every SESAR record fails to transform and
+# there would be nothing to measure.
+AUTHORITIES: typing.Dict[str, typing.Tuple[str, typing.Callable, typing.Callable, typing.Callable]] = {
+    isb_lib.geome_adapter.GEOMEItem.AUTHORITY_ID: (
+        "GEOME/raw", _geome_copy, isb_lib.geome_adapter.reparseAsCoreRecord, GEOMETransformer.geo_to_h3
+    ),
+    isb_lib.opencontext_adapter.OpenContextItem.AUTHORITY_ID: (
+        "OpenContext/raw",
+        _opencontext_copy,
+        isb_lib.opencontext_adapter.reparse_as_core_record,
+        isamples_metadata.OpenContextTransformer.geo_to_h3,
+    ),
+}
+
+
+class _FakeSolrServer(http.server.ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _FakeSolrHandler)
+        self.lock = threading.Lock()
+        self.num_documents = 0
+        self.num_bytes = 0
+        self.num_commits = 0
+
+
+class _FakeSolrHandler(http.server.BaseHTTPRequestHandler):
+    """Accepts solr JSON updates and commits, and answers model server requests with no predictions"""
+
+    server: _FakeSolrServer
+    protocol_version = "HTTP/1.1"
+
+    def _read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks: typing.List[bytes] = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return b"".join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _respond(self, body: typing.Any):
+        response = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def do_GET(self):
+        path = urllib.parse.urlparse(self.path).path
+        if path.endswith("/update"):
+            self.server.num_commits += 1
+        self._respond({"responseHeader": {"status": 0}})
+
+    def do_POST(self):
+        path = urllib.parse.urlparse(self.path).path
+        body = self._read_body()
+        if path.startswith("/models/"):
+            self._respond([[] for _ in json.loads(body)] if path.endswith("/batch") else [])
+            return
+        # Parse the update like solr would, so malformed bodies still show up
+        docs = json.loads(body)
+        with self.server.lock:
+            self.server.num_documents += len(docs)
+            self.server.num_bytes += len(body)
+        self._respond({"responseHeader": {"status": 0}})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeSolr:
+    """Runs a fake solr /update endpoint (and model server) in a background thread of this process"""
+
+    def __init__(self):
+        self._server = _FakeSolrServer()
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/"
+
+    @property
+    def solr_url(self) -> str:
+        return f"{self.base_url}solr/isb_core_records/"
+
+    @property
+    def num_documents(self) -> int:
+        return self._server.num_documents
+
+    @property
+    def num_bytes(self) -> int:
+        return self._server.num_bytes
+
+    def __enter__(self) -> "FakeSolr":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def seed_things(db_url: str, authority_id: str, num_things: int) -> int:
+    """Inserts num_things copies of the authority's raw test records, each with a unique identifier"""
+    raw_dir, copy_function, _, h3_function = AUTHORITIES[authority_id]
+    raw_dir = os.path.join(TEST_DATA_DIR, raw_dir)
+    templates = []
+    for file_name in sorted(os.listdir(raw_dir)):
+        with open(os.path.join(raw_dir, file_name)) as raw_file:
+            templates.append(json.load(raw_file))
+    session = SQLModelDAO(db_url).get_session()
+    try:
+        updater = DatabaseBulkUpdater(session, authority_id, 5000, "application/json")
+        for i in range(num_things):
+            thing_id, resolved_content = copy_function(templates[i % len(templates)], f"_bench{i}")
+            updater.add_thing(resolved_content, thing_id, "http://localhost/benchmark", 200, h3_function(resolved_content))
+        updater.finish()
+    finally:
+        session.close()
+    return num_things
+
+
+def benchmark_transformer(db_url: str, authority_id: str) -> typing.Tuple[int, int, int, float]:
+    """Times the authority's core record function alone, returns (things, solr documents, failures, seconds)"""
+    core_record_function = AUTHORITIES[authority_id][2]
+    session = SQLModelDAO(db_url).get_session()
+    try:
+        things = list(isb_lib.core.ThingRecordIterator(session, authority_id).yieldRecordsByCursor())
+    finally:
+        session.close()
+    num_documents = 0
+    num_failures = 0
+    start = time.perf_counter()
+    for thing in things:
+        # Handle failures the same way the importer does
+        core_records, exclusion, error = isb_lib.core._transform_thing(core_record_function, thing)
+        num_documents += len(core_records)
+        num_failures += 1 if exclusion is not None or error is not None else 0
+    return len(things), num_documents, num_failures, time.perf_counter() - start
+
+
+def _peak_rss_mb(who: int) -> float:
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+@click.command()
+@click.option(
+    "-d", "--db_url", default=None,
+    help="SQLAlchemy URL of a scratch database to seed, a temporary SQLite database by default.  Existing things for the "
+         "benchmarked authorities are reindexed too, so don't point this at a real database."
+)
+@click.option(
+    "-a", "--authority", "authorities", multiple=True, type=click.Choice(list(AUTHORITIES.keys())),
+    help="Authority to benchmark, may be repeated.  All of them by default."
+)
+@click.option("-n", "--num_things", type=int, default=2000, help="Number of things to seed per authority", show_default=True)
+@click.option("-w", "--workers", type=int, default=1, help="Number of importer transform processes", show_default=True)
+@click.option("-q", "--queue_size", type=int, default=4, help="Importer queue size", show_default=True)
+@click.option(
+    "-p", "--prediction_batch_size", type=int, default=0, help="Importer prediction batch size", show_default=True
+)
+@click.option("--db_batch_size", type=int, default=1000, show_default=True)
+@click.option("--solr_batch_size", type=int, default=1000, show_default=True)
+def main(
+    db_url: typing.Optional[str],
+    authorities: typing.Tuple[str],
+    num_things: int,
+    workers: int,
+    queue_size: int,
+    prediction_batch_size: int,
+    db_batch_size: int,
+    solr_batch_size: int,
+):
+    """Measures the indexing throughput of CoreSolrImporter and of the individual transformers against a fake solr"""
+    authorities = authorities or tuple(AUTHORITIES.keys())
+    temp_dir = None
+    if db_url is None:
+        temp_dir = tempfile.TemporaryDirectory()
+        db_url = f"sqlite:///{os.path.join(temp_dir.name, 'benchmark.db')}"
+    with FakeSolr() as fake_solr:
+        # The transformers consult the model server for records without a material type
+        MODEL_SERVER_CLIENT.base_url = f"{fake_solr.base_url}models/"
+        for authority_id in authorities:
+            start = time.perf_counter()
+            seed_things(db_url, authority_id, num_things)
+            print(f"{authority_id}: seeded {num_things} things in {time.perf_counter() - start:.2f}s")
+
+            things, documents, failures, seconds = benchmark_transformer(db_url, authority_id)
+            print(
+                f"{authority_id}: transformer alone {things / seconds:10.0f} things/s {documents / seconds:10.0f} docs/s "
+                f"({failures} things failed or were excluded)"
+            )
+
+            documents_before = fake_solr.num_documents
+            importer = isb_lib.core.CoreSolrImporter(
+                db_url=db_url,
+                authority_id=authority_id,
+                db_batch_size=db_batch_size,
+                solr_batch_size=solr_batch_size,
+                solr_url=fake_solr.solr_url,
+                workers=workers,
+                queue_size=queue_size,
+                prediction_batch_size=prediction_batch_size,
+            )
+            start = time.perf_counter()
+            importer.run_solr_import(AUTHORITIES[authority_id][2])
+            seconds = time.perf_counter() - start
+            documents = fake_solr.num_documents - documents_before
+            print(
+                f"{authority_id}: run_solr_import    {things / seconds:10.0f} things/s {documents / seconds:10.0f} docs/s "
+                f"({documents} docs in {seconds:.2f}s)"
+            )
+            for stats in importer.stage_stats.values():
+                print(f"{authority_id}:   {stats}")
+    print(
+        f"solr received {fake_solr.num_documents} docs, {fake_solr.num_bytes / 1024 / 1024:.1f} MB; "
+        f"peak RSS {_peak_rss_mb(resource.RUSAGE_SELF):.0f} MB, "
+        f"transform workers {_peak_rss_mb(resource.RUSAGE_CHILDREN):.0f} MB"
+    )
+    if temp_dir is not None:
+        temp_dir.cleanup()
+
+
+"""
+Seeds a database with synthetic Things built from tests/test_data and measures indexing throughput against an in-process
+fake solr, e.g. python scripts/benchmarks/indexing_benchmark.py -n 10000 -w 4
+"""
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
-import concurrent.futures
+import collections
 import datetime
+import functools
+import itertools
 import json
 import typing
 import urllib.parse
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Iterator
 
 import click
@@ -16,7 +18,7 @@ import isb_web.config
 import logging
 import re
 
-from isb_lib.models.thing import Thing
+from isb_lib.sitemaps.concurrency import AIMDConcurrencyLimiter, OrderedQueueWriter
 from isb_lib.sitemaps.sitemap_fetcher import (
     SitemapIndexFetcher,
     SitemapFileFetcher,
@@ -26,12 +28,15 @@ from isb_lib.sitemaps.sitemap_fetcher import (
 from isb_web import sqlmodel_database
 from isb_web.sqlmodel_database import (
     SQLModelDAO,
-    all_thing_identifiers,
     thing_identifiers_from_resolved_content,
+    upsert_things,
 )
 
 __NUM_THINGS_FETCHED = 0
 
+# The number of fetched things decoded and saved at a time
+WRITE_BATCH_SIZE = 1000
+
 
 @click.command()
 @click.pass_context
@@ -73,10 +78,35 @@ __NUM_THINGS_FETCHED = 0
     default=-1,
     help="If specified, the start index of the sitemap files to ingest",
 )
-def main(ctx, url: str, authority: str, ignore_last_modified: bool, batch_size: int, file: str, start: int):
+@click.option(
+    "-c",
+    "--max_concurrency",
+    default=4,
+    show_default=True,
+    help="The most things requests to have in flight at once, the actual number adapts to how the server responds",
+)
+@click.option(
+    "-p",
+    "--parallel_files",
+    default=2,
+    show_default=True,
+    help="The number of sitemap files to fetch ahead of the one whose things are being requested",
+)
+def main(
+    ctx,
+    url: str,
+    authority: str,
+    ignore_last_modified: bool,
+    batch_size: int,
+    file: str,
+    start: int,
+    max_concurrency: int,
+    parallel_files: int,
+):
     solr_url = isb_web.config.Settings().solr_url
     rsession = requests.session()
-    adapter = requests.adapters.HTTPAdapter(pool_connections=5, pool_maxsize=5)
+    pool_size = max(5, max_concurrency + parallel_files)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
     rsession.mount("http://", adapter)
     rsession.mount("https://", adapter)
     db_url = isb_web.config.Settings().database_url
@@ -94,20 +124,20 @@ def main(ctx, url: str, authority: str, ignore_last_modified: bool, batch_size:
         last_updated_date = sqlmodel_database.last_time_thing_created(
             db_session, authority
         )
-    thing_ids_to_pks = all_thing_identifiers(db_session, authority)
     logging.info(
         f"Going to fetch records for authority {authority} with updated date > {last_updated_date}"
     )
     fetch_sitemap_files(
         authority,
         last_updated_date,
-        thing_ids_to_pks,
         rsession,
         url,
         db_session,
         batch_size,
         file,
-        start
+        start,
+        max_concurrency,
+        parallel_files,
     )
     logging.info(f"Completed.  Fetched {__NUM_THINGS_FETCHED} things total.")
 
@@ -151,14 +181,24 @@ def pre_thing_host_url(thing_url: str) -> typing.Optional[str]:
     return _group_from_thing_url_regex(thing_url, 1)
 
 
-def construct_thing_futures(
-    thing_futures: list,
+def _fetch_things(things_fetcher: ThingsFetcher, writer: OrderedQueueWriter, sequence_number: int):
+    # Hand the fetcher over before fetching, so once it's this batch's turn the writer saves things as they arrive.
+    # fetch_things doesn't raise, so the writer isn't left waiting for the rest of the things.
+    writer.put(sequence_number, things_fetcher)
+    things_fetcher.fetch_things()
+
+
+def submit_thing_fetches(
     sitemap_file_iterator: Iterator,
     sitemap_file_url: str,
     rsession: requests.Session,
     thing_executor: ThreadPoolExecutor,
     batch_size: int,
-) -> bool:
+    writer: OrderedQueueWriter,
+    concurrency_limiter: AIMDConcurrencyLimiter,
+) -> int:
+    """Splits the sitemap file's urls into things requests and submits them in order, returns the number submitted"""
+    num_submitted = 0
     constructed_all_futures_for_sitemap_file = False
     while not constructed_all_futures_for_sitemap_file:
         thing_ids: set = set()
@@ -187,102 +227,134 @@ def construct_thing_futures(
                 break
         if len(thing_ids) > 0 and things_url is not None:
             things_fetcher = ThingsFetcher(
-                things_url, sitemap_file_url, thing_ids, rsession
+                things_url, sitemap_file_url, thing_ids, rsession, concurrency_limiter
             )
-            things_future = thing_executor.submit(things_fetcher.fetch_things)
-            thing_futures.append(things_future)
-    return constructed_all_futures_for_sitemap_file
+            # Reserving blocks while too many fetched batches are waiting to be written
+            sequence_number = writer.reserve()
+            thing_executor.submit(_fetch_things, things_fetcher, writer, sequence_number)
+            num_submitted += 1
+    return num_submitted
+
+
+def _prepare_json_thing(authority: str, json_thing: dict) -> dict:
+    json_thing["tstamp"] = datetime.datetime.now()
+    identifiers = thing_identifiers_from_resolved_content(
+        authority, json_thing["resolved_content"]
+    )
+    identifiers.append(json_thing["id"])
+    json_thing["identifiers"] = json.dumps(identifiers)
+    return json_thing
+
+
+def save_things(authority: str, db_session, things_fetcher: ThingsFetcher, write_batch_size: int = WRITE_BATCH_SIZE):
+    """Saves the things fetched by a things request, called on the writer thread in sitemap order.
+
+    The things are saved write_batch_size at a time as the fetch hands them over, which may be while the rest of
+    the response is still being received.
+    """
+    global __NUM_THINGS_FETCHED
+    logging.info(
+        f"About to process things fetched from {things_fetcher.sitemap_url}"
+    )
+    num_things = 0
+    num_inserted = 0
+    num_updated = 0
+    json_things = (_prepare_json_thing(authority, json_thing) for json_thing in things_fetcher.iter_json_things())
+    try:
+        while True:
+            batch = list(itertools.islice(json_things, write_batch_size))
+            if len(batch) == 0:
+                break
+            # the primary keys aren't guaranteed to be the same here, so things are matched up by id
+            batch_inserted, batch_updated = upsert_things(db_session, batch)
+            num_things += len(batch)
+            num_inserted += batch_inserted
+            num_updated += batch_updated
+    finally:
+        things_fetcher.close()
+    if not things_fetcher.fetched:
+        logging.error(f"Error fetching thing for {things_fetcher.url}")
+    __NUM_THINGS_FETCHED += num_things
+    logging.info(
+        f"Just processed {num_things} things, inserted {num_inserted} and updated {num_updated}"
+    )
+
+
+def _fetch_sitemap_file(url: str, authority, last_updated_date, rsession) -> SitemapFileFetcher:
+    sitemap_file_fetcher = SitemapFileFetcher(
+        url, authority, last_updated_date, rsession
+    )
+    sitemap_file_fetcher.fetch_sitemap_file()
+    return sitemap_file_fetcher
+
+
+def _sitemap_file_urls(urls: typing.List[str], file: str, start: int) -> typing.List[str]:
+    file_urls = []
+    for num_files, url in enumerate(urls, start=1):
+        if file is not None and file not in url:
+            # there's a specific sitemap file specified, and this file isn't it, so continue on our way
+            # we expect file to be something like "sitemap-81.xml"
+            continue
+        if num_files < start:
+            # we've specified a start file (e.g. 81) and we are less than the start (e.g. sitemap-1.xml), so continue
+            continue
+        file_urls.append(url)
+    return file_urls
 
 
 def fetch_sitemap_files(
     authority,
     last_updated_date,
-    thing_ids: typing.Dict[str, int],
     rsession,
     url,
     db_session,
     batch_size: int,
     file: str,
-    start: int
+    start: int,
+    max_concurrency: int = 4,
+    parallel_files: int = 2,
 ):
+    """Fetches the things listed in the sitemap index at url and saves them to the database.
+
+    Up to parallel_files sitemap files are fetched ahead, and their things requests run on max_concurrency threads
+    gated by an AIMDConcurrencyLimiter, so the number of requests in flight grows while the server keeps up and backs
+    off when it slows down or returns server errors.  The fetched things are saved on a single writer thread in the
+    same order as the sitemap files and their urls, so a thing listed more than once ends up as its latest version.
+    """
     sitemap_index_fetcher = SitemapIndexFetcher(
         url, authority, last_updated_date, rsession
     )
-    # fetch the index file, and iterate over the individual sitemap files serially so we preserve order
     sitemap_index_fetcher.fetch_index_file()
-    num_files = 0
-    for url in sitemap_index_fetcher.urls_to_fetch:
-        num_files += 1
-        if file is not None and file not in url:
-            # there's a specific sitemap file specified, and this file isn't it, so continue on our way
-            # we expect file to be something like "sitemap-81.xml"
-            continue
-        if num_files < start:
-            # we've specified a start file (e.g. 81) and we are less than the start (e.g. sitemap-1.xml), so continue
-            continue
-        sitemap_file_fetcher = SitemapFileFetcher(
-            url, authority, last_updated_date, rsession
-        )
-        sitemap_file_fetcher.fetch_sitemap_file()
-        sitemap_file_iterator = sitemap_file_fetcher.url_iterator()
-        thing_futures: list = []
-        # max_workers is 1 so that we may execute one request at a time in order to avoid overwhelming the server
-        # We still gain benefits as the next things request executes while the local processing is occurring
-        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as thing_executor:
-            construct_thing_futures(
-                thing_futures,
-                sitemap_file_iterator,
-                sitemap_file_fetcher.url,
-                rsession,
-                thing_executor,
-                batch_size,
-            )
-            # Then read out results and save to the database after the queue is filled to capacity.
-            # Provided there are more urls in the iterator, return to the top of the loop to fill the queue again
-            for thing_fut in concurrent.futures.as_completed(thing_futures):
-                things_fetcher = thing_fut.result()
-                if (
-                    things_fetcher is not None
-                    and things_fetcher.json_things is not None
-                ):
-                    global __NUM_THINGS_FETCHED
-                    __NUM_THINGS_FETCHED += len(things_fetcher.json_things)
-                    logging.info(
-                        f"About to process {len(things_fetcher.json_things)} things"
-                    )
-                    current_existing_things_batch = []
-                    current_new_things_batch = []
+    concurrency_limiter = AIMDConcurrencyLimiter(max_limit=max_concurrency)
+    writer = OrderedQueueWriter(
+        functools.partial(save_things, authority, db_session), max_pending=2 * max_concurrency
+    )
+    num_requests = 0
+    try:
+        with ThreadPoolExecutor(max_workers=parallel_files) as file_executor, ThreadPoolExecutor(
+            max_workers=max_concurrency
+        ) as thing_executor:
+            # fetch sitemap files ahead, but hand out their things requests in order
+            pending_files: typing.Deque[Future] = collections.deque()
 
-                    for json_thing in things_fetcher.json_things:
-                        json_thing["tstamp"] = datetime.datetime.now()
-                        identifiers = thing_identifiers_from_resolved_content(
-                            authority, json_thing["resolved_content"]
-                        )
-                        identifiers.append(json_thing["id"])
-                        json_thing["identifiers"] = json.dumps(identifiers)
-                        # remove the pk as that isn't guaranteed to be the same
-                        del json_thing["primary_key"]
-                        if thing_ids.__contains__(json_thing["id"]):
-                            # existing row in the db, for the update to work we need to insert the pk into the dict
-                            json_thing["primary_key"] = thing_ids[json_thing["id"]]
-                            current_existing_things_batch.append(json_thing)
-                        else:
-                            current_new_things_batch.append(json_thing)
-                    db_session.bulk_insert_mappings(
-                        mapper=Thing,
-                        mappings=current_new_things_batch,
-                        return_defaults=False,
-                    )
-                    db_session.bulk_update_mappings(
-                        mapper=Thing, mappings=current_existing_things_batch
-                    )
-                    db_session.commit()
-                    logging.info(
-                        f"Just processed {len(things_fetcher.json_things)} things"
-                    )
-                else:
-                    logging.error(f"Error fetching thing for {things_fetcher.url}")
-                thing_futures.remove(thing_fut)
+            def submit_oldest_file() -> int:
+                sitemap_file_fetcher = pending_files.popleft().result()
+                return submit_thing_fetches(
+                    sitemap_file_fetcher.url_iterator(), sitemap_file_fetcher.url, rsession, thing_executor,
+                    batch_size, writer, concurrency_limiter
+                )
+
+            for file_url in _sitemap_file_urls(sitemap_index_fetcher.urls_to_fetch, file, start):
+                pending_files.append(
+                    file_executor.submit(_fetch_sitemap_file, file_url, authority, last_updated_date, rsession)
+                )
+                if len(pending_files) >= parallel_files:
+                    num_requests += submit_oldest_file()
+            while len(pending_files) > 0:
+                num_requests += submit_oldest_file()
+    finally:
+        writer.close()
+    logging.info(f"Made {num_requests} things requests, {concurrency_limiter}")
 
 
 if __name__ == "__main__":
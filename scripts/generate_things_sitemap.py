@@ -2,9 +2,8 @@ import click
 
 import isb_web.config
 import isb_lib.core
-from isb_lib.sitemaps import build_sitemap
 from isb_lib.sitemaps.thing_sitemap import (
-    ThingSitemapIndexIterator
+    ThingSitemapBuilder
 )
 from isb_web.sqlmodel_database import SQLModelDAO
 
@@ -24,11 +23,31 @@ from isb_web.sqlmodel_database import SQLModelDAO
     default=None,
     help="The hostname to include in the sitemap file",
 )
+@click.option(
+    "-i",
+    "--incremental",
+    is_flag=True,
+    help="Reuse the sitemap files at path that still list the same things, and only rewrite the rest",
+)
+@click.option(
+    "-z",
+    "--gzip",
+    "compress",
+    is_flag=True,
+    help="Write gzipped .xml.gz sitemap files",
+)
+@click.option(
+    "-w",
+    "--workers",
+    default=4,
+    show_default=True,
+    help="The number of sitemap files to write in parallel",
+)
 @click.pass_context
-def main(ctx, path: str, host: str):
+def main(ctx, path: str, host: str, incremental: bool, compress: bool, workers: int):
     isb_lib.core.things_main(ctx, isb_web.config.Settings().database_url, isb_web.config.Settings().solr_url, "INFO")
     session = SQLModelDAO(isb_web.config.Settings().database_url).get_session()
-    build_sitemap(path, host, ThingSitemapIndexIterator(session))
+    ThingSitemapBuilder(session, path, host, compress=compress, max_workers=workers).build(incremental)
 
 
 if __name__ == "__main__":
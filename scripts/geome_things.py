@@ -11,9 +11,10 @@ import asyncio
 import concurrent.futures
 import click
 import click_config_file
+from isb_lib.identifier_index import IdentifierIndex, get_existing_thing, refresh_identifier_index
 from isb_lib.models.thing import Thing
 from isb_web import sqlmodel_database
-from isb_web.sqlmodel_database import SQLModelDAO, get_thing_with_id, save_thing
+from isb_web.sqlmodel_database import SQLModelDAO, save_thing
 from typing import Optional
 
 CONCURRENT_DOWNLOADS = 10
@@ -39,9 +40,9 @@ def countThings(session):
     return cnt
 
 
-async def _loadGEOMEEntries(session, max_count, start_from=None):  # noqa: C901 -- need to examine computational complexity
+async def _loadGEOMEEntries(session, max_count, start_from=None, identifier_index: Optional[IdentifierIndex] = None):  # noqa: C901 -- need to examine computational complexity
     L = getLogger()
-    futures = []
+    futures: list = []
     working = {}
     ids = isb_lib.geome_adapter.GEOMEIdentifierIterator(
         max_entries=countThings(session) + max_count, date_start=start_from
@@ -73,7 +74,7 @@ async def _loadGEOMEEntries(session, max_count, start_from=None):  # noqa: C901
                 try:
                     _id = next(ids)
                     identifier = _id[0]
-                    existing_thing = get_thing_with_id(session, identifier)
+                    existing_thing = get_existing_thing(session, identifier_index, identifier)
                     if existing_thing is not None:
                         logging.debug("Already have %s at %s", identifier, _id[1])
                         future = executor.submit(wrapLoadThing, identifier, _id[1], existing_thing)
@@ -137,10 +138,10 @@ async def _loadGEOMEEntries(session, max_count, start_from=None):  # noqa: C901
             )
 
 
-def loadGEOMEEntries(session, max_count, start_from=None):
+def loadGEOMEEntries(session, max_count, start_from=None, identifier_index: Optional[IdentifierIndex] = None):
     loop = asyncio.get_event_loop()
     future = asyncio.ensure_future(
-        _loadGEOMEEntries(session, max_count, start_from=start_from)
+        _loadGEOMEEntries(session, max_count, start_from=start_from, identifier_index=identifier_index)
     )
     loop.run_until_complete(future)
 
@@ -169,8 +170,15 @@ def main(ctx, db_url, solr_url, verbosity):
     default=1000,
     help="Maximum records to load, -1 for all",
 )
+@click.option(
+    "-x",
+    "--identifier_index",
+    "identifier_index_path",
+    default=None,
+    help="Path of an identifier index file to refresh and use to skip the database lookup for new records",
+)
 @click.pass_context
-def loadRecords(ctx, max_records):
+def loadRecords(ctx, max_records, identifier_index_path):
     L = getLogger()
     L.info("loadRecords, max = %s", max_records)
     if max_records == -1:
@@ -182,8 +190,14 @@ def loadRecords(ctx, max_records):
             session, isb_lib.geome_adapter.GEOMEItem.AUTHORITY_ID
         )
         logging.info("Oldest = %s", max_created)
+        identifier_index = None
+        if identifier_index_path is not None:
+            identifier_index = refresh_identifier_index(
+                session, identifier_index_path, isb_lib.geome_adapter.GEOMEItem.AUTHORITY_ID
+            )
+            logging.info("Identifier index has %d identifiers", len(identifier_index))
         time.sleep(1)
-        loadGEOMEEntries(session, max_records, start_from=max_created)
+        loadGEOMEEntries(session, max_records, start_from=max_created, identifier_index=identifier_index)
     finally:
         session.close()
 
@@ -312,8 +326,32 @@ def reloadRecords(ctx, status_code):
 @click.option(
     "-I", "--ignore_last_modified", is_flag=True, help="Whether to ignore the last modified date and do a full rebuild"
 )
+@click.option(
+    "-w", "--workers", type=int, default=1, help="Number of processes to use for transforming records", show_default=True
+)
+@click.option(
+    "-q", "--queue_size", type=int, default=4, help="Number of pages and solr batches buffered between import stages", show_default=True
+)
+@click.option(
+    "-u", "--skip_unchanged", is_flag=True, help="Whether to skip posting solr documents that haven't changed since they were last indexed"
+)
+@click.option(
+    "-r", "--resume", is_flag=True, help="Whether to continue after the last checkpoint of a previous import instead of starting over"
+)
+@click.option(
+    "-l", "--limit", type=int, default=-1, help="Maximum number of things to import in this invocation, -1 for all", show_default=True
+)
+@click.option(
+    "-n", "--num_shards", type=int, default=1, help="Number of primary key ranges to split the import into", show_default=True
+)
+@click.option(
+    "-x", "--shard", type=int, default=None, help="Only import this shard (0 based), by default all shards are imported concurrently"
+)
+@click.option(
+    "-t", "--transform_cache", is_flag=True, help="Whether to reuse the cached transforms of things that haven't changed since they were last indexed"
+)
 @click.pass_context
-def populateIsbCoreSolr(ctx, ignore_last_modified: bool):
+def populateIsbCoreSolr(ctx, ignore_last_modified: bool, workers: int, queue_size: int, skip_unchanged: bool, resume: bool, limit: int, num_shards: int, shard: Optional[int], transform_cache: bool):
     logger = getLogger()
     db_url = ctx.obj["db_url"]
     solr_url = ctx.obj["solr_url"]
@@ -325,13 +363,21 @@ def populateIsbCoreSolr(ctx, ignore_last_modified: bool):
             authority_id=isb_lib.geome_adapter.GEOMEItem.AUTHORITY_ID,
         )
     logger.info(f"Going to index Things with tcreated > {max_solr_updated_date}")
-    solr_importer = isb_lib.core.CoreSolrImporter(
+    solr_importer = isb_lib.core.ShardedCoreSolrImporter(
+        num_shards=num_shards,
+        shard=shard,
         db_url=db_url,
         authority_id=isb_lib.geome_adapter.GEOMEItem.AUTHORITY_ID,
         db_batch_size=1000,
         solr_batch_size=1000,
         solr_url=solr_url,
-        min_time_created=max_solr_updated_date
+        min_time_created=max_solr_updated_date,
+        workers=workers,
+        queue_size=queue_size,
+        skip_unchanged=skip_unchanged,
+        resume=resume,
+        limit=limit,
+        transform_cache=transform_cache,
     )
     allkeys = solr_importer.run_solr_import(isb_lib.geome_adapter.reparseAsCoreRecord)
     logger.info(f"Total keys= {len(allkeys)}")
@@ -1,6 +1,7 @@
 import json
 import logging
 import sys
+from typing import Optional
 
 import click
 import click_config_file
@@ -138,16 +139,48 @@ def reparse_as_core_record(thing: isb_lib.models.thing.Thing) -> list[dict]:
 
 
 @main.command("populate_isb_core_solr")
+@click.option(
+    "-w", "--workers", type=int, default=1, help="Number of processes to use for transforming records", show_default=True
+)
+@click.option(
+    "-q", "--queue_size", type=int, default=4, help="Number of pages and solr batches buffered between import stages", show_default=True
+)
+@click.option(
+    "-u", "--skip_unchanged", is_flag=True, help="Whether to skip posting solr documents that haven't changed since they were last indexed"
+)
+@click.option(
+    "-r", "--resume", is_flag=True, help="Whether to continue after the last checkpoint of a previous import instead of starting over"
+)
+@click.option(
+    "-l", "--limit", type=int, default=-1, help="Maximum number of things to import in this invocation, -1 for all", show_default=True
+)
+@click.option(
+    "-n", "--num_shards", type=int, default=1, help="Number of primary key ranges to split the import into", show_default=True
+)
+@click.option(
+    "-x", "--shard", type=int, default=None, help="Only import this shard (0 based), by default all shards are imported concurrently"
+)
+@click.option(
+    "-t", "--transform_cache", is_flag=True, help="Whether to reuse the cached transforms of things that haven't changed since they were last indexed"
+)
 @click.pass_context
-def populate_isb_core_solr(ctx):
+def populate_isb_core_solr(ctx, workers: int, queue_size: int, skip_unchanged: bool, resume: bool, limit: int, num_shards: int, shard: Optional[int], transform_cache: bool):
     db_url = ctx.obj["db_url"]
     solr_url = ctx.obj["solr_url"]
-    solr_importer = isb_lib.core.CoreSolrImporter(
+    solr_importer = isb_lib.core.ShardedCoreSolrImporter(
+        num_shards=num_shards,
+        shard=shard,
         db_url=db_url,
         authority_id=config.Settings().authority_id,
         db_batch_size=1000,
         solr_batch_size=1000,
-        solr_url=solr_url
+        solr_url=solr_url,
+        workers=workers,
+        queue_size=queue_size,
+        skip_unchanged=skip_unchanged,
+        resume=resume,
+        limit=limit,
+        transform_cache=transform_cache,
     )
     allkeys = solr_importer.run_solr_import(
         reparse_as_core_record
@@ -0,0 +1,70 @@
+import logging
+
+import click
+import click_config_file
+
+import isb_lib.core
+from isb_lib.models.thing import thing_identifier_keys, upsert_thing_identifiers
+from isb_web.sqlmodel_database import SQLModelDAO, stream_thing_identifiers
+
+BATCH_SIZE = 10000
+
+
+@click.command()
+@click.option(
+    "-d", "--db_url", default=None, help="SQLAlchemy database URL for storage"
+)
+@click.option(
+    "-a", "--authority", default=None, help="Only backfill the Things of this authority"
+)
+@click.option(
+    "-s",
+    "--start_primary_key",
+    default=0,
+    help="Resume after the Thing with this primary key, as logged by an earlier run",
+    show_default=True,
+)
+@click.option(
+    "-v",
+    "--verbosity",
+    default="DEBUG",
+    help="Specify logging level",
+    show_default=True,
+)
+@click_config_file.configuration_option(config_file_name="isb.cfg")
+@click.pass_context
+def main(ctx, db_url, authority, start_primary_key, verbosity):
+    isb_lib.core.things_main(ctx, db_url, None, verbosity)
+    dao = SQLModelDAO(ctx.obj["db_url"])
+    # Read with a server-side cursor on one session and commit the batches on another, committing would close the
+    # cursor
+    with dao.get_session() as read_session, dao.get_session() as write_session:
+        populate_thing_identifiers(read_session, write_session, authority, start_primary_key)
+
+
+def populate_thing_identifiers(read_session, write_session, authority, start_primary_key):
+    """Adds the ids and identifiers of existing Things to the ThingIdentifier lookup table, in primary key order"""
+    primary_keys = {}
+    num_things = 0
+    last_primary_key = start_primary_key
+    for primary_key, thing_id, identifiers in stream_thing_identifiers(
+        read_session, authority, start_primary_key, BATCH_SIZE
+    ):
+        primary_keys.update(dict.fromkeys(thing_identifier_keys(thing_id, identifiers), primary_key))
+        num_things += 1
+        last_primary_key = primary_key
+        if num_things % BATCH_SIZE == 0:
+            upsert_thing_identifiers(write_session.connection(), primary_keys)
+            write_session.commit()
+            primary_keys = {}
+            logging.info(f"Indexed the identifiers of {num_things} things, through primary key {last_primary_key}")
+    upsert_thing_identifiers(write_session.connection(), primary_keys)
+    write_session.commit()
+    logging.info(f"Done.  Indexed the identifiers of {num_things} things, through primary key {last_primary_key}")
+
+
+"""
+Backfills the ThingIdentifier table that get_thing_with_id uses to look up Things by their other identifiers
+"""
+if __name__ == "__main__":
+    main()
@@ -43,7 +43,7 @@ async def run_models(session: Session, dest_path: str):
         header = "id\tmaterial_categories\tmaterial_category_confidences\n"
         await writer(header)
         await aiodf.fsync()
-        for thing in thing_iterator.yieldRecordsByPage():
+        for thing in thing_iterator.yieldRecordsByCursor(columns=["resolved_content"]):
             counter = counter + 1
             if counter % 1000 == 0:
                 current_time = time.time()
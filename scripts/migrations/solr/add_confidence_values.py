@@ -1,70 +1,61 @@
-import logging
 from typing import Optional
 
 import click
-import requests
 
 import isb_lib.core
 import isb_web.config
-import isb_lib.sesar_adapter
 from isamples_metadata.Transformer import Transformer
-from isb_web.isb_solr_query import ISBCoreSolrRecordIterator
+from isb_lib.solr_backfill import SolrBackfill
+
+CATEGORY_CONFIDENCE_FIELDS = {
+    "hasContextCategory": "hasContextCategoryConfidence",
+    "hasMaterialCategory": "hasMaterialCategoryConfidence",
+    "hasSpecimenCategory": "hasSpecimenCategoryConfidence",
+}
 
 
 @click.command()
+@click.option("-w", "--workers", type=int, default=4, help="Number of threads posting updates to solr", show_default=True)
+@click.option("-n", "--dry_run", is_flag=True, help="Only count and log the updates, don't post them")
+@click.option("-r", "--resume", is_flag=True, help="Continue from the checkpoint of a previous run")
+@click.option(
+    "-c", "--checkpoint", default="add_confidence_values_checkpoint.json", help="Path of the checkpoint file", show_default=True
+)
 @click.pass_context
-def main(ctx):
+def main(ctx, workers: int, dry_run: bool, resume: bool, checkpoint: str):
     solr_url = isb_web.config.Settings().solr_url
     isb_lib.core.things_main(ctx, None, solr_url)
-    add_confidence_values(solr_url)
-
-
-def add_confidence_values(solr_url: str):
-    total_records = 0
-    batch_size = 10000
-    current_mutated_batch = []
-    rsession = requests.session()
-    iterator = ISBCoreSolrRecordIterator(rsession, "*:*", batch_size, 0, "id asc")
-    for record in iterator:
-        mutated_record = mutate_record(record)
-        if mutated_record is not None:
-            current_mutated_batch.append(mutated_record)
-        if len(current_mutated_batch) == batch_size:
-            save_mutated_batch(current_mutated_batch, rsession, solr_url)
-            current_mutated_batch = []
-        total_records += 1
-    if len(current_mutated_batch) > 0:
-        # handle the remainder
-        save_mutated_batch(current_mutated_batch, rsession, solr_url)
-    logging.info(f"Finished iterating, visited {total_records} records")
+    add_confidence_values(solr_url, workers, dry_run, resume, checkpoint)
 
 
-def save_mutated_batch(current_mutated_batch, rsession, solr_url):
-    logging.info(f"Going to save {len(current_mutated_batch)} records")
-    isb_lib.core.solrAddRecords(rsession, current_mutated_batch, solr_url)
-    isb_lib.core.solrCommit(rsession, solr_url)
-    logging.info(f"Just saved {len(current_mutated_batch)} records")
+def add_confidence_values(solr_url: str, workers: int, dry_run: bool, resume: bool, checkpoint: str):
+    SolrBackfill(
+        solr_url,
+        "*:*",
+        compute_fields,
+        fields=list(CATEGORY_CONFIDENCE_FIELDS.keys()) + list(CATEGORY_CONFIDENCE_FIELDS.values()),
+        workers=workers,
+        dry_run=dry_run,
+        resume=resume,
+        checkpoint_path=checkpoint,
+    ).run()
 
 
-def _insert_confidence_values(record: dict, category_str: str, confidence_str: str) -> bool:
+def _confidence_values(record: dict, category_str: str, confidence_str: str) -> Optional[list]:
     categories: Optional[list] = record.get(category_str)
     if categories is None or record.get(confidence_str) is not None:
-        return False
-    else:
-        confidences = []
-        for _ in categories:
-            confidences.append(Transformer.RULE_BASED_CONFIDENCE)
-        record[confidence_str] = confidences
-        return True
+        return None
+    return [Transformer.RULE_BASED_CONFIDENCE for _ in categories]
 
 
-def mutate_record(record: dict) -> Optional[dict]:
-    # Do whatever work is required to mutate the record to update things…
-    record_copy = record.copy()
-    changed = _insert_confidence_values(record_copy, "hasContextCategory", "hasContextCategoryConfidence")
-    changed = changed or _insert_confidence_values(record_copy, "hasMaterialCategory", "hasMaterialCategoryConfidence")
-    changed = changed or _insert_confidence_values(record_copy, "hasSpecimenCategory", "hasSpecimenCategoryConfidence")
-    return record_copy if changed else None
+def compute_fields(record: dict) -> Optional[dict]:
+    # Add a rule-based confidence for every category that doesn't have confidences yet
+    changed_fields = {}
+    for category_str, confidence_str in CATEGORY_CONFIDENCE_FIELDS.items():
+        confidences = _confidence_values(record, category_str, confidence_str)
+        if confidences is not None:
+            changed_fields[confidence_str] = confidences
+    return changed_fields
 
 
 """
@@ -25,7 +25,7 @@ def compute_geome_permitting_information(session: Session) -> dict:
             offset=0
         )
         # thing = get_thing_with_id(session, "IGSN:NHB002GWT")
-        for thing in thing_iterator.yieldRecordsByPage():
+        for thing in thing_iterator.yieldRecordsByCursor(columns=["resolved_content"]):
             resolved_content = thing.resolved_content
             parent = resolved_content.get("parent")
             permit_information = parent.get("permitInformation")
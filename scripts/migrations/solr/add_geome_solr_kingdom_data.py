@@ -1,4 +1,5 @@
 import logging
+import os
 from typing import Optional
 
 import click
@@ -10,22 +11,31 @@ import isb_lib.core
 import isb_web.config
 import isb_lib.geome_adapter
 from isamples_metadata import GEOMETransformer
+from isamples_metadata.taxonomy.taxonomy_index import TaxonomyIndex, write_taxonomy_index
 from isb_web.isb_solr_query import ISBCoreSolrRecordIterator
-from isb_web.sqlmodel_database import SQLModelDAO, taxonomy_name_to_kingdom_map
+from isb_web.sqlmodel_database import SQLModelDAO, taxonomy_name_rows
 
 
 @click.command()
+@click.option(
+    "-i", "--index_path", default="taxonomy_index.bin", show_default=True,
+    help="Path of the taxonomy index file, built from the taxonomy names in the database if it doesn't exist"
+)
+@click.option("-r", "--rebuild", is_flag=True, help="Rebuild the taxonomy index even if it already exists")
 @click.pass_context
-def main(ctx):
+def main(ctx, index_path: str, rebuild: bool):
     db_url = isb_web.config.Settings().database_url
     solr_url = isb_web.config.Settings().solr_url
     isb_lib.core.things_main(ctx, None, solr_url)
     session = SQLModelDAO(db_url).get_session()
-    add_kingdom_data(session, solr_url)
+    if rebuild or not os.path.exists(index_path):
+        num_names = write_taxonomy_index(index_path, taxonomy_name_rows(session))
+        logging.info(f"Wrote {num_names} taxonomy names to {index_path}")
+    with TaxonomyIndex(index_path) as taxonomy_index:
+        add_kingdom_data(session, solr_url, taxonomy_index)
 
 
-def add_kingdom_data(session: Session, solr_url: str):
-    map = taxonomy_name_to_kingdom_map(session)
+def add_kingdom_data(session: Session, solr_url: str, taxonomy_index: TaxonomyIndex):
     batch_size = 10000
     thing_iterator = isb_lib.core.ThingRecordIterator(
         session,
@@ -38,28 +48,25 @@ def add_kingdom_data(session: Session, solr_url: str):
     uniqued_unknown_names = set()
     # Gather the kingdom values by sample id
     sample_id_to_kingdom = {}
-    for thing in thing_iterator.yieldRecordsByPage():
-        transformer = GEOMETransformer.GEOMETransformer(source_record=thing.resolved_content)
+    for thing in thing_iterator.yieldRecordsByCursor(columns=["resolved_content"]):
+        transformer = GEOMETransformer.GEOMETransformer(
+            source_record=thing.resolved_content, taxonomy_index=taxonomy_index
+        )
         total_things += 1
         if total_things % 1000 == 0:
             logging.info(f"Visited {total_things} things, current percentage of things with identified kingdom: {num_with_resolved_kingdom / total_things}")
-        ranks = ["kingdom", "phylum", "genus"]
-        checked_ranks = []
-        record = thing.resolved_content["record"]
-        for rank in ranks:
-            value = record.get(rank)
-            if value is not None and value != "unidentified":
-                checked_ranks.append(value)
-                # Check to see if we have a hit in our name cache
-                resolved_kingdom = map.get(value)
-                if resolved_kingdom is not None:
-                    num_with_resolved_kingdom += 1
-                    break
+        resolved_kingdom = transformer.kingdom()
         if resolved_kingdom is None:
+            record = thing.resolved_content["record"]
+            checked_ranks = [
+                record[rank] for rank in GEOMETransformer.GEOMETransformer.KINGDOM_RANKS
+                if record.get(rank) is not None and record.get(rank) != "unidentified"
+            ]
             print(f"couldnt find kingdom for {checked_ranks}")
             for rank in checked_ranks:
                 uniqued_unknown_names.add(rank)
         else:
+            num_with_resolved_kingdom += 1
             sample_id_to_kingdom[transformer.sample_identifier_string()] = resolved_kingdom
             for child_transformer in transformer.child_transformers:
                 sample_id_to_kingdom[child_transformer.sample_identifier_string()] = resolved_kingdom
@@ -1,70 +1,60 @@
-import logging
 from typing import Optional
 
 import click
-import requests
 
 import isb_lib.core
 import isb_web.config
-import isb_lib.sesar_adapter
-from isamples_metadata.Transformer import geo_to_h3
-from isb_web.isb_solr_query import ISBCoreSolrRecordIterator
+from isamples_metadata.Transformer import geo_to_h3_all_resolutions_batch
+from isb_lib.solr_backfill import SolrBackfill
+
+LATITUDE_FIELD = "producedBy_samplingSite_location_latitude"
+LONGITUDE_FIELD = "producedBy_samplingSite_location_longitude"
 
 
 @click.command()
+@click.option("-w", "--workers", type=int, default=4, help="Number of threads posting updates to solr", show_default=True)
+@click.option("-n", "--dry_run", is_flag=True, help="Only count and log the updates, don't post them")
+@click.option("-r", "--resume", is_flag=True, help="Continue from the checkpoint of a previous run")
+@click.option(
+    "-c", "--checkpoint", default="add_h3_different_resolutions_checkpoint.json", help="Path of the checkpoint file",
+    show_default=True
+)
 @click.pass_context
-def main(ctx):
+def main(ctx, workers: int, dry_run: bool, resume: bool, checkpoint: str):
     solr_url = isb_web.config.Settings().solr_url
     isb_lib.core.things_main(ctx, None, solr_url)
-    add_h3_values(solr_url)
+    add_h3_values(solr_url, workers, dry_run, resume, checkpoint)
 
 
-def add_h3_values(solr_url: str):
-    total_records = 0
-    batch_size = 50000
-    current_mutated_batch = []
-    rsession = requests.session()
-    iterator = ISBCoreSolrRecordIterator(
-        rsession, "-(_nest_path_:*) AND producedBy_samplingSite_location_latitude:*", batch_size, 0, "id asc"
-    )
-    for record in iterator:
-        mutated_record = mutate_record(record)
-        if mutated_record is not None:
-            current_mutated_batch.append(mutated_record)
-        if len(current_mutated_batch) == batch_size:
-            save_mutated_batch(current_mutated_batch, rsession, solr_url)
-            current_mutated_batch = []
-        total_records += 1
-    if len(current_mutated_batch) > 0:
-        # handle the remainder
-        save_mutated_batch(current_mutated_batch, rsession, solr_url)
-    logging.info(f"Finished iterating, visited {total_records} records")
+def add_h3_values(solr_url: str, workers: int, dry_run: bool, resume: bool, checkpoint: str):
+    SolrBackfill(
+        solr_url,
+        f"-(_nest_path_:*) AND {LATITUDE_FIELD}:* AND -(producedBy_samplingSite_location_h3_0:*)",
+        None,
+        fields=[LATITUDE_FIELD, LONGITUDE_FIELD],
+        workers=workers,
+        dry_run=dry_run,
+        resume=resume,
+        checkpoint_path=checkpoint,
+        compute_page_fields=compute_page_fields,
+    ).run()
 
 
-def save_mutated_batch(current_mutated_batch, rsession, solr_url):
-    logging.info(f"Going to save {len(current_mutated_batch)} records")
-    isb_lib.core.solrAddRecords(rsession, current_mutated_batch, solr_url)
-    isb_lib.core.solrCommit(rsession, solr_url)
-    logging.info(f"Just saved {len(current_mutated_batch)} records")
+def _changed_fields(h3_cells: Optional[list[str]]) -> dict:
+    # Remove old problematic fields
+    changed_fields: dict = {
+        "producedBy_samplingSite_location_h3": None,
+        "producedBy_samplingSite_location_cesium_height": None,
+    }
+    if h3_cells is not None:
+        for index, h3_at_resolution in enumerate(h3_cells):
+            changed_fields[f"producedBy_samplingSite_location_h3_{index}"] = h3_at_resolution
+    return changed_fields
 
 
-def mutate_record(record: dict) -> Optional[dict]:
-    if record.get("producedBy_samplingSite_location_h3_0") is not None:
-        return None
-    # Do whatever work is required to mutate the record to update things…
-    record_copy = record.copy()
-    # Remove old problematic fields
-    record.pop("producedBy_samplingSite_location_h3")
-    record_copy.pop("producedBy_samplingSite_location_cesium_height")
-    for index in range(0, 16):
-        h3_at_resolution = geo_to_h3(
-            record.get("producedBy_samplingSite_location_latitude"),
-            record.get("producedBy_samplingSite_location_longitude"),
-            index,
-        )
-        field_name = f"producedBy_samplingSite_location_h3_{index}"
-        record_copy[field_name] = h3_at_resolution
-    return record_copy
+def compute_page_fields(records: list[dict]) -> list[Optional[dict]]:
+    coordinates = [(record.get(LATITUDE_FIELD), record.get(LONGITUDE_FIELD)) for record in records]
+    return [_changed_fields(h3_cells) for h3_cells in geo_to_h3_all_resolutions_batch(coordinates)]
 
 
 """
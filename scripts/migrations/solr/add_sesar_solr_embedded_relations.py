@@ -63,7 +63,7 @@ def compute_sesar_parent_relations(session: Session) -> dict:
             offset=0
         )
         # thing = get_thing_with_id(session, "IGSN:NHB002GWT")
-        for thing in thing_iterator.yieldRecordsByPage():
+        for thing in thing_iterator.yieldRecordsByCursor(columns=["resolved_content"]):
             parent = thing.resolved_content.get("description").get("parentIdentifier")
             if parent is not None:
                 igsn_to_parent_igsn[fullIgsn(thing.resolved_content.get("igsn"))] = fullIgsn(parent)
@@ -1,4 +1,5 @@
 import datetime
+from typing import Optional
 import logging
 import click
 import click_config_file
@@ -135,7 +136,7 @@ def recreate_records(ctx):
     records = isb_lib.opencontext_adapter.OpenContextRecordIterator(
         max_entries=-1, date_start=None, page_size=OPENCONTEXT_PAGE_SIZE
     )
-    bulk_updater = DatabaseBulkUpdater(session, opencontext_adapter.OpenContextItem.AUTHORITY_ID, 1000, MEDIA_JSON, None)
+    bulk_updater = DatabaseBulkUpdater(session, opencontext_adapter.OpenContextItem.AUTHORITY_ID, 1000, MEDIA_JSON)
     num_ids = 0
     for record in records:
         L.info("got next id from open context %s", record)
@@ -151,8 +152,38 @@ def recreate_records(ctx):
 @click.option(
     "-I", "--ignore_last_modified", is_flag=True, help="Whether to ignore the last modified date and do a full rebuild"
 )
+@click.option(
+    "-w", "--workers", type=int, default=1, help="Number of processes to use for transforming records", show_default=True
+)
+@click.option(
+    "-q", "--queue_size", type=int, default=4, help="Number of pages and solr batches buffered between import stages", show_default=True
+)
+@click.option(
+    "-u", "--skip_unchanged", is_flag=True, help="Whether to skip posting solr documents that haven't changed since they were last indexed"
+)
+@click.option(
+    "-r", "--resume", is_flag=True, help="Whether to continue after the last checkpoint of a previous import instead of starting over"
+)
+@click.option(
+    "-l", "--limit", type=int, default=-1, help="Maximum number of things to import in this invocation, -1 for all", show_default=True
+)
+@click.option(
+    "-n", "--num_shards", type=int, default=1, help="Number of primary key ranges to split the import into", show_default=True
+)
+@click.option(
+    "-x", "--shard", type=int, default=None, help="Only import this shard (0 based), by default all shards are imported concurrently"
+)
+@click.option(
+    "-t", "--transform_cache", is_flag=True, help="Whether to reuse the cached transforms of things that haven't changed since they were last indexed"
+)
+@click.option(
+    "-p", "--prediction_batch_size", type=int, default=0, help="Number of things per process to transform concurrently so their model server requests can be batched, 0 to disable", show_default=True
+)
+@click.option(
+    "-s", "--prediction_store", is_flag=True, help="Whether to keep model server predictions in the database and reuse them for records whose inputs haven't changed"
+)
 @click.pass_context
-def populate_isb_core_solr(ctx, ignore_last_modified: bool):
+def populate_isb_core_solr(ctx, ignore_last_modified: bool, workers: int, queue_size: int, skip_unchanged: bool, resume: bool, limit: int, num_shards: int, shard: Optional[int], transform_cache: bool, prediction_batch_size: int, prediction_store: bool):
     L = get_logger()
     db_url = ctx.obj["db_url"]
     solr_url = ctx.obj["solr_url"]
@@ -164,13 +195,23 @@ def populate_isb_core_solr(ctx, ignore_last_modified: bool):
             authority_id=isb_lib.opencontext_adapter.OpenContextItem.AUTHORITY_ID,
         )
     L.info(f"Going to index Things with tcreated > {max_solr_updated_date}")
-    solr_importer = isb_lib.core.CoreSolrImporter(
+    solr_importer = isb_lib.core.ShardedCoreSolrImporter(
+        num_shards=num_shards,
+        shard=shard,
         db_url=db_url,
         authority_id=isb_lib.opencontext_adapter.OpenContextItem.AUTHORITY_ID,
         db_batch_size=1000,
         solr_batch_size=1000,
         solr_url=solr_url,
         min_time_created=max_solr_updated_date,
+        workers=workers,
+        queue_size=queue_size,
+        skip_unchanged=skip_unchanged,
+        resume=resume,
+        limit=limit,
+        transform_cache=transform_cache,
+        prediction_batch_size=prediction_batch_size,
+        prediction_store=prediction_store,
     )
     allkeys = solr_importer.run_solr_import(
         isb_lib.opencontext_adapter.reparse_as_core_record
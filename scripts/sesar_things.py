@@ -14,6 +14,7 @@ import click
 import click_config_file
 import typing
 
+from isb_lib.identifier_index import IdentifierIndex, get_existing_thing, refresh_identifier_index
 from isb_lib.models.thing import Thing
 from isb_web import sqlmodel_database
 from isb_web.sqlmodel_database import SQLModelDAO, save_thing
@@ -43,7 +44,7 @@ def countThings(session):
     return cnt
 
 
-async def _loadSesarEntries(session, max_count, start_from=None, manual_ids: Optional[typing.List[typing.List[str]]] = None):  # noqa: C901 -- need to examine computational complexity
+async def _loadSesarEntries(session, max_count, start_from=None, manual_ids: Optional[typing.List[typing.List[str]]] = None, identifier_index: Optional[IdentifierIndex] = None):  # noqa: C901 -- need to examine computational complexity
     L = getLogger()
     futures: list = []
     working = {}
@@ -71,7 +72,7 @@ async def _loadSesarEntries(session, max_count, start_from=None, manual_ids: Opt
                 try:
                     _id = next(ids)
                     igsn = igsn_lib.normalize(_id[0])
-                    existing_thing = sqlmodel_database.get_thing_with_id(session, fullIgsn(igsn))
+                    existing_thing = get_existing_thing(session, identifier_index, fullIgsn(igsn))
                     if existing_thing is not None:
                         logging.info("Already have %s at %s", igsn, existing_thing)
                         future = executor.submit(wrapLoadThing, igsn, _id[1], existing_thing)
@@ -133,10 +134,10 @@ async def _loadSesarEntries(session, max_count, start_from=None, manual_ids: Opt
             )
 
 
-def loadSesarEntries(session, max_count, start_from=None, manual_ids: Optional[typing.List[typing.List[str]]] = None):
+def loadSesarEntries(session, max_count, start_from=None, manual_ids: Optional[typing.List[typing.List[str]]] = None, identifier_index: Optional[IdentifierIndex] = None):
     loop = asyncio.get_event_loop()
     future = asyncio.ensure_future(
-        _loadSesarEntries(session, max_count, start_from=start_from, manual_ids=manual_ids)
+        _loadSesarEntries(session, max_count, start_from=start_from, manual_ids=manual_ids, identifier_index=identifier_index)
     )
     loop.run_until_complete(future)
 
@@ -165,8 +166,15 @@ def main(ctx, db_url, solr_url, verbosity):
     default=1000,
     help="Maximum records to load, -1 for all",
 )
+@click.option(
+    "-x",
+    "--identifier_index",
+    "identifier_index_path",
+    default=None,
+    help="Path of an identifier index file to refresh and use to skip the database lookup for new records",
+)
 @click.pass_context
-def loadRecords(ctx, max_records):
+def loadRecords(ctx, max_records, identifier_index_path):
     L = getLogger()
     L.info("loadRecords, max = %s", max_records)
     if max_records == -1:
@@ -177,8 +185,14 @@ def loadRecords(ctx, max_records):
             session, isb_lib.sesar_adapter.SESARItem.AUTHORITY_ID
         )
         logging.info("Oldest = %s", oldest_record)
+        identifier_index = None
+        if identifier_index_path is not None:
+            identifier_index = refresh_identifier_index(
+                session, identifier_index_path, isb_lib.sesar_adapter.SESARItem.AUTHORITY_ID
+            )
+            logging.info("Identifier index has %d identifiers", len(identifier_index))
         time.sleep(1)
-        loadSesarEntries(session, max_records, start_from=oldest_record)
+        loadSesarEntries(session, max_records, start_from=oldest_record, identifier_index=identifier_index)
     finally:
         session.close()
 
@@ -325,8 +339,38 @@ def reloadRecords(ctx, status_code):
 @click.option(
     "-I", "--ignore_last_modified", is_flag=True, help="Whether to ignore the last modified date and do a full rebuild"
 )
+@click.option(
+    "-w", "--workers", type=int, default=1, help="Number of processes to use for transforming records", show_default=True
+)
+@click.option(
+    "-q", "--queue_size", type=int, default=4, help="Number of pages and solr batches buffered between import stages", show_default=True
+)
+@click.option(
+    "-u", "--skip_unchanged", is_flag=True, help="Whether to skip posting solr documents that haven't changed since they were last indexed"
+)
+@click.option(
+    "-r", "--resume", is_flag=True, help="Whether to continue after the last checkpoint of a previous import instead of starting over"
+)
+@click.option(
+    "-l", "--limit", type=int, default=-1, help="Maximum number of things to import in this invocation, -1 for all", show_default=True
+)
+@click.option(
+    "-n", "--num_shards", type=int, default=1, help="Number of primary key ranges to split the import into", show_default=True
+)
+@click.option(
+    "-x", "--shard", type=int, default=None, help="Only import this shard (0 based), by default all shards are imported concurrently"
+)
+@click.option(
+    "-t", "--transform_cache", is_flag=True, help="Whether to reuse the cached transforms of things that haven't changed since they were last indexed"
+)
+@click.option(
+    "-p", "--prediction_batch_size", type=int, default=0, help="Number of things per process to transform concurrently so their model server requests can be batched, 0 to disable", show_default=True
+)
+@click.option(
+    "-s", "--prediction_store", is_flag=True, help="Whether to keep model server predictions in the database and reuse them for records whose inputs haven't changed"
+)
 @click.pass_context
-def populateIsbCoreSolr(ctx, ignore_last_modified: bool):
+def populateIsbCoreSolr(ctx, ignore_last_modified: bool, workers: int, queue_size: int, skip_unchanged: bool, resume: bool, limit: int, num_shards: int, shard: Optional[int], transform_cache: bool, prediction_batch_size: int, prediction_store: bool):
     L = getLogger()
     db_url = ctx.obj["db_url"]
     solr_url = ctx.obj["solr_url"]
@@ -338,13 +382,23 @@ def populateIsbCoreSolr(ctx, ignore_last_modified: bool):
             authority_id=isb_lib.sesar_adapter.SESARItem.AUTHORITY_ID,
         )
     L.info(f"Going to index Things with tcreated > {max_solr_updated_date}")
-    solr_importer = isb_lib.core.CoreSolrImporter(
+    solr_importer = isb_lib.core.ShardedCoreSolrImporter(
+        num_shards=num_shards,
+        shard=shard,
         db_url=db_url,
         authority_id=isb_lib.sesar_adapter.SESARItem.AUTHORITY_ID,
         db_batch_size=1000,
         solr_batch_size=1000,
         solr_url=solr_url,
-        min_time_created=max_solr_updated_date
+        min_time_created=max_solr_updated_date,
+        workers=workers,
+        queue_size=queue_size,
+        skip_unchanged=skip_unchanged,
+        resume=resume,
+        limit=limit,
+        transform_cache=transform_cache,
+        prediction_batch_size=prediction_batch_size,
+        prediction_store=prediction_store,
     )
     allkeys = solr_importer.run_solr_import(isb_lib.sesar_adapter.reparseAsCoreRecord)
     L.info(f"Total keys= {len(allkeys)}")
@@ -5,11 +5,12 @@ import csv
 import isb_lib.smithsonian_adapter
 import logging
 import datetime
+from typing import Optional
 
 from isamples_metadata import SmithsonianTransformer
 from isb_lib import smithsonian_adapter
 from isb_lib.smithsonian_adapter import SmithsonianItem
-from isb_web.sqlmodel_database import SQLModelDAO, all_thing_primary_keys, DatabaseBulkUpdater
+from isb_web.sqlmodel_database import SQLModelDAO, DatabaseBulkUpdater
 
 BATCH_SIZE = 10000
 num_inserts = 0
@@ -20,8 +21,7 @@ all_ids: set[str] = set()
 
 
 def load_smithsonian_entries(db_session, file_path, start_from=None):
-    primary_keys_by_id = all_thing_primary_keys(db_session, smithsonian_adapter.SmithsonianItem.AUTHORITY_ID)
-    bulk_updater = DatabaseBulkUpdater(db_session, smithsonian_adapter.SmithsonianItem.AUTHORITY_ID, BATCH_SIZE, SmithsonianItem.TEXT_CSV, primary_keys_by_id)
+    bulk_updater = DatabaseBulkUpdater(db_session, smithsonian_adapter.SmithsonianItem.AUTHORITY_ID, BATCH_SIZE, SmithsonianItem.TEXT_CSV)
     with open(file_path, newline="") as csvfile:
         csvreader = csv.reader(csvfile, delimiter="\t", quoting=csv.QUOTE_NONE)
         num_newer = 0
@@ -123,17 +123,57 @@ def load_records(ctx, max_records, file, modification_date):
 
 
 @main.command("populate_isb_core_solr")
+@click.option(
+    "-w", "--workers", type=int, default=1, help="Number of processes to use for transforming records", show_default=True
+)
+@click.option(
+    "-q", "--queue_size", type=int, default=4, help="Number of pages and solr batches buffered between import stages", show_default=True
+)
+@click.option(
+    "-u", "--skip_unchanged", is_flag=True, help="Whether to skip posting solr documents that haven't changed since they were last indexed"
+)
+@click.option(
+    "-r", "--resume", is_flag=True, help="Whether to continue after the last checkpoint of a previous import instead of starting over"
+)
+@click.option(
+    "-l", "--limit", type=int, default=-1, help="Maximum number of things to import in this invocation, -1 for all", show_default=True
+)
+@click.option(
+    "-n", "--num_shards", type=int, default=1, help="Number of primary key ranges to split the import into", show_default=True
+)
+@click.option(
+    "-x", "--shard", type=int, default=None, help="Only import this shard (0 based), by default all shards are imported concurrently"
+)
+@click.option(
+    "-t", "--transform_cache", is_flag=True, help="Whether to reuse the cached transforms of things that haven't changed since they were last indexed"
+)
+@click.option(
+    "-p", "--prediction_batch_size", type=int, default=0, help="Number of things per process to transform concurrently so their model server requests can be batched, 0 to disable", show_default=True
+)
+@click.option(
+    "-s", "--prediction_store", is_flag=True, help="Whether to keep model server predictions in the database and reuse them for records whose inputs haven't changed"
+)
 @click.pass_context
-def populate_isb_core_solr(ctx):
+def populate_isb_core_solr(ctx, workers: int, queue_size: int, skip_unchanged: bool, resume: bool, limit: int, num_shards: int, shard: Optional[int], transform_cache: bool, prediction_batch_size: int, prediction_store: bool):
     logger = isb_lib.core.getLogger()
     db_url = ctx.obj["db_url"]
     solr_url = ctx.obj["solr_url"]
-    solr_importer = isb_lib.core.CoreSolrImporter(
+    solr_importer = isb_lib.core.ShardedCoreSolrImporter(
+        num_shards=num_shards,
+        shard=shard,
         db_url=db_url,
         authority_id=isb_lib.smithsonian_adapter.SmithsonianItem.AUTHORITY_ID,
         db_batch_size=1000,
         solr_batch_size=1000,
         solr_url=solr_url,
+        workers=workers,
+        queue_size=queue_size,
+        skip_unchanged=skip_unchanged,
+        resume=resume,
+        limit=limit,
+        transform_cache=transform_cache,
+        prediction_batch_size=prediction_batch_size,
+        prediction_store=prediction_store,
     )
     allkeys = solr_importer.run_solr_import(
         isb_lib.smithsonian_adapter.reparse_as_core_record
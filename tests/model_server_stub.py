@@ -0,0 +1,73 @@
+import http.server
+import json
+import threading
+import typing
+
+
+def _predict(params: dict) -> typing.Any:
+    """Deterministic stand-in for a model: predicts a value derived from the request"""
+    if "input" in params:
+        return [f"{params['type']}:{len(params['input'])}"]
+    return [{"value": f"{params['type']}:{json.dumps(params['source_record'], sort_keys=True)}", "confidence": 0.5}]
+
+
+class _ModelServerStubServer(http.server.ThreadingHTTPServer):
+    def __init__(self, supports_batch: bool):
+        super().__init__(("127.0.0.1", 0), _ModelServerStubHandler)
+        self.lock = threading.Lock()
+        self.requests: typing.List[typing.Tuple[str, typing.Any]] = []
+        self.supports_batch = supports_batch
+
+
+class _ModelServerStubHandler(http.server.BaseHTTPRequestHandler):
+    server: _ModelServerStubServer
+
+    def _respond(self, status: int, body: typing.Any):
+        response = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        with self.server.lock:
+            self.server.requests.append((self.path, body))
+        if self.path.endswith("/batch"):
+            if not self.server.supports_batch:
+                self._respond(404, {"detail": "Not Found"})
+                return
+            self._respond(200, [_predict(params) for params in body])
+            return
+        if body.get("source_record", {}).get("raise"):
+            self._respond(409, "Unable to predict")
+            return
+        self._respond(200, _predict(body))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ModelServerStub:
+    """A model server running in a background thread, recording the (path, body) of every request it gets"""
+
+    def __init__(self, supports_batch: bool = True):
+        self._server = _ModelServerStubServer(supports_batch)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/"
+
+    @property
+    def requests(self) -> typing.List[typing.Tuple[str, typing.Any]]:
+        return self._server.requests
+
+    def __enter__(self) -> "ModelServerStub":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
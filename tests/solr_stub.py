@@ -0,0 +1,85 @@
+import http.server
+import json
+import threading
+import typing
+
+
+class _SolrStubServer(http.server.ThreadingHTTPServer):
+    def __init__(self, update_status: int):
+        super().__init__(("127.0.0.1", 0), _SolrStubHandler)
+        self.lock = threading.Lock()
+        self.update_status = update_status
+        self.documents: typing.List[dict] = []
+        self.num_commits = 0
+
+
+class _SolrStubHandler(http.server.BaseHTTPRequestHandler):
+    server: _SolrStubServer
+    protocol_version = "HTTP/1.1"
+
+    def _read_body(self) -> bytes:
+        # Updates are streamed as chunked request bodies
+        if self.headers.get("Transfer-Encoding", "").lower() != "chunked":
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        chunks: typing.List[bytes] = []
+        while True:
+            size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+            if size == 0:
+                self.rfile.readline()
+                return b"".join(chunks)
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+
+    def _respond(self, status: int, body: typing.Any):
+        response = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def do_GET(self):
+        if "commit=true" in self.path:
+            with self.server.lock:
+                self.server.num_commits += 1
+        self._respond(200, {"responseHeader": {"status": 0}})
+
+    def do_POST(self):
+        docs = json.loads(self._read_body())
+        if self.server.update_status != 200:
+            self._respond(self.server.update_status, {"error": {"msg": "Stub update failure"}})
+            return
+        with self.server.lock:
+            self.server.documents.extend(docs)
+        self._respond(200, {"responseHeader": {"status": 0}})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SolrStub:
+    """A solr core running in a background thread, recording the documents posted to its /update handler"""
+
+    def __init__(self, update_status: int = 200):
+        self._server = _SolrStubServer(update_status)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/solr/isb_core_records/"
+
+    @property
+    def documents(self) -> typing.List[dict]:
+        return self._server.documents
+
+    @property
+    def num_commits(self) -> int:
+        return self._server.num_commits
+
+    def __enter__(self) -> "SolrStub":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
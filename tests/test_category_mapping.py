@@ -1,9 +1,14 @@
+import typing
+
 import pytest
 
+from isamples_metadata import OpenContextTransformer, SESARTransformer, SmithsonianTransformer
 from isamples_metadata.Transformer import (
     StringPairedCategoryMapper,
     StringOrderedCategoryMapper,
     StringEndsWithCategoryMapper,
+    StringEqualityCategoryMapper,
+    Transformer,
 )
 from isamples_metadata.vocabularies import vocabulary_mapper
 
@@ -42,3 +47,54 @@ def test_ends_with_soil(soil_mapper):
     categories = []
     soil_mapper.append_if_matched("Metamorphic>Soil", "", categories)
     assert categories[0].label == "Subaerial surface environment"
+
+
+def _uncompiled_categories(meta_mapper, source_category, auxiliary_source_category):
+    categories = []
+    for mapper in meta_mapper.categories_mappers():
+        mapper.append_if_matched(source_category, auxiliary_source_category, categories)
+    return [category.label for category in categories]
+
+
+def _mapper_inputs(mapper) -> list[tuple[str, typing.Optional[str]]]:
+    inputs = []
+    if isinstance(mapper, StringOrderedCategoryMapper):
+        for submapper in mapper.submappers:
+            inputs.extend(_mapper_inputs(submapper))
+    elif isinstance(mapper, StringEqualityCategoryMapper):
+        inputs.extend((category, None) for category in mapper._categories)
+    elif isinstance(mapper, StringEndsWithCategoryMapper):
+        inputs.append((f"Something>{mapper._endsWith}", None))
+    elif isinstance(mapper, StringPairedCategoryMapper):
+        inputs.append((mapper._primaryMatch, mapper._auxiliaryMatch))
+        inputs.append((mapper._primaryMatch, "elsewhere"))
+    return inputs
+
+
+@pytest.mark.parametrize("meta_mapper", [
+    SESARTransformer.MaterialCategoryMetaMapper,
+    SESARTransformer.SpecimenCategoryMetaMapper,
+    SESARTransformer.ContextCategoryMetaMapper,
+    OpenContextTransformer.MaterialCategoryMetaMapper,
+    OpenContextTransformer.SpecimenCategoryMetaMapper,
+    SmithsonianTransformer.SpecimenCategoryMetaMapper,
+])
+def test_compiled_categories_match_mappers(meta_mapper):
+    inputs = [("", None), ("unknown", None), ("rock", "lake"), ("Sediment", "sea")]
+    for mapper in meta_mapper.categories_mappers():
+        for source_category, auxiliary_source_category in _mapper_inputs(mapper):
+            inputs.append((source_category, auxiliary_source_category))
+            inputs.append((f"  {source_category.upper()} ", auxiliary_source_category))
+            inputs.append((f"{source_category}x", auxiliary_source_category))
+            inputs.append((source_category[1:], auxiliary_source_category))
+    for source_category, auxiliary_source_category in inputs:
+        expected = _uncompiled_categories(meta_mapper, source_category, auxiliary_source_category)
+        actual = [category.label for category in meta_mapper.categories(source_category, auxiliary_source_category)]
+        assert (expected or [Transformer.NOT_PROVIDED]) == actual, source_category
+
+
+def test_ordered_mapper_doesnt_store_match(soil_mapper):
+    assert soil_mapper.matching_mapper("Microbiology>Soil", "floodplain") is soil_mapper.submappers[0]
+    assert soil_mapper.matching_mapper("Metamorphic>Soil", None) is soil_mapper.submappers[1]
+    assert soil_mapper.matching_mapper("Metamorphic", None) is None
+    assert not hasattr(soil_mapper, "_destination")
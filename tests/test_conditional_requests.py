@@ -0,0 +1,80 @@
+import datetime
+
+import fastapi
+
+from isb_web.conditional_requests import (
+    entity_tag,
+    http_date,
+    is_conditional,
+    is_not_modified,
+    not_modified_response,
+    parse_http_date,
+    validator_headers,
+)
+
+LAST_MODIFIED = datetime.datetime(2023, 1, 2, 3, 4, 5, 678)
+
+
+def _request(method: str = "GET", **headers: str) -> fastapi.Request:
+    return fastapi.Request({
+        "type": "http",
+        "method": method,
+        "headers": [(name.replace("_", "-").lower().encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+def test_entity_tag():
+    etag = entity_tag(LAST_MODIFIED, 1, "core")
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag == entity_tag(LAST_MODIFIED, 1, "core")
+    assert etag != entity_tag(LAST_MODIFIED, 2, "core")
+
+
+def test_http_date():
+    assert "Mon, 02 Jan 2023 03:04:05 GMT" == http_date(LAST_MODIFIED)
+    assert LAST_MODIFIED.replace(microsecond=0, tzinfo=datetime.timezone.utc) == parse_http_date(http_date(LAST_MODIFIED))
+    assert parse_http_date("yesterday") is None
+
+
+def test_validator_headers():
+    assert {
+        "ETag": '"a"', "Last-Modified": "Mon, 02 Jan 2023 03:04:05 GMT", "Cache-Control": "no-cache"
+    } == validator_headers('"a"', LAST_MODIFIED)
+    assert {"ETag": '"a"', "Cache-Control": "no-cache"} == validator_headers('"a"')
+    assert {} == validator_headers(None)
+
+
+def test_is_conditional():
+    assert is_conditional(_request(If_None_Match='"a"'))
+    assert is_conditional(_request("HEAD", If_Modified_Since=http_date(LAST_MODIFIED)))
+    assert not is_conditional(_request())
+    assert not is_conditional(_request("POST", If_None_Match='"a"'))
+
+
+def test_is_not_modified_if_none_match():
+    etag = entity_tag("a")
+    assert is_not_modified(_request(If_None_Match=etag), etag)
+    assert is_not_modified(_request("HEAD", If_None_Match=f'"other", W/{etag}'), etag)
+    assert is_not_modified(_request(If_None_Match="*"), etag)
+    assert not is_not_modified(_request(If_None_Match='"other"'), etag)
+    assert not is_not_modified(_request(If_None_Match=etag), None)
+    assert not is_not_modified(_request("POST", If_None_Match=etag), etag)
+    assert not is_not_modified(_request(), etag)
+
+
+def test_is_not_modified_if_modified_since():
+    since = http_date(LAST_MODIFIED)
+    assert is_not_modified(_request(If_Modified_Since=since), None, LAST_MODIFIED)
+    assert not is_not_modified(_request(If_Modified_Since=since), None, LAST_MODIFIED + datetime.timedelta(seconds=1))
+    assert not is_not_modified(_request(If_Modified_Since="garbage"), None, LAST_MODIFIED)
+    # Without a last modified time If-Modified-Since is ignored
+    assert not is_not_modified(_request(If_Modified_Since=since), entity_tag("a"))
+    # If-None-Match takes precedence
+    assert not is_not_modified(_request(If_None_Match='"other"', If_Modified_Since=since), entity_tag("a"), LAST_MODIFIED)
+
+
+def test_not_modified_response():
+    response = not_modified_response({"ETag": '"a"'})
+    assert 304 == response.status_code
+    assert '"a"' == response.headers["ETag"]
+    assert b"" == response.body
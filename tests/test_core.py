@@ -3,10 +3,17 @@ import click.core
 import pytest
 import isb_lib.core
 import json
+import queue
 import requests
+import threading
 
 from isamples_metadata.metadata_constants import METADATA_KEYWORDS
+from isamples_metadata.metadata_exceptions import MetadataException
 from isb_lib.core import things_main
+from isb_lib.models.thing import Thing
+from isb_web.sqlmodel_database import SQLModelDAO
+from solr_stub import SolrStub
+from test_utils import _add_some_things
 
 TEST_LIVE_SERVER = 0
 
@@ -413,6 +420,26 @@ def test_core_record_as_solr_doc_3():
     assert "fossils" in solr_dict.get(METADATA_KEYWORDS)
 
 
+def test_lat_lon_to_solr_h3_page():
+    coordinates = [(37.8719, -122.2585), (-33.86, 151.2), (0, 0)]
+    expected = []
+    for latitude, longitude in coordinates:
+        doc: dict = {}
+        isb_lib.core.lat_lon_to_solr(doc, latitude, longitude)
+        expected.append(doc)
+    docs: list[dict] = [{} for _ in coordinates]
+    with isb_lib.core.h3_page():
+        for doc, (latitude, longitude) in zip(docs, coordinates):
+            isb_lib.core.lat_lon_to_solr(doc, latitude, longitude)
+        # The h3 fields are filled in once the page is done
+        assert "producedBy_samplingSite_location_h3_0" not in docs[0]
+        # Coordinates that can't be deferred still fail right away, for their own document only
+        with pytest.raises(TypeError):
+            isb_lib.core.lat_lon_to_solr({}, "37.8719", "-122.2585")
+    assert expected == docs
+    assert "producedBy_samplingSite_location_h3_15" in docs[0]
+
+
 def _load_test_file_into_solr_doc(file_path: str) -> dict:
     with open(file_path, "r") as source_file:
         source_record = source_file.read()
@@ -544,3 +571,258 @@ def test_isamples_date_with_ms():
 
 def test_things_main():
     things_main(click.core.Context(click.core.Command("test")), None, None)
+
+
+def _core_record_function_for_transform_test(thing: Thing) -> list[dict]:
+    if thing.id == "excluded":
+        raise MetadataException("test record")
+    if thing.id == "broken":
+        raise ValueError("broken record")
+    return [{"id": thing.id}]
+
+
+def test_transform_thing():
+    core_records, exclusion, error = isb_lib.core._transform_thing(
+        _core_record_function_for_transform_test, Thing(id="good")
+    )
+    assert core_records == [{"id": "good"}]
+    assert exclusion is None
+    assert error is None
+    core_records, exclusion, error = isb_lib.core._transform_thing(
+        _core_record_function_for_transform_test, Thing(id="excluded")
+    )
+    assert len(core_records) == 0
+    assert exclusion == "test record"
+    assert error is None
+    core_records, exclusion, error = isb_lib.core._transform_thing(
+        _core_record_function_for_transform_test, Thing(id="broken")
+    )
+    assert len(core_records) == 0
+    assert exclusion is None
+    assert error == "broken record"
+
+
+def test_transform_thing_page_preserves_order():
+    thing_dicts = [Thing(id=str(i), authority_id="test").dict() for i in range(10)]
+    results = isb_lib.core._transform_thing_page(_core_record_function_for_transform_test, thing_dicts)
+    assert [result[0][0]["id"] for result in results] == [str(i) for i in range(10)]
+
+
+def test_import_stage_stats():
+    stats = isb_lib.core.ImportStageStats("transform")
+    assert stats.records_per_second == 0.0
+    stats.records = 100
+    stats.elapsed_seconds = 10.0
+    stats.starved_seconds = 3.0
+    stats.blocked_seconds = 2.0
+    assert stats.busy_seconds == 5.0
+    assert stats.records_per_second == 20.0
+    assert "transform" in str(stats)
+
+
+def test_solr_update_stream():
+    records = [{"id": str(i), "label": f"label {i}", "searchText": "copy field"} for i in range(100)]
+    stream = isb_lib.core.SolrUpdateStream(iter(records), chunk_size=256)
+    chunks = list(stream)
+    assert len(chunks) > 1
+    # no chunk should grow much past the chunk size, as that's the point of streaming
+    assert max(len(chunk) for chunk in chunks[:-1]) < 256 + 64
+    streamed = json.loads(b"".join(chunks))
+    assert [record["id"] for record in streamed] == [str(i) for i in range(100)]
+    # copy fields should have been stripped on the way out
+    assert "searchText" not in streamed[0]
+    assert stream.num_records == 100
+    assert stream.num_bytes == sum(len(chunk) for chunk in chunks)
+
+
+def test_solr_update_stream_empty():
+    stream = isb_lib.core.SolrUpdateStream([])
+    assert json.loads(b"".join(stream)) == []
+
+
+def test_solr_document_digest():
+    doc = {"id": "ark:/123", "label": "foo", "keywords": ["a", "b"], "indexUpdatedTime": "2023-01-01T00:00:00.000Z"}
+    reindexed_doc = {"indexUpdatedTime": "2024-01-01T00:00:00.000Z", "keywords": ["a", "b"], "label": "foo", "id": "ark:/123"}
+    assert isb_lib.core.solr_document_digest(doc) == isb_lib.core.solr_document_digest(reindexed_doc)
+    changed_doc = dict(doc)
+    changed_doc["label"] = "bar"
+    assert isb_lib.core.solr_document_digest(doc) != isb_lib.core.solr_document_digest(changed_doc)
+
+
+def _seeded_db_url(tmp_path, num_things: int) -> str:
+    # The importer opens its own sessions, so it needs a database file rather than an in-memory one
+    db_url = f"sqlite:///{tmp_path / 'import.db'}"
+    session = SQLModelDAO(db_url).get_session()
+    _add_some_things(session, num_things, "test")
+    session.close()
+    return db_url
+
+
+def test_run_solr_import_more_pages_than_queue_size(tmp_path):
+    # 12 pages through queues of 1, so the reader blocks on the page queue while the poster commits its bookkeeping
+    db_url = _seeded_db_url(tmp_path, 60)
+    with SolrStub() as solr:
+        importer = isb_lib.core.CoreSolrImporter(
+            db_url, "test", db_batch_size=5, solr_batch_size=5, solr_url=solr.url, queue_size=1
+        )
+        allkeys = importer.run_solr_import(_core_record_function_for_transform_test)
+    assert {str(i) for i in range(60)} == allkeys
+    assert [str(i) for i in range(60)] == [doc["id"] for doc in solr.documents]
+    assert 60 == importer.checkpoint.num_things
+    assert importer.checkpoint.tcompleted is not None
+
+
+def _core_record_function_without_id(thing: Thing) -> list[dict]:
+    # Records without an id fail in the transform stage itself rather than being reported as a failed Thing
+    if thing.id == "7":
+        return [{"label": thing.id}]
+    return [{"id": thing.id}]
+
+
+def _assert_import_aborted(importer: isb_lib.core.CoreSolrImporter, solr: SolrStub):
+    assert 0 == solr.num_commits
+    assert importer.checkpoint.tcompleted is None
+    # run_solr_import only returns once every stage has stopped
+    assert not any(thread.name in ("read", "post") and thread.is_alive() for thread in threading.enumerate())
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_run_solr_import(tmp_path, workers: int):
+    db_url = _seeded_db_url(tmp_path, 25)
+    with SolrStub() as solr:
+        importer = isb_lib.core.CoreSolrImporter(
+            db_url, "test", db_batch_size=4, solr_batch_size=3, solr_url=solr.url, workers=workers
+        )
+        importer.run_solr_import(_core_record_function_for_transform_test)
+    assert [{"id": str(i), "source": "test", "producedBy_samplingSite_location_h3_15": None} for i in range(25)] == solr.documents
+    assert 1 == solr.num_commits
+    assert 25 == importer.checkpoint.num_records
+    assert 25 == importer.stage_stats["post"].records
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_run_solr_import_transform_exception(tmp_path, workers: int):
+    db_url = _seeded_db_url(tmp_path, 25)
+    with SolrStub() as solr:
+        importer = isb_lib.core.CoreSolrImporter(
+            db_url, "test", db_batch_size=4, solr_batch_size=3, solr_url=solr.url, workers=workers, queue_size=1
+        )
+        with pytest.raises(KeyError):
+            importer.run_solr_import(_core_record_function_without_id)
+    _assert_import_aborted(importer, solr)
+    assert "7" not in [doc["id"] for doc in solr.documents]
+
+
+def test_run_solr_import_post_exception(tmp_path):
+    db_url = _seeded_db_url(tmp_path, 25)
+    with SolrStub(update_status=500) as solr:
+        importer = isb_lib.core.CoreSolrImporter(
+            db_url, "test", db_batch_size=4, solr_batch_size=3, solr_url=solr.url, queue_size=1
+        )
+        with pytest.raises(ValueError):
+            importer.run_solr_import(_core_record_function_for_transform_test)
+    _assert_import_aborted(importer, solr)
+    assert 0 == importer.checkpoint.num_records
+
+
+def test_pipeline_stage_aborts():
+    abort = threading.Event()
+
+    def fail():
+        raise ValueError("stage failure")
+
+    stage = isb_lib.core._PipelineStage("fail", fail, abort)
+    stage.start()
+    stage.join()
+    assert isinstance(stage.exception, ValueError)
+    assert abort.is_set()
+    # Stages that stop because another stage failed don't report an exception of their own
+    stats = isb_lib.core.ImportStageStats("test")
+    full_queue: queue.Queue = queue.Queue(maxsize=1)
+    full_queue.put("page")
+    blocked = isb_lib.core._PipelineStage(
+        "blocked", lambda: isb_lib.core._put_unless_aborted(full_queue, "page", abort, stats), abort
+    )
+    starved = isb_lib.core._PipelineStage(
+        "starved", lambda: isb_lib.core._get_unless_aborted(queue.Queue(), abort, stats), abort
+    )
+    blocked.start()
+    starved.start()
+    blocked.join(timeout=5)
+    starved.join(timeout=5)
+    assert not blocked.is_alive() and blocked.exception is None
+    assert not starved.is_alive() and starved.exception is None
+
+
+@pytest.mark.parametrize("queue_size", [1, 2, 100])
+def test_run_solr_import_queue_sizes(tmp_path, queue_size: int):
+    db_url = _seeded_db_url(tmp_path, 30)
+    with SolrStub() as solr:
+        importer = isb_lib.core.CoreSolrImporter(
+            db_url, "test", db_batch_size=3, solr_batch_size=2, solr_url=solr.url, queue_size=queue_size
+        )
+        importer.run_solr_import(_core_record_function_for_transform_test)
+    assert [str(i) for i in range(30)] == [doc["id"] for doc in solr.documents]
+    assert 30 == importer.stage_stats["read"].records
+
+
+@pytest.mark.parametrize("queue_size", [1, 100])
+def test_run_solr_import_read_exception(tmp_path, monkeypatch, queue_size: int):
+    db_url = _seeded_db_url(tmp_path, 30)
+    with SolrStub() as solr:
+        importer = isb_lib.core.CoreSolrImporter(
+            db_url, "test", db_batch_size=3, solr_batch_size=2, solr_url=solr.url, queue_size=queue_size
+        )
+        thing_pages = importer._thing_pages
+
+        def failing_thing_pages():
+            for i, page in enumerate(thing_pages()):
+                if i == 4:
+                    raise ConnectionError("lost the database")
+                yield page
+
+        monkeypatch.setattr(importer, "_thing_pages", failing_thing_pages)
+        with pytest.raises(ConnectionError):
+            importer.run_solr_import(_core_record_function_for_transform_test)
+    _assert_import_aborted(importer, solr)
+    # Nothing read after the failure made it to solr
+    assert all(int(doc["id"]) < 12 for doc in solr.documents)
+
+
+def _add_things_with_ids(db_url: str, ids: list[str]):
+    session = SQLModelDAO(db_url).get_session()
+    for thing_id in ids:
+        session.add(Thing(id=thing_id, authority_id="test", resolved_url="http://foo.bar", resolved_status=200, resolved_content={}))
+    session.commit()
+    session.close()
+
+
+def _sharded_importer(db_url: str, solr_url: str, shard: int) -> isb_lib.core.ShardedCoreSolrImporter:
+    return isb_lib.core.ShardedCoreSolrImporter(
+        num_shards=4, shard=shard, db_url=db_url, authority_id="test", db_batch_size=3, solr_batch_size=2, solr_url=solr_url
+    )
+
+
+def test_shard_ranges_planned_once(tmp_path):
+    db_url = _seeded_db_url(tmp_path, 20)
+    ranges = _sharded_importer(db_url, "http://localhost/", 0).shard_ranges()
+    assert [(0, 5), (5, 10), (10, 15), (15, None)] == ranges
+    # A harvest between two containers starting doesn't move the boundaries
+    _add_things_with_ids(db_url, [f"new-{i}" for i in range(20)])
+    assert ranges == _sharded_importer(db_url, "http://localhost/", 1).shard_ranges()
+
+
+def test_sharded_import_covers_keys_once(tmp_path):
+    db_url = _seeded_db_url(tmp_path, 20)
+    with SolrStub() as solr:
+        # Each container starts its shard after another harvest
+        for shard in range(4):
+            _add_things_with_ids(db_url, [f"shard-{shard}-{i}" for i in range(5)])
+            _sharded_importer(db_url, solr.url, shard).run_solr_import(_core_record_function_for_transform_test)
+        ids = [doc["id"] for doc in solr.documents]
+        assert 40 == len(ids)
+        assert 40 == len(set(ids))
+        importer = _sharded_importer(db_url, solr.url, 0)
+        assert 4 == importer.progress()["num_completed"]
+        # Once every shard of a plan has completed, the next start plans again over all the Things
+        assert [(0, 10), (10, 20), (20, 30), (30, None)] == importer.shard_ranges()
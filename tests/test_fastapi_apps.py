@@ -1,8 +1,10 @@
+import datetime
 import json
 from unittest.mock import MagicMock, patch
 
 import pytest
 
+import fastapi.responses
 from fastapi.testclient import TestClient
 from httpx import Response
 from sqlmodel import Session, SQLModel, create_engine
@@ -10,7 +12,8 @@ from sqlmodel.pool import StaticPool
 
 
 from isb_lib.models import thing
-from isb_web.main import get_session, app, manage_app
+from isb_web import sqlmodel_database
+from isb_web.main import get_session, app, manage_app, STAC_ITEM_URL_PATH
 
 
 def _test_model():
@@ -181,6 +184,38 @@ def test_get_thing(client: TestClient, session: Session):
     assert data.get("@id") is not None
 
 
+def test_get_thing_not_modified(client: TestClient, session: Session):
+    with patch(
+        "isb_web.sqlmodel_database.get_thing_tstamp_with_id", wraps=sqlmodel_database.get_thing_tstamp_with_id
+    ) as mock_get_tstamp:
+        response = client.get(f"/thing/{TEST_IGSN}")
+        # Without validators in the request there's nothing to check before loading the Thing
+        assert not mock_get_tstamp.called
+    etag = response.headers["ETag"]
+    last_modified = response.headers["Last-Modified"]
+    assert "no-cache" == response.headers["Cache-Control"]
+    response = client.get(f"/thing/{TEST_IGSN}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert etag == response.headers["ETag"]
+    assert len(response.content) == 0
+    response = client.get(f"/thing/{TEST_IGSN}", headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 304
+    # Other representations of the Thing have their own ETags
+    response = client.get(f"/thing/{TEST_IGSN}?format=full", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert etag != response.headers["ETag"]
+    # which are only validated by ETag, as they also change with the code
+    assert "Last-Modified" not in response.headers
+    # Updating the Thing changes its ETag
+    existing_thing = session.get(thing.Thing, response.json()["primary_key"])
+    assert existing_thing is not None
+    existing_thing.tstamp = existing_thing.tstamp + datetime.timedelta(seconds=1)
+    session.commit()
+    response = client.get(f"/thing/{TEST_IGSN}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert etag != response.headers["ETag"]
+
+
 def test_resolve_thing(client: TestClient, session: Session):
     response = client.get(f"/resolve/{TEST_IGSN}", allow_redirects=False)
     assert response.status_code == 302
@@ -198,6 +233,33 @@ def test_get_thing_page(client: TestClient, session: Session):
     assert len(data) > 0
 
 
+def test_get_thing_page_not_modified(client: TestClient, session: Session):
+    response = client.get(f"/thingpage/{TEST_IGSN}")
+    etag = response.headers["ETag"]
+    response = client.get(f"/thingpage/{TEST_IGSN}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    # The page embeds transformed metadata, so it's only revalidated by ETag
+    assert "Last-Modified" not in response.headers
+    response = client.get(f"/thingpage/{TEST_IGSN}", headers={"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"})
+    assert response.status_code == 200
+
+
+def test_get_stac_item_not_modified(client: TestClient):
+    with open("./test_data/isb_core_solr_documents/ark-21547-BHP2CFR_368.json") as source_file:
+        solr_doc = json.load(source_file)
+    solr_doc["_version_"] = 1234
+    solr_doc["indexUpdatedTime"] = "2023-01-01T00:00:00Z"
+    with patch("isb_web.isb_solr_query.async_solr_get_record", return_value=(200, solr_doc)):
+        response = client.get(f"/{STAC_ITEM_URL_PATH}/ark:/21547/BHP2CFR_368")
+        assert response.status_code == 200
+        # The item also changes with the code that builds it, so it's only revalidated by ETag
+        assert "Last-Modified" not in response.headers
+        response = client.get(
+            f"/{STAC_ITEM_URL_PATH}/ark:/21547/BHP2CFR_368", headers={"If-None-Match": response.headers["ETag"]}
+        )
+        assert response.status_code == 304
+
+
 def test_non_existent_thing_page(client: TestClient, session: Session):
     response = client.get("/thingpage/6666666")
     assert response.status_code == 404
@@ -235,6 +297,21 @@ def test_get_things_for_sitemap(client: TestClient, session: Session):
     assert response_data[0]["id"] == TEST_IGSN
 
 
+def test_get_things_for_sitemap_ndjson(client: TestClient, session: Session):
+    response = client.request(
+        "POST", "/things", json={"identifiers": [TEST_IGSN, "nope"]}, headers={"Accept": "application/x-ndjson"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert "gzip" == response.headers["content-encoding"]
+    lines = response.text.splitlines()
+    assert 1 == len(lines)
+    json_thing = json.loads(lines[0])
+    assert TEST_IGSN == json_thing["id"]
+    assert json_thing["primary_key"] is not None
+    assert json_thing["resolved_content"] is not None
+
+
 def test_manage_logout(manage_client: TestClient, session: Session):
     headers = {
         "authorization": "Bearer 123456"
@@ -269,37 +346,40 @@ def test_manage_with_invalid_authorization_header(manage_client: TestClient, ses
     assert response.status_code == 400
 
 
+SOLR_RESPONSE = fastapi.responses.JSONResponse(content={})
+
+
 def _assert_on_solr_response(mock_solr_query: MagicMock, response: Response):
     assert response.status_code == 200
     assert mock_solr_query.called is True
 
 
-@patch("isb_web.isb_solr_query.solr_query")
+@patch("isb_web.isb_solr_query.async_solr_query", return_value=SOLR_RESPONSE)
 def test_solr_select_get(mock_solr_query: MagicMock, client: TestClient, session: Session):
     response = client.get("/thing/select")
     _assert_on_solr_response(mock_solr_query, response)
 
 
-@patch("isb_web.isb_solr_query.solr_query")
+@patch("isb_web.isb_solr_query.async_solr_query", return_value=SOLR_RESPONSE)
 def test_solr_select_get_with_slash(mock_solr_query: MagicMock, client: TestClient, session: Session):
     response = client.get("/thing/select/")
     _assert_on_solr_response(mock_solr_query, response)
 
 
-@patch("isb_web.isb_solr_query.solr_query")
+@patch("isb_web.isb_solr_query.async_solr_query", return_value=SOLR_RESPONSE)
 def test_solr_select_post(mock_solr_query: MagicMock, client: TestClient, session: Session):
     response = client.post("/thing/select", headers={"Content-Type": "application/json; charset=utf-8"}, data=json.dumps({"foo": "bar"}))  # type: ignore
     _assert_on_solr_response(mock_solr_query, response)
 
 
 # This is a test comment
-@patch("isb_web.isb_solr_query.solr_query")
+@patch("isb_web.isb_solr_query.async_solr_query", return_value=SOLR_RESPONSE)
 def test_solr_select_post_with_slash(mock_solr_query: MagicMock, client: TestClient, session: Session):
     response = client.post("/thing/select/", headers={"Content-Type": "application/json; charset=utf-8"}, data=json.dumps({"foo": "bar"}))  # type: ignore
     _assert_on_solr_response(mock_solr_query, response)
 
 
-@patch("isb_web.isb_solr_query.solr_searchStream")
+@patch("isb_web.isb_solr_query.async_solr_searchStream", return_value=SOLR_RESPONSE)
 def test_solr_stream(mock_solr_query: MagicMock, client: TestClient, session: Session):
     response = client.get("/thing/stream")
     _assert_on_solr_response(mock_solr_query, response)
@@ -0,0 +1,94 @@
+import datetime
+import os
+
+import pytest
+from sqlmodel import SQLModel, Session, create_engine
+from sqlmodel.pool import StaticPool
+
+from isb_lib.identifier_index import IdentifierIndex, get_existing_thing, refresh_identifier_index
+from isb_web.sqlmodel_database import all_thing_primary_keys
+from isb_lib.models.thing import Thing
+from test_utils import _add_some_things
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    return os.path.join(tmp_path, "identifiers.idx")
+
+
+def _add_thing(session: Session, thing_id: str, authority_id: str, identifiers: list) -> Thing:
+    thing = Thing(
+        id=thing_id,
+        authority_id=authority_id,
+        resolved_url="http://foo.bar",
+        resolved_status=200,
+        tcreated=datetime.datetime.now(),
+        identifiers=identifiers,
+    )
+    session.add(thing)
+    session.commit()
+    return thing
+
+
+def test_identifier_index(session: Session, index_path: str):
+    _add_some_things(session, 10, "authority")
+    _add_some_things(session, 1, "other")
+    thing = _add_thing(session, "ark:/1", "authority", ["ark:/1", "http://n2t.net/ark:/1"])
+    primary_keys = all_thing_primary_keys(session, "authority")
+    index = refresh_identifier_index(session, index_path, "authority")
+    assert 12 == len(index)
+    assert "authority" == index.authority_id
+    assert thing.primary_key == index.primary_key("http://n2t.net/ark:/1")
+    assert index.primary_key("nope") is None
+    assert {"3": primary_keys["3"], "ark:/1": thing.primary_key} == index.primary_keys(["3", "nope", "ark:/1"])
+    assert {} == index.primary_keys([])
+
+
+def test_identifier_index_refresh(session: Session, index_path: str):
+    _add_some_things(session, 2, "authority")
+    index = refresh_identifier_index(session, index_path, "authority")
+    assert "ark:/1" not in index
+    thing = _add_thing(session, "ark:/1", "authority", ["ark:/1"])
+    index = refresh_identifier_index(session, index_path, "authority")
+    assert 3 == len(index)
+    assert thing.primary_key == index.max_primary_key
+    assert "ark:/1" in index
+    assert "0" in index
+    # An index for another authority is rebuilt rather than merged
+    index = refresh_identifier_index(session, index_path, "other")
+    assert 0 == len(index)
+    assert "0" not in index
+
+
+def test_get_existing_thing(session: Session, index_path: str):
+    _add_some_things(session, 2, "authority")
+    index = IdentifierIndex(refresh_identifier_index(session, index_path, "authority").path)
+    existing_thing = get_existing_thing(session, index, "1")
+    assert existing_thing is not None and "1" == existing_thing.id
+    assert get_existing_thing(session, index, "2") is None
+    # Things added since the index was refreshed are found without it
+    _add_thing(session, "ark:/1", "authority", ["ark:/1"])
+    existing_thing = get_existing_thing(session, None, "ark:/1")
+    assert existing_thing is not None and "ark:/1" == existing_thing.id
+
+
+def test_get_existing_thing_saved_during_run(session: Session, index_path: str):
+    _add_some_things(session, 2, "authority")
+    index = refresh_identifier_index(session, index_path, "authority")
+    # The first time an identifier comes up the index says it's new, and the caller saves a Thing for it
+    assert get_existing_thing(session, index, "ark:/1") is None
+    _add_thing(session, "ark:/1", "authority", ["ark:/1"])
+    # So if it comes up again in the same run, the Thing has to be looked up rather than created again
+    existing_thing = get_existing_thing(session, index, "ark:/1")
+    assert existing_thing is not None and "ark:/1" == existing_thing.id
+    assert "ark:/1" not in index
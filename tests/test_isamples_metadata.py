@@ -5,6 +5,7 @@ from typing import Optional
 from unittest.mock import patch
 
 
+import h3 as h3_lib
 import pytest
 import typing
 import re
@@ -304,6 +305,28 @@ def test_geo_to_h3_none():
     assert h3 is None
 
 
+def test_geo_to_h3_all_resolutions():
+    h3_cells = Transformer.geo_to_h3_all_resolutions(32.253460, -110.911789)
+    assert len(h3_cells) == 16
+    assert h3_cells[15] == Transformer.geo_to_h3(32.253460, -110.911789, 15)
+    for resolution, h3_cell in enumerate(h3_cells):
+        assert h3_lib.get_resolution(h3_cell) == resolution
+        assert h3_lib.cell_to_parent(h3_cells[15], resolution) == h3_cell
+
+
+def test_geo_to_h3_all_resolutions_none():
+    assert Transformer.geo_to_h3_all_resolutions(None, None) is None
+
+
+def test_geo_to_h3_all_resolutions_batch():
+    coordinates = [(32.253460, -110.911789), (None, None), (-45.0, 170.5)]
+    h3_cells = Transformer.geo_to_h3_all_resolutions_batch(coordinates)
+    assert len(h3_cells) == 3
+    assert h3_cells[0] == Transformer.geo_to_h3_all_resolutions(32.253460, -110.911789)
+    assert h3_cells[1] is None
+    assert h3_cells[2] == Transformer.geo_to_h3_all_resolutions(-45.0, 170.5)
+
+
 def test_geome_geo_to_h3():
     test_file_path = "./test_data/GEOME/raw/ark-21547-Car2PIRE_0334.json"
     with open(test_file_path) as source_file:
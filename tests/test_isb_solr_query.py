@@ -1,7 +1,62 @@
-from isb_web.isb_solr_query import _solr_heatmap_geom_params_str, MIN_LAT, MAX_LAT, MIN_LON, MAX_LON
+import io
+import json
+
+from isb_web.isb_solr_query import _solr_heatmap_geom_params_str, MIN_LAT, MAX_LAT, MIN_LON, MAX_LON, \
+    ISBCoreSolrRecordIterator
 
 
 def test_solr_heat_geom_params_str():
     bb = {MIN_LAT: -90.0, MAX_LAT: 90.0, MIN_LON: -180.0, MAX_LON: 180.0}
     params_str = _solr_heatmap_geom_params_str(bb)
     assert "[-180.0 -90.0 TO 180.0 90.0]" == params_str
+
+
+class _FakeCursorResponse:
+    def __init__(self, body: dict):
+        self.status_code = 200
+        self.raw = io.BytesIO(json.dumps(body).encode("utf-8"))
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class _FakeCursorSession:
+    def __init__(self, pages: dict):
+        self.pages = pages
+        self.requests: list[dict] = []
+
+    def get(self, url, headers=None, params=None, stream=False):
+        self.requests.append(params)
+        docs, next_cursor_mark = self.pages[params["cursorMark"]]
+        return _FakeCursorResponse(
+            {"response": {"numFound": 5, "start": 0, "docs": docs}, "nextCursorMark": next_cursor_mark}
+        )
+
+
+def test_solr_record_iterator_cursor_mark():
+    pages = {
+        "*": ([{"id": "1", "x": 1.5}, {"id": "2", "nested": {"a": [1, 2]}}], "AoE1"),
+        "AoE1": ([{"id": "3"}, {"id": "4"}], "AoE2"),
+        "AoE2": ([{"id": "5"}], "AoE3"),
+    }
+    rsession = _FakeCursorSession(pages)
+    iterator = ISBCoreSolrRecordIterator(rsession, "source:SESAR", 2, 0, "producedBy_resultTime desc")
+    records = list(iterator)
+    assert ["1", "2", "3", "4", "5"] == [record["id"] for record in records]
+    assert 1.5 == records[0]["x"]
+    assert {"a": [1, 2]} == records[1]["nested"]
+    # The short last page ends the iteration without another request
+    assert ["*", "AoE1", "AoE2"] == [params["cursorMark"] for params in rsession.requests]
+    assert "producedBy_resultTime desc, id asc" == rsession.requests[0]["sort"]
+
+
+def test_solr_record_iterator_cursor_mark_unchanged_mark_ends():
+    pages = {
+        "*": ([{"id": "1"}, {"id": "2"}], "AoE1"),
+        "AoE1": ([], "AoE1"),
+    }
+    rsession = _FakeCursorSession(pages)
+    assert 2 == len(list(ISBCoreSolrRecordIterator(rsession, None, 2)))
+    assert "id asc" == rsession.requests[0]["sort"]
+    assert "*:*" == rsession.requests[0]["q"]
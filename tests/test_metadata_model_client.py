@@ -1,6 +1,12 @@
+import concurrent.futures
 from unittest.mock import patch, MagicMock
 
-from isamples_metadata.taxonomy.metadata_model_client import MODEL_SERVER_CLIENT, PredictionResult
+import pytest
+import requests
+
+from isamples_metadata.metadata_exceptions import MetadataException
+from isamples_metadata.taxonomy.metadata_model_client import MODEL_SERVER_CLIENT, ModelServerClient, PredictionResult
+from model_server_stub import ModelServerStub
 
 
 @patch("isamples_metadata.taxonomy.metadata_model_client.requests.session")
@@ -54,3 +60,48 @@ def _construct_mock_response(mock_request):
     }]
     mock_request.post.return_value = mock_response
     return expected_confidence, expected_value
+
+
+def _concurrent_requests(client: ModelServerClient, source_records: list[dict]) -> list:
+    with client.batching(max_batch_size=len(source_records), max_wait_seconds=1.0):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(source_records)) as executor:
+            material = executor.map(client.make_opencontext_material_request, source_records)
+            sample = executor.map(client.make_opencontext_sample_request, source_records)
+            return list(material) + list(sample)
+
+
+def test_batched_requests():
+    source_records = [{"id": i} for i in range(4)]
+    with ModelServerStub() as stub:
+        client = ModelServerClient(stub.base_url)
+        results = _concurrent_requests(client, source_records)
+        assert ['material:{"id": 0}', 'sample:{"id": 3}'] == [results[0][0].value, results[-1][0].value]
+        paths = sorted(path for path, _ in stub.requests)
+        # The material and sample predictions can't share a batch, but each type can be sent as one
+        assert 2 <= len(paths) <= 4
+        assert "/opencontext/batch" in paths
+        # Outside of batching(), requests go out one at a time
+        client.make_sesar_material_request({"id": 0})
+        assert "/sesar" == stub.requests[-1][0]
+
+
+def test_batched_requests_fallback():
+    source_records = [{"id": 0}, {"id": 1}, {"raise": True}]
+    with ModelServerStub(supports_batch=False) as stub:
+        client = ModelServerClient(stub.base_url)
+        with client.batching(max_batch_size=3, max_wait_seconds=1.0):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+                futures = [executor.submit(client.make_sesar_material_request, record) for record in source_records]
+                assert 'material:{"id": 1}' == futures[1].result()[0].value
+                with pytest.raises(MetadataException):
+                    futures[2].result()
+        assert 3 == len([path for path, _ in stub.requests if path == "/sesar"])
+
+
+def test_cache_shared_between_sessions():
+    with ModelServerStub() as stub:
+        client = ModelServerClient(stub.base_url)
+        client.make_sesar_material_request({"id": 0}, requests.session())
+        result = client.make_sesar_material_request({"id": 0}, requests.session())
+        assert 'material:{"id": 0}' == result[0].value
+        assert 1 == len(stub.requests)
@@ -0,0 +1,58 @@
+import concurrent.futures
+import os
+
+import pytest
+
+from isamples_metadata.taxonomy.metadata_model_client import ModelServerClient
+from isb_lib.prediction_store import PredictionStore
+from model_server_stub import ModelServerStub
+
+
+@pytest.fixture
+def db_url(tmp_path):
+    return f"sqlite:///{os.path.join(tmp_path, 'predictions.db')}"
+
+
+def test_prediction_store(db_url):
+    store = PredictionStore(db_url, {})
+    assert {} == store.get_many("sesar/material", ["a"])
+    store.put_many("sesar/material", {"a": [{"value": "rock", "confidence": 0.5}]})
+    assert {"a": [{"value": "rock", "confidence": 0.5}]} == store.get_many("sesar/material", ["a", "b"])
+    assert {} == store.get_many("opencontext/material", ["a"])
+    # A new model version doesn't see the old version's predictions
+    assert {} == PredictionStore(db_url, {"sesar/material": "2"}).get_many("sesar/material", ["a"])
+
+
+def test_client_uses_prediction_store(db_url):
+    with ModelServerStub() as stub:
+        client = ModelServerClient(stub.base_url)
+        client.prediction_store = PredictionStore(db_url, {})
+        client.make_sesar_material_request({"id": 0})
+        assert 1 == len(stub.requests)
+        # A fresh client, like a new process, gets the stored prediction without asking the model server
+        restarted_client = ModelServerClient(stub.base_url)
+        restarted_client.prediction_store = PredictionStore(db_url, {})
+        result = restarted_client.make_sesar_material_request({"id": 0})
+        assert 'material:{"id": 0}' == result[0].value
+        assert 1 == len(stub.requests)
+        # Upgrading the model invalidates its predictions
+        upgraded_client = ModelServerClient(stub.base_url)
+        upgraded_client.prediction_store = PredictionStore(db_url, {"sesar/material": "2"})
+        upgraded_client.make_sesar_material_request({"id": 0})
+        assert 2 == len(stub.requests)
+
+
+def test_batched_client_uses_prediction_store(db_url):
+    with ModelServerStub() as stub:
+        client = ModelServerClient(stub.base_url)
+        client.prediction_store = PredictionStore(db_url, {})
+        client.make_opencontext_material_request({"id": 0})
+        client.clear_cache()
+        source_records = [{"id": i} for i in range(3)]
+        with client.batching(max_batch_size=3, max_wait_seconds=1.0):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+                results = list(executor.map(client.make_opencontext_material_request, source_records))
+        assert ['material:{"id": 0}', 'material:{"id": 1}', 'material:{"id": 2}'] == [r[0].value for r in results]
+        # Only the records without a stored prediction were sent to the model server
+        sent = [params for _, body in stub.requests[1:] for params in (body if isinstance(body, list) else [body])]
+        assert [1, 2] == sorted(params["source_record"]["id"] for params in sent)
@@ -0,0 +1,283 @@
+import gzip
+import http.server
+import json
+import threading
+import time
+import zlib
+
+import pytest
+import requests
+
+import isb_lib.sitemaps.sitemap_fetcher
+from isb_lib.sitemaps.concurrency import AIMDConcurrencyLimiter, OrderedQueueWriter
+from isb_lib.sitemaps.sitemap_fetcher import ThingsFetcher
+
+
+def test_limiter_additive_increase():
+    limiter = AIMDConcurrencyLimiter(initial_limit=1, max_limit=3)
+    for _ in range(20):
+        limiter.release(limiter.acquire(), True)
+    assert 3 == limiter.limit
+    assert 20 == limiter.num_requests
+
+
+def test_limiter_multiplicative_decrease():
+    limiter = AIMDConcurrencyLimiter(initial_limit=8, max_limit=8)
+    started = [limiter.acquire() for _ in range(8)]
+    # All the requests in flight fail, but the limit only halves once for them
+    for start in started:
+        limiter.release(start, False)
+    assert 4 == limiter.limit
+    assert 8 == limiter.num_failures
+    assert 1 == limiter.num_decreases
+    limiter.release(limiter.acquire(), False)
+    limiter.release(limiter.acquire(), False)
+    limiter.release(limiter.acquire(), False)
+    assert 1 == limiter.limit
+
+
+def test_limiter_slow_responses_decrease():
+    limiter = AIMDConcurrencyLimiter(initial_limit=4, max_limit=4, latency_tolerance=2.0)
+    limiter.acquire()
+    limiter.release(time.monotonic() - 0.01, True, 10)
+    assert 4 == limiter.limit
+    limiter.acquire()
+    # Fifty times slower per unit of size than the first one
+    limiter.release(time.monotonic() - 0.5, True, 10)
+    assert 2 == limiter.limit
+    limiter.acquire()
+    # Much slower overall, but for a proportionally bigger request
+    limiter.release(time.monotonic() - 0.01, True, 10)
+    limiter.acquire()
+    limiter.release(time.monotonic() - 0.1, True, 100)
+    assert 2 < limiter.limit
+
+
+def test_limiter_blocks_at_limit():
+    limiter = AIMDConcurrencyLimiter(initial_limit=2, max_limit=2)
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def request():
+        nonlocal max_in_flight
+        started = limiter.acquire()
+        with lock:
+            max_in_flight = max(max_in_flight, limiter.in_flight)
+        time.sleep(0.01)
+        limiter.release(started, True)
+
+    threads = [threading.Thread(target=request) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 2 == max_in_flight
+    assert 0 == limiter.in_flight
+
+
+def test_ordered_queue_writer():
+    written = []
+    writer = OrderedQueueWriter(written.append, max_pending=4)
+    sequence_numbers = [writer.reserve() for _ in range(4)]
+    for sequence_number in reversed(sequence_numbers):
+        writer.put(sequence_number, sequence_number)
+    # Slots are freed as results are written
+    fifth = writer.reserve()
+    writer.put(fifth, None)
+    sixth = writer.reserve()
+    writer.put(sixth, sixth)
+    writer.close()
+    assert [0, 1, 2, 3, 5] == written
+
+
+def test_ordered_queue_writer_error():
+    def fail(result):
+        raise ValueError(result)
+
+    writer = OrderedQueueWriter(fail, max_pending=1)
+    writer.put(writer.reserve(), "first")
+    with pytest.raises(ValueError):
+        writer.reserve()
+    with pytest.raises(ValueError):
+        writer.close()
+
+
+class _FlakyThingsHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.num_requests += 1
+        if self.server.num_requests == 1:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        response = json.dumps(
+            [{"id": identifier, "primary_key": i} for i, identifier in enumerate(body["identifiers"])]
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_things_fetcher_reports_to_limiter():
+    server = http.server.HTTPServer(("127.0.0.1", 0), _FlakyThingsHandler)
+    server.num_requests = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        limiter = AIMDConcurrencyLimiter(initial_limit=4, max_limit=4)
+        url = f"http://127.0.0.1:{server.server_address[1]}/things"
+        fetcher = ThingsFetcher(url, "sitemap-1.xml", {"a", "b"}, requests.session(), limiter).fetch_things()
+        assert {"a", "b"} == {thing["id"] for thing in fetcher.json_things}
+        assert 2 == limiter.num_requests
+        assert 1 == limiter.num_failures
+        assert 2 < limiter.limit < 4
+        assert 0 == limiter.in_flight
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class _NDJSONThingsHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        assert "application/x-ndjson" in self.headers["Accept"]
+        lines = "".join(
+            json.dumps({"id": identifier, "primary_key": i}) + "\n" for i, identifier in enumerate(body["identifiers"])
+        )
+        response = gzip.compress(lines.encode("utf-8"))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_things_fetcher_ndjson(monkeypatch):
+    monkeypatch.setattr(isb_lib.sitemaps.sitemap_fetcher, "MAX_QUEUED_PAGES", 2)
+    server = http.server.HTTPServer(("127.0.0.1", 0), _NDJSONThingsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/things"
+        identifiers = {str(i) for i in range(1000)}
+        fetcher = ThingsFetcher(url, "sitemap-1.xml", identifiers, requests.session()).fetch_things()
+        assert fetcher.fetched
+        # Nobody was consuming, so most of the things were kept in the temporary file
+        assert fetcher._spool is not None
+        json_things = [thing["id"] for thing in fetcher.iter_json_things()]
+        assert identifiers == set(json_things)
+        assert len(identifiers) == len(json_things)
+        # Things are handed over once
+        assert [] == list(fetcher.iter_json_things())
+        fetcher.close()
+        assert [] == list(fetcher.iter_json_things())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _serve(handler_class: type) -> http.server.ThreadingHTTPServer:
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+    server.num_requests = 0  # type: ignore[attr-defined]
+    server.resume = threading.Event()  # type: ignore[attr-defined]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class _SlowNDJSONThingsHandler(http.server.BaseHTTPRequestHandler):
+    """Streams the things in chunks like the /things endpoint, but only sends the second half once the test says so"""
+
+    protocol_version = "HTTP/1.1"
+
+    def _write_chunk(self, chunk: bytes):
+        if len(chunk) > 0:
+            self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+            self.wfile.flush()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        identifiers = sorted(body["identifiers"], key=int)
+        for i, identifier in enumerate(identifiers):
+            self._write_chunk(compressor.compress((json.dumps({"id": identifier}) + "\n").encode("utf-8")))
+            if i == len(identifiers) // 2 - 1:
+                self._write_chunk(compressor.flush(zlib.Z_SYNC_FLUSH))
+                self.server.resume.wait(timeout=10)
+        self._write_chunk(compressor.flush())
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_things_fetcher_hands_over_things_as_they_arrive():
+    server = _serve(_SlowNDJSONThingsHandler)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/things"
+        identifiers = {str(i) for i in range(1000)}
+        fetcher = ThingsFetcher(url, "sitemap-1.xml", identifiers, requests.session())
+        fetch = threading.Thread(target=fetcher.fetch_things)
+        fetch.start()
+        json_things = fetcher.iter_json_things()
+        # The first things are consumed while the server is still holding back the rest
+        first = [next(json_things)["id"] for _ in range(400)]
+        assert [str(i) for i in range(400)] == first
+        server.resume.set()
+        assert [str(i) for i in range(400, 1000)] == [thing["id"] for thing in json_things]
+        fetch.join()
+        assert fetcher.fetched
+        assert fetcher._spool is None
+    finally:
+        server.resume.set()
+        server.shutdown()
+        server.server_close()
+
+
+class _TruncatingThingsHandler(http.server.BaseHTTPRequestHandler):
+    """Breaks off the first response part of the way through"""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.num_requests += 1
+        lines = [json.dumps({"id": identifier}) + "\n" for identifier in sorted(body["identifiers"], key=int)]
+        response = "".join(lines).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        if self.server.num_requests == 1:
+            response = "".join(lines[:550]).encode("utf-8")
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_things_fetcher_retries_truncated_response():
+    server = _serve(_TruncatingThingsHandler)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/things"
+        identifiers = {str(i) for i in range(1000)}
+        fetcher = ThingsFetcher(url, "sitemap-1.xml", identifiers, requests.session()).fetch_things()
+        assert fetcher.fetched
+        assert 2 == server.num_requests
+        # The things handed over before the response broke off aren't handed over again
+        assert [str(i) for i in range(1000)] == [thing["id"] for thing in fetcher.iter_json_things()]
+    finally:
+        server.shutdown()
+        server.server_close()
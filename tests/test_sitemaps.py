@@ -1,5 +1,7 @@
 import asyncio
 import datetime
+import gzip
+import io
 import json
 import os.path
 import tempfile
@@ -7,11 +9,16 @@ import tempfile
 import lxml
 import pytest
 import requests
+from sqlmodel import SQLModel, Session, create_engine
+from sqlmodel.pool import StaticPool
 
 from isb_lib.sitemaps import SitemapIndexEntry, ThingSitemapIndexEntry, UrlSetEntry, ThingUrlSetEntry, \
-    write_urlset_file, write_sitemap_index_file, INDEX_XML, build_sitemap, SiteMap
+    write_urlset_file, write_sitemap_index_file, INDEX_XML, build_sitemap, SiteMap, SiteMapStreamIterator, \
+    iter_sitemap_chunks, iterparse_sitemap
 from isb_lib.sitemaps.gh_pages_sitemap import GHPagesSitemapIndexIterator
-from test_utils import LocalFileAdapter
+from isb_lib.sitemaps.thing_sitemap import ThingSitemapBuilder
+from isb_web.sqlmodel_database import get_thing_with_id
+from test_utils import LocalFileAdapter, _add_some_things
 
 
 def test_sitemap_index_entry():
@@ -93,3 +100,120 @@ def test_sitemap_scan_items(local_file_requests_session):
                       local_file_requests_session, local_url_path)
     for item in sitemap.scanItems():
         assert item is not None
+
+
+def _urlset_response(num_urls: int, gzipped: bool) -> requests.Response:
+    urls = "".join(
+        f"<url><loc>https://example.org/thing/{i}</loc><lastmod>2022-01-01T09:40:28Z</lastmod></url>\n"
+        for i in range(num_urls)
+    )
+    body = f'<?xml version="1.0"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>'.encode()
+    if gzipped:
+        body = gzip.compress(body)
+    response = requests.Response()
+    response.status_code = 200
+    response.url = "https://example.org/sitemap-0.xml.gz" if gzipped else "https://example.org/sitemap-0.xml"
+    response.raw = io.BytesIO(body)
+    return response
+
+
+def test_iterparse_sitemap(local_file_requests_session):
+    file_url = f"file://{os.path.join(os.getcwd(), 'test_data/sitemaps/test_sitemap_index.xml')}"
+    entries = list(iterparse_sitemap(local_file_requests_session.get(file_url, stream=True)))
+    assert [
+        ("test_data/sitemaps/sitemap-0.xml", "2017-02-11T02:00:00Z"),
+        ("test_data/sitemaps/sitemap-1.xml", "2022-01-01T09:40:28Z"),
+    ] == entries
+
+
+@pytest.mark.parametrize("gzipped", [False, True])
+def test_sitemap_stream_iterator(gzipped: bool):
+    iterator = SiteMapStreamIterator(iter_sitemap_chunks(_urlset_response(50000, gzipped), chunk_size=4096))
+    assert "urlset" == iterator.type
+    num_entries = 0
+    for entry in iterator:
+        assert f"https://example.org/thing/{num_entries}" == entry["loc"]
+        # entries that have been yielded are dropped from the tree, which only holds the rest of the current chunk
+        assert iterator._root is not None and len(iterator._root) <= 100
+        num_entries += 1
+    assert 50000 == num_entries
+
+
+def test_sitemap_stream_iterator_truncated_gzip():
+    response = _urlset_response(1000, True)
+    body = response.raw.getvalue()
+    response.raw = io.BytesIO(body[: len(body) // 2])
+    locs = [loc for loc, lastmod in iterparse_sitemap(response)]
+    assert 0 < len(locs) < 1000
+    assert "https://example.org/thing/0" == locs[0]
+
+
+def test_sitemap_stream_iterator_empty():
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(b"")
+    assert SiteMapStreamIterator(iter_sitemap_chunks(response)).type is None
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def _sitemap_locs(path: str) -> list[str]:
+    with open(os.path.join(path, INDEX_XML), "rb") as index_file:
+        sitemap_locs = [loc for loc, lastmod in iterparse_sitemap(_file_response(index_file.read()))]
+    locs: list[str] = []
+    for sitemap_loc in sitemap_locs:
+        with open(os.path.join(path, os.path.basename(sitemap_loc)), "rb") as sitemap_file:
+            locs.extend(loc for loc, lastmod in iterparse_sitemap(_file_response(sitemap_file.read())))
+    return locs
+
+
+def _file_response(body: bytes) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(body)
+    return response
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_thing_sitemap_builder_incremental(session: Session, compress: bool):
+    path = tempfile.mkdtemp()
+    host = "https://hyde.cyverse.org"
+    _add_some_things(session, 10, "authority")
+    builder = ThingSitemapBuilder(session, path, host, num_things_per_file=3, compress=compress)
+    assert 4 == builder.build(incremental=True)
+    extension = ".xml.gz" if compress else ".xml"
+    assert os.path.exists(os.path.join(path, f"sitemap-3{extension}"))
+    assert 10 == len(_sitemap_locs(path))
+    # Nothing changed, only the partially filled last file is rewritten
+    assert 1 == builder.build(incremental=True)
+    # Saving a thing moves it to the end, so the files from the one it was in onwards change
+    thing = get_thing_with_id(session, "4")
+    assert thing is not None
+    thing.tstamp = datetime.datetime.now()
+    session.add(thing)
+    session.commit()
+    assert 3 == builder.build(incremental=True)
+    locs = _sitemap_locs(path)
+    assert f"{host}/thing/4?full=false&format=core" == locs[-1]
+    # The result is the same as a full rebuild
+    full_path = tempfile.mkdtemp()
+    ThingSitemapBuilder(session, full_path, host, num_things_per_file=3, compress=compress).build()
+    assert _sitemap_locs(full_path) == locs
+
+
+def test_thing_sitemap_builder_removes_stale_files(session: Session):
+    path = tempfile.mkdtemp()
+    _add_some_things(session, 10, "authority")
+    ThingSitemapBuilder(session, path, "https://hyde.cyverse.org", num_things_per_file=3).build()
+    # A different file size means nothing can be reused, and the extra files are no longer listed
+    assert 2 == ThingSitemapBuilder(session, path, "https://hyde.cyverse.org", num_things_per_file=5).build(True)
+    assert not os.path.exists(os.path.join(path, "sitemap-3.xml"))
+    assert 10 == len(_sitemap_locs(path))
@@ -0,0 +1,123 @@
+import io
+import json
+import os
+from unittest.mock import patch
+
+import pytest
+
+from isb_lib.solr_backfill import SolrBackfill, atomic_update_document
+
+
+class _FakeCursorResponse:
+    def __init__(self, body: dict):
+        self.status_code = 200
+        self.raw = io.BytesIO(json.dumps(body).encode("utf-8"))
+
+    def close(self):
+        pass
+
+
+class _FakeSolrSession:
+    def __init__(self, pages: dict):
+        self.pages = pages
+        self.cursor_marks: list[str] = []
+
+    def get(self, url, headers=None, params=None, stream=False):
+        self.cursor_marks.append(params["cursorMark"])
+        docs, next_cursor_mark = self.pages[params["cursorMark"]]
+        return _FakeCursorResponse({"response": {"docs": docs}, "nextCursorMark": next_cursor_mark})
+
+
+PAGES = {
+    "*": ([{"id": "1", "x": 1}, {"id": "2", "x": 2}], "AoE1"),
+    "AoE1": ([{"id": "3", "x": 3}, {"id": "4", "x": 4, "_root_": "3"}], "AoE2"),
+    "AoE2": ([{"id": "5", "x": 5}], "AoE3"),
+}
+
+
+def _double_odd_x(record: dict):
+    if record["x"] % 2 == 0:
+        return None
+    return {"x": record["x"] * 2, "old_field": None}
+
+
+def _double_odd_x_page(records: list[dict]):
+    return [_double_odd_x(record) for record in records]
+
+
+def _run_backfill(pages: dict, checkpoint_path: str, compute_fields=_double_odd_x, **kwargs):
+    rsession = _FakeSolrSession(pages)
+    posted: list[dict] = []
+    with patch("isb_lib.solr_backfill.requests.session", return_value=rsession), \
+            patch("isb_lib.core.solrAddRecords", side_effect=lambda _, updates, __: posted.extend(updates)), \
+            patch("isb_lib.core.solrCommit") as solr_commit:
+        backfill = SolrBackfill(
+            "http://localhost:8983/solr/isb_core_records/", "*:*", compute_fields, fields=["x"], page_size=2,
+            batch_size=1, workers=2, checkpoint_path=checkpoint_path, **kwargs
+        )
+        checkpoint = backfill.run()
+    return checkpoint, posted, rsession, solr_commit
+
+
+def test_atomic_update_document():
+    update = atomic_update_document({"id": "child", "_root_": "parent", "x": 1}, {"x": 2, "y": None})
+    assert {"id": "child", "_root_": "parent", "x": {"set": 2}, "y": {"set": None}} == update
+    assert "_root_" not in atomic_update_document({"id": "parent", "_root_": "parent"}, {"x": 2})
+
+
+def test_solr_backfill(tmp_path):
+    checkpoint_path = os.path.join(tmp_path, "checkpoint.json")
+    checkpoint, posted, rsession, solr_commit = _run_backfill(PAGES, checkpoint_path)
+    assert ["1", "3", "5"] == sorted(update["id"] for update in posted)
+    assert {"id": "3", "x": {"set": 6}, "old_field": {"set": None}} in posted
+    assert 5 == checkpoint.num_visited
+    assert 3 == checkpoint.num_updated
+    assert checkpoint.complete
+    assert 1 == solr_commit.call_count
+    with open(checkpoint_path) as checkpoint_file:
+        saved = json.load(checkpoint_file)
+    assert saved["complete"]
+    assert "AoE3" == saved["cursor_mark"]
+
+
+def test_solr_backfill_page_fields(tmp_path):
+    checkpoint_path = os.path.join(tmp_path, "checkpoint.json")
+    checkpoint, posted, _, _ = _run_backfill(PAGES, checkpoint_path, None, compute_page_fields=_double_odd_x_page)
+    assert ["1", "3", "5"] == sorted(update["id"] for update in posted)
+    assert {"id": "3", "x": {"set": 6}, "old_field": {"set": None}} in posted
+    assert 5 == checkpoint.num_visited
+    assert 3 == checkpoint.num_updated
+    with pytest.raises(ValueError):
+        SolrBackfill("http://localhost:8983/solr/isb_core_records/", "*:*", _double_odd_x,
+                     compute_page_fields=_double_odd_x_page)
+
+
+def test_solr_backfill_dry_run(tmp_path):
+    checkpoint_path = os.path.join(tmp_path, "checkpoint.json")
+    checkpoint, posted, _, solr_commit = _run_backfill(PAGES, checkpoint_path, dry_run=True)
+    assert 0 == len(posted)
+    assert 0 == solr_commit.call_count
+    assert 3 == checkpoint.num_updated
+    assert not os.path.exists(checkpoint_path)
+
+
+def test_solr_backfill_resume(tmp_path):
+    checkpoint_path = os.path.join(tmp_path, "checkpoint.json")
+    # Fetching the last page fails, so at most the first two are checkpointed
+    failing_pages = dict(PAGES)
+    del failing_pages["AoE2"]
+    with pytest.raises(KeyError):
+        _run_backfill(failing_pages, checkpoint_path)
+    checkpoint, posted, rsession, _ = _run_backfill(PAGES, checkpoint_path, resume=True)
+    assert "AoE2" == rsession.cursor_marks[-1]
+    assert "5" in [update["id"] for update in posted]
+    assert 5 == checkpoint.num_visited
+    assert 3 == checkpoint.num_updated
+
+
+def test_solr_backfill_resume_wrong_query(tmp_path):
+    checkpoint_path = os.path.join(tmp_path, "checkpoint.json")
+    _run_backfill(PAGES, checkpoint_path)
+    with pytest.raises(ValueError):
+        SolrBackfill("http://localhost:8983/solr/isb_core_records/", "source:SESAR", _double_odd_x, resume=True,
+                     checkpoint_path=checkpoint_path)
@@ -0,0 +1,84 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import isb_web.isb_solr_query
+from isb_web.solr_client import AsyncSolrClient
+
+
+def _solr_handler(request: httpx.Request) -> httpx.Response:
+    if request.url.path.startswith("/missing"):
+        return httpx.Response(404, text="Not Found")
+    docs = [{"id": value} for value in request.url.params.get_list("q")]
+    return httpx.Response(200, json={"response": {"numFound": len(docs), "docs": docs}})
+
+
+@pytest.fixture
+def solr_client() -> AsyncSolrClient:
+    return AsyncSolrClient(transport=httpx.MockTransport(_solr_handler))
+
+
+async def _read_streaming_response(response) -> bytes:
+    sent = []
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    await response({"type": "http"}, receive, send)
+    return b"".join(message.get("body", b"") for message in sent if message["type"] == "http.response.body")
+
+
+def test_stream(solr_client: AsyncSolrClient):
+    async def stream():
+        response = await solr_client.stream("GET", "http://solr/select", "application/json", params=[["q", "a"], ["q", "b"]])
+        return response.status_code, response.media_type, await _read_streaming_response(response)
+
+    status_code, media_type, body = asyncio.run(stream())
+    assert 200 == status_code
+    assert "application/json" == media_type
+    assert ["a", "b"] == [doc["id"] for doc in json.loads(body)["response"]["docs"]]
+
+
+def test_stream_passes_on_solr_status(solr_client: AsyncSolrClient):
+    async def stream():
+        response = await solr_client.stream("GET", "http://solr/missing", "application/json")
+        return response.status_code, await _read_streaming_response(response)
+
+    assert (404, b"Not Found") == asyncio.run(stream())
+
+
+def test_client_reused_within_loop(solr_client: AsyncSolrClient):
+    async def clients():
+        first = solr_client.client
+        await solr_client.get("http://solr/select")
+        return first, solr_client.client
+
+    first, second = asyncio.run(clients())
+    assert first is second
+    # Connections belong to their loop, so another loop gets a new client
+    third, _ = asyncio.run(clients())
+    assert third is not first
+
+
+def test_aclose(solr_client: AsyncSolrClient):
+    async def close():
+        client = solr_client.client
+        await solr_client.aclose()
+        return client
+
+    assert asyncio.run(close()).is_closed
+
+
+def test_async_solr_get_record(monkeypatch, solr_client: AsyncSolrClient):
+    monkeypatch.setattr(isb_web.isb_solr_query, "BASE_URL", "http://solr/solr/isb_core_records/")
+    monkeypatch.setattr(isb_web.isb_solr_query, "SOLR_CLIENT", solr_client)
+    status, doc = asyncio.run(isb_web.isb_solr_query.async_solr_get_record("ark:/123"))
+    assert 200 == status
+    assert {"id": "id:ark\\:/123"} == doc
+    monkeypatch.setattr(isb_web.isb_solr_query, "BASE_URL", "http://solr/missing/")
+    assert (404, None) == asyncio.run(isb_web.isb_solr_query.async_solr_get_record("ark:/123"))
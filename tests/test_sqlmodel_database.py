@@ -5,27 +5,36 @@ import pytest
 
 from isb_lib.models.export_job import ExportJob
 from isb_lib.models.namespace import Namespace
+from isb_lib.models.solr_import_checkpoint import SolrImportCheckpoint
 from sqlalchemy.orm.attributes import flag_modified
 from sqlmodel import Session, SQLModel, create_engine
 from sqlmodel.pool import StaticPool
 
 from isb_lib.core import ThingRecordIterator
 from isb_lib.models.taxonomy_name import TaxonomyName
-from isb_lib.models.thing import Thing, Point
+from isb_lib.models.thing import Thing, ThingIdentifier, Point
 from isb_web.sqlmodel_database import (
     get_thing_with_id,
+    get_thing_tstamp_with_id,
     read_things_summary,
     last_time_thing_created,
     paged_things_with_ids,
+    stream_things_with_ids,
+    stream_thing_dicts_with_ids,
     save_thing,
     things_for_sitemap,
+    stream_things_for_sitemap,
+    count_things_for_sitemap,
     mark_thing_not_found,
     save_or_update_thing,
     get_things_with_ids, insert_identifiers, all_thing_identifiers, get_thing_identifiers_for_thing,
     h3_values_without_points, h3_to_height, all_thing_primary_keys, save_draft_thing_with_id, save_person_with_orcid_id,
     all_orcid_ids, mint_identifiers_in_namespace, save_or_update_namespace, save_taxonomy_name,
     taxonomy_name_to_kingdom_map, kingdom_for_taxonomy_name, get_thing_meta, things_by_authority_count_dict,
-    save_or_update_export_job, export_job_with_uuid,
+    save_or_update_export_job, export_job_with_uuid, solr_document_digests, save_solr_document_digests,
+    solr_import_checkpoint, save_solr_import_checkpoint, thing_primary_key_shard_bounds, transform_cache_entries,
+    save_transform_cache_entries, model_predictions, save_model_predictions, taxonomy_name_rows,
+    upsert_things, DatabaseBulkUpdater, _copy_text_value,
 )
 from test_utils import _add_some_things
 
@@ -133,6 +142,31 @@ def test_paged_things_with_ids(session: Session):
     assert 15 == len(all_things)
 
 
+def test_stream_things_with_ids(session: Session):
+    authority = "test_authority"
+    old_tcreated = datetime.datetime(1978, month=11, day=22)
+    _add_some_things(session, 10, authority, old_tcreated)
+    now = datetime.datetime.now()
+    _add_some_things(session, 5, authority, now)
+    assert 15 == len(list(stream_things_with_ids(session, authority, yield_per=4)))
+    assert 5 == len(list(stream_things_with_ids(session, authority, min_time_created=now, yield_per=4)))
+    rows = list(stream_things_with_ids(session, authority, min_id=9, columns=["primary_key", "h3"], yield_per=4))
+    assert 6 == len(rows)
+    assert 10 == rows[0].primary_key
+    assert rows[0].h3 is None
+
+
+def test_thing_primary_key_shard_bounds(session: Session):
+    _add_some_things(session, 10, "test")
+    _add_some_things(session, 5, "other")
+    assert [3, 6, 8, 10] == thing_primary_key_shard_bounds(session, 4, "test")
+    assert [8, 15] == thing_primary_key_shard_bounds(session, 2)
+    # Fewer things than shards
+    assert [11, 12, 13, 14, 15] == thing_primary_key_shard_bounds(session, 8, "other")
+    things = list(stream_things_with_ids(session, "test", min_id=3, max_id=6))
+    assert [4, 5, 6] == [thing.primary_key for thing in things]
+
+
 def test_things_for_sitemap(session: Session):
     authority = "test"
     _add_some_things(session, 20, authority)
@@ -158,6 +192,19 @@ def test_things_for_sitemap(session: Session):
         assert new_thing[1] >= last_tstamp
 
 
+def test_stream_things_for_sitemap(session: Session):
+    _add_some_things(session, 10, "test")
+    _add_some_things(session, 5, "different")
+    things = list(stream_things_for_sitemap(session, "test", yield_per=3))
+    assert [str(i) for i in range(10)] == [thing[0] for thing in things]
+    assert things == sorted(things, key=lambda thing: (thing[1], thing[2]))
+    position = (things[3][1], things[3][2])
+    assert things[4:] == list(stream_things_for_sitemap(session, "test", after=position))
+    assert 4 == count_things_for_sitemap(session, "test", through=position)
+    assert 10 == count_things_for_sitemap(session, "test")
+    assert 15 == count_things_for_sitemap(session)
+
+
 def test_thing_iterator(session: Session):
     authority_id = "test"
     num_things = 10
@@ -170,6 +217,46 @@ def test_thing_iterator(session: Session):
     assert num_things == count_iterated_things
 
 
+def test_thing_iterator_cursor(session: Session):
+    authority_id = "test"
+    num_things = 10
+    _add_some_things(session, num_things, authority_id, None)
+    iterator = ThingRecordIterator(session, authority_id, 200, 3, 0, None)
+    things = list(iterator.yieldRecordsByCursor())
+    assert num_things == len(things)
+    assert all(type(thing) is Thing for thing in things)
+    assert [thing.primary_key for thing in things] == sorted(thing.primary_key for thing in things)
+    # Streamed things aren't tracked by the session
+    assert all(thing not in session for thing in things)
+
+
+def test_thing_iterator_cursor_columns(session: Session):
+    authority_id = "test"
+    _add_some_things(session, 10, authority_id, None)
+    iterator = ThingRecordIterator(session, authority_id, 200, 3, 0, 4)
+    rows = list(iterator.yieldRecordsByCursor(columns=["id", "resolved_content"]))
+    assert 4 == len(rows)
+    assert {"foo": "bar"} == rows[0].resolved_content
+    assert "0" == rows[0].id
+    # Resuming the same iterator continues after the last primary key it yielded
+    iterator = ThingRecordIterator(session, authority_id, 200, 3, rows[-1].primary_key)
+    remaining = list(iterator.yieldRecordsByCursor(columns=["id"]))
+    assert ["4", "5", "6", "7", "8", "9"] == [row.id for row in remaining]
+
+
+def test_thing_iterator_pages(session: Session):
+    authority_id = "test"
+    _add_some_things(session, 10, authority_id, None)
+    iterator = ThingRecordIterator(session, authority_id, 200, 3, 0, 8)
+    pages = list(iterator.yieldPagesOfRecords())
+    assert [3, 3, 2] == [len(page) for page in pages]
+    assert [str(i) for i in range(8)] == [thing.id for page in pages for thing in page]
+    # Paged things aren't tracked by the session either
+    assert all(thing not in session for page in pages for thing in page)
+    iterator = ThingRecordIterator(session, authority_id, 200, 3, pages[-1][-1].primary_key)
+    assert [["8", "9"]] == [[thing.id for thing in page] for page in iterator.yieldPagesOfRecords()]
+
+
 def test_thing_with_identifier(session: Session):
     thing_id = "123456"
     new_thing = Thing(
@@ -397,6 +484,17 @@ def test_get_things_with_ids(session: Session):
     assert len(things) == 3
 
 
+def test_stream_thing_dicts_with_ids(session: Session):
+    _add_some_things(session, 10, "authority", datetime.datetime.now())
+    thing_dicts = list(stream_thing_dicts_with_ids(session, ["0", "1", "2", "nope"], yield_per=2))
+    assert {"0", "1", "2"} == {thing_dict["id"] for thing_dict in thing_dicts}
+    primary_keys = all_thing_primary_keys(session, "authority")
+    for thing_dict in thing_dicts:
+        assert primary_keys[thing_dict["id"]] == thing_dict["primary_key"]
+        assert "authority" == thing_dict["authority_id"]
+        assert isinstance(thing_dict["tcreated"], datetime.datetime)
+
+
 def test_get_thing_with_id_with_identifier(session: Session):
     _add_some_things(session, 10, "authority", datetime.datetime.now())
     guid = "12345"
@@ -411,6 +509,37 @@ def test_get_thing_with_id_with_identifier(session: Session):
     assert thing_with_identifier is not None
 
 
+def test_get_thing_with_id_exact_identifier(session: Session):
+    _add_some_things(session, 1, "authority", datetime.datetime.now())
+    existing_thing = get_thing_with_id(session, "0")
+    existing_thing.identifiers = ["0", "ark:/12345"]
+    session.commit()
+    assert existing_thing.primary_key == session.get(ThingIdentifier, "ark:/12345").thing_id
+    # Alternate identifiers match exactly, not as substrings of each other
+    assert get_thing_with_id(session, "ark:/123") is None
+    assert get_thing_with_id(session, "12345") is None
+    assert "0" == get_thing_with_id(session, "ark:/12345").id
+
+
+def test_get_thing_tstamp_with_id(session: Session):
+    _add_some_things(session, 1, "authority", datetime.datetime.now())
+    existing_thing = get_thing_with_id(session, "0")
+    existing_thing.identifiers = ["0", "ark:/0"]
+    session.commit()
+    assert existing_thing.tstamp == get_thing_tstamp_with_id(session, "0")
+    assert existing_thing.tstamp == get_thing_tstamp_with_id(session, "ark:/0")
+    assert get_thing_tstamp_with_id(session, "nope") is None
+
+
+def test_get_things_with_ids_with_identifiers(session: Session):
+    _add_some_things(session, 3, "authority", datetime.datetime.now())
+    existing_thing = get_thing_with_id(session, "2")
+    existing_thing.identifiers = ["2", "ark:/2"]
+    session.commit()
+    things = get_things_with_ids(session, ["0", "ark:/2", "2", "nope"])
+    assert ["0", "2"] == sorted(thing.id for thing in things)
+
+
 def test_all_thing_identifiers(session: Session):
     _add_some_things(session, 10, "authority", datetime.datetime.now())
     all_identifiers = all_thing_identifiers(session)
@@ -423,6 +552,48 @@ def test_all_thing_primary_keys(session: Session):
     assert 10 == len(all_primary_keys)
 
 
+def test_upsert_things(session: Session):
+    _add_some_things(session, 2, "authority", datetime.datetime.now())
+    primary_keys = all_thing_primary_keys(session)
+    things = [
+        {"id": "1", "primary_key": 12345, "authority_id": "authority", "resolved_url": "http://foo.bar/1", "resolved_content": {"v": 1}},
+        {"id": "2", "authority_id": "authority", "resolved_url": "http://foo.bar/2", "resolved_content": {"v": 2}},
+        {"id": "2", "authority_id": "authority", "resolved_url": "http://foo.bar/2", "resolved_content": {"v": 3}},
+    ]
+    assert (1, 1) == upsert_things(session, things)
+    assert primary_keys["1"] == get_thing_with_id(session, "1").primary_key
+    assert {"v": 1} == get_thing_with_id(session, "1").resolved_content
+    assert {"v": 3} == get_thing_with_id(session, "2").resolved_content
+    assert "http://foo.bar" == get_thing_with_id(session, "0").resolved_url
+    assert (0, 0) == upsert_things(session, [])
+    things = [
+        {"id": "3", "authority_id": "authority", "resolved_url": "http://foo.bar/3", "identifiers": '["3", "ark:/3"]'},
+    ]
+    assert (1, 0) == upsert_things(session, things)
+    assert "3" == get_thing_with_id(session, "ark:/3").id
+
+
+def test_database_bulk_updater(session: Session):
+    _add_some_things(session, 2, "authority", datetime.datetime.now())
+    updater = DatabaseBulkUpdater(session, "authority", 2, "application/json")
+    for i in range(1, 4):
+        updater.add_thing({"v": i}, str(i), "http://foo.bar", 200, None)
+    updater.finish()
+    assert 2 == updater.num_inserts
+    assert 1 == updater.num_updates
+    assert 4 == len(all_thing_primary_keys(session))
+    assert {"v": 1} == get_thing_with_id(session, "1").resolved_content
+    assert ["3"] == get_thing_with_id(session, "3").identifiers
+
+
+def test_copy_text_value():
+    assert "\\N" == _copy_text_value(None)
+    assert '{"a": "b\\\\tc"}' == _copy_text_value({"a": "b\tc"})
+    assert "a\\tb\\nc\\\\" == _copy_text_value("a\tb\nc\\")
+    assert "2023-01-02 03:04:05" == _copy_text_value(datetime.datetime(2023, 1, 2, 3, 4, 5))
+    assert "200" == _copy_text_value(200)
+
+
 def test_h3_values_without_points(session: Session):
     no_height = "8f3f6dadb58ad40"
     with_height = "8f3e6dca50120b3"
@@ -552,6 +723,15 @@ def test_kingdom_for_taxonomy_name(session: Session):
     assert "kingdom2" == kingdom
 
 
+def test_taxonomy_name_rows(session: Session):
+    _insert_test_taxonomy_names(session)
+    name0 = TaxonomyName()
+    name0.name = "Name0"
+    name0.kingdom = "kingdom0"
+    save_taxonomy_name(session, name0, True)
+    assert [("Name0", "kingdom0"), ("name1", "kingdom1"), ("name2", "kingdom2")] == list(taxonomy_name_rows(session))
+
+
 def test_save_export_job(session: Session):
     export_job = _create_test_export_job(session)
     assert export_job.primary_key is not None
@@ -580,3 +760,53 @@ def test_export_job_with_uuid(session: Session):
 def test_export_job_with_uuid_doesnt_exist(session: Session):
     shouldnt_exist = export_job_with_uuid(session, "foobar")
     assert shouldnt_exist is None
+
+
+def test_solr_document_digests(session: Session):
+    assert len(solr_document_digests(session, ["1", "2"])) == 0
+    save_solr_document_digests(session, "test", {"1": "digest1", "2": "digest2"}, [])
+    digests = solr_document_digests(session, ["1", "2", "3"])
+    assert digests == {"1": "digest1", "2": "digest2"}
+    save_solr_document_digests(session, "test", {"2": "new_digest2", "3": "digest3"}, digests.keys())
+    digests = solr_document_digests(session, ["1", "2", "3"])
+    assert digests == {"1": "digest1", "2": "new_digest2", "3": "digest3"}
+
+
+def test_solr_import_checkpoint(session: Session):
+    assert solr_import_checkpoint(session, "test") is None
+    checkpoint = SolrImportCheckpoint(name="test", authority_id="test", last_primary_key=10, failed_ids=[])
+    save_solr_import_checkpoint(session, checkpoint)
+    checkpoint.last_primary_key = 20
+    checkpoint.failed_ids = ["failed"]
+    save_solr_import_checkpoint(session, checkpoint)
+    saved_checkpoint = solr_import_checkpoint(session, "test")
+    assert saved_checkpoint.last_primary_key == 20
+    assert saved_checkpoint.failed_ids == ["failed"]
+    assert saved_checkpoint.tstamp is not None
+
+
+def test_transform_cache_entries(session: Session):
+    assert {} == transform_cache_entries(session, ["a", "b"])
+    save_transform_cache_entries(session, [
+        {"key": "a", "authority_id": "test", "identifier": "1", "content": {"label": "a"}},
+        {"key": "b", "authority_id": "test", "identifier": "2", "content": [{"id": "b"}]},
+    ])
+    # Keys that already have a row are left alone
+    save_transform_cache_entries(session, [
+        {"key": "a", "authority_id": "test", "identifier": "1", "content": {"label": "changed"}},
+        {"key": "c", "authority_id": "test", "identifier": "3", "content": {"label": "c"}},
+    ])
+    entries = transform_cache_entries(session, ["a", "b", "c", "d"])
+    assert {"a": {"label": "a"}, "b": [{"id": "b"}], "c": {"label": "c"}} == entries
+
+
+def test_model_predictions(session: Session):
+    assert {} == model_predictions(session, ["a"])
+    save_model_predictions(session, [
+        {"key": "a", "model_type": "sesar/material", "model_version": "0", "input_hash": "1", "prediction": []},
+    ])
+    save_model_predictions(session, [
+        {"key": "a", "model_type": "sesar/material", "model_version": "0", "input_hash": "1", "prediction": ["x"]},
+        {"key": "b", "model_type": "sesar/material", "model_version": "0", "input_hash": "2", "prediction": [{"v": 1}]},
+    ])
+    assert {"a": [], "b": [{"v": 1}]} == model_predictions(session, ["a", "b", "c"])
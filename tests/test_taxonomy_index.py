@@ -0,0 +1,73 @@
+import json
+import os
+import pickle
+
+import pytest
+
+from isamples_metadata.GEOMETransformer import GEOMETransformer
+from isamples_metadata.taxonomy.taxonomy_index import TaxonomyIndex, write_taxonomy_index
+
+ROWS = [
+    ("Abies", "Plantae"),
+    ("Mollusca", "Animalia"),
+    ("Mollusca", "Animalia"),
+    ("Quercus", "Plantae"),
+    ("Zea", "Fungi"),
+    ("Zea", "Plantae"),
+    ("Ölandia", "Animalia"),
+]
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    path = os.path.join(tmp_path, "taxonomy_index.bin")
+    assert 5 == write_taxonomy_index(path, ROWS)
+    return path
+
+
+def test_taxonomy_index(index_path):
+    with TaxonomyIndex(index_path) as index:
+        assert 5 == len(index)
+        assert "Plantae" == index.kingdom("Abies")
+        assert "Animalia" == index.kingdom("Mollusca")
+        assert "Animalia" == index.kingdom("Ölandia")
+        # The last of a repeated name wins
+        assert "Plantae" == index.kingdom("Zea")
+        # Kingdoms resolve to themselves
+        assert "Fungi" == index.kingdom("Fungi")
+        assert index.kingdom("Homo") is None
+        assert index.kingdom("") is None
+        assert "Quercus" in index
+        assert "quercus" not in index
+
+
+def test_taxonomy_index_empty(tmp_path):
+    path = os.path.join(tmp_path, "empty.bin")
+    assert 0 == write_taxonomy_index(path, [])
+    with TaxonomyIndex(path) as index:
+        assert 0 == len(index)
+        assert index.kingdom("Abies") is None
+
+
+def test_taxonomy_index_unsorted(tmp_path):
+    path = os.path.join(tmp_path, "unsorted.bin")
+    with pytest.raises(ValueError):
+        write_taxonomy_index(path, [("Zea", "Plantae"), ("Abies", "Plantae")])
+    assert not os.path.exists(path)
+
+
+def test_taxonomy_index_pickle(index_path):
+    with TaxonomyIndex(index_path) as index:
+        with pickle.loads(pickle.dumps(index)) as unpickled:
+            assert "Plantae" == unpickled.kingdom("Quercus")
+
+
+def test_geome_transformer_kingdom(index_path):
+    with open("./test_data/GEOME/raw/ark-21547-Car2PIRE_0334.json") as source_file:
+        source_record = json.load(source_file)
+    assert GEOMETransformer(source_record).kingdom() is None
+    with TaxonomyIndex(index_path) as index:
+        transformer = GEOMETransformer(source_record, taxonomy_index=index)
+        assert "Animalia" == transformer.kingdom()
+        for child_transformer in transformer.child_transformers:
+            assert "Animalia" == child_transformer.kingdom()
@@ -0,0 +1,71 @@
+import pytest
+from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.pool import StaticPool
+
+from isamples_metadata.Transformer import Transformer
+from isb_lib.transform_cache import TransformCache, content_hash, transform_cache_key
+from isb_web.sqlmodel_database import transform_cache_entries
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def test_content_hash():
+    assert content_hash({"a": 1, "b": [1, 2]}) == content_hash({"b": [1, 2], "a": 1})
+    assert content_hash({"a": 1}) != content_hash({"a": 2})
+
+
+def test_transform_cache_key(monkeypatch):
+    digest = content_hash({"a": 1})
+    key = transform_cache_key("SESAR", "IGSN:1", digest, "core")
+    assert key == transform_cache_key("SESAR", "IGSN:1", digest, "core")
+    assert key != transform_cache_key("SESAR", "IGSN:2", digest, "core")
+    assert key != transform_cache_key("SESAR", "IGSN:1", digest, "solr")
+    monkeypatch.setattr(Transformer, "VERSION", Transformer.VERSION + 1)
+    assert key != transform_cache_key("SESAR", "IGSN:1", digest, "core")
+
+
+def test_transform_cache_lru():
+    cache = TransformCache(maxsize=2)
+    cache.put("a", "test", "1", {"label": "a"})
+    cache.put("b", "test", "2", {"label": "b"})
+    # Touch a so that b is the least recently used
+    assert {"label": "a"} == cache.get("a")
+    cache.put("c", "test", "3", {"label": "c"})
+    assert cache.get("b") is None
+    assert {"label": "c"} == cache.get("c")
+    assert 2 == cache.hits
+    assert 1 == cache.misses
+
+
+def test_transform_cache_returns_copies():
+    cache = TransformCache()
+    value = {"label": "a", "keywords": ["x"]}
+    cache.put("a", "test", "1", value)
+    value["keywords"].append("y")
+    cached = cache.get("a")
+    assert ["x"] == cached["keywords"]
+    cached["label"] = "changed"
+    assert "a" == cache.get("a")["label"]
+
+
+def test_transform_cache_persistent(session: Session):
+    cache = TransformCache(maxsize=0, persistent=True)
+    cache.put_many([("a", "test", "1", [{"id": "a"}]), ("b", "test", "2", [{"id": "b"}])], session)
+    assert ["a", "b"] == sorted(transform_cache_entries(session, ["a", "b"]).keys())
+    # A new process would only have the persistent tier
+    fresh_cache = TransformCache(persistent=True)
+    assert {"a": [{"id": "a"}]} == fresh_cache.get_many(["a", "c"], session)
+    assert {"b": [{"id": "b"}]} == fresh_cache.get_many(["b"], session)
+    # Without a session only the in-process tier is consulted
+    assert [{"id": "a"}] == fresh_cache.get("a")
+    assert TransformCache(persistent=True).get("a") is None
@@ -57,3 +57,13 @@ def test_vocabulary_fast_api_material_type(client: TestClient):
 def test_vocabulary_fast_api_sampled_feature_type(client: TestClient):
     response = client.get("/vocabulary/sampled_feature_type")
     assert response.status_code == 200
+
+
+def test_vocabulary_fast_api_not_modified(client: TestClient):
+    response = client.get("/vocabulary/material_type")
+    etag = response.headers["ETag"]
+    response = client.get("/vocabulary/material_type", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert etag == response.headers["ETag"]
+    response = client.get("/vocabulary/material_type", headers={"If-None-Match": '"other"'})
+    assert response.status_code == 200